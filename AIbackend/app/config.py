@@ -0,0 +1,236 @@
+import logging
+import os
+
+
+def _find_env_file() -> str:
+    """The nearest .env in the working directory or above this package, or an empty string"""
+    for start in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = start
+        while True:
+            candidate = os.path.join(path, ".env")
+            if os.path.isfile(candidate):
+                return candidate
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return ""
+
+
+# Load environment variables if .env file exists (python-dotenv is only imported when one does)
+_env_file = _find_env_file()
+if _env_file:
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(_env_file)
+    except Exception as e:
+        logging.warning(f"Could not load .env file: {e}")
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning(f"Invalid integer for {name}: {value!r}, using {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logging.warning(f"Invalid number for {name}: {value!r}, using {default}")
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_weights(name: str, default: str) -> dict:
+    """Read `name:weight,...` pairs with positive weights from the environment"""
+    weights = {}
+    for entry in (os.getenv(name) or default).split(","):
+        key, _, value = entry.partition(":")
+        if not key.strip():
+            continue
+        try:
+            weight = float(value)
+        except ValueError:
+            weight = 0.0
+        if weight <= 0:
+            logging.warning(f"Invalid weight in {name}: {entry!r}, ignoring it")
+            continue
+        weights[key.strip().lower()] = weight
+    return weights
+
+
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+)
+GEMINI_STREAM_URL = os.getenv(
+    "GEMINI_STREAM_URL",
+    GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent")
+)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+if not GEMINI_API_KEY:
+    logging.warning("GEMINI_API_KEY is not set. Please set your Gemini API key in environment variables.")
+
+# Upstream HTTP client
+UPSTREAM_HTTP2 = env_bool("UPSTREAM_HTTP2", True)
+UPSTREAM_MAX_CONNECTIONS = env_int("UPSTREAM_MAX_CONNECTIONS", 100)
+UPSTREAM_MAX_KEEPALIVE = env_int("UPSTREAM_MAX_KEEPALIVE", 20)
+UPSTREAM_KEEPALIVE_EXPIRY = env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0)
+UPSTREAM_CONNECT_TIMEOUT = env_float("UPSTREAM_CONNECT_TIMEOUT", 10.0)
+UPSTREAM_MAX_RETRIES = env_int("UPSTREAM_MAX_RETRIES", 3)
+UPSTREAM_RETRY_DELAY = env_float("UPSTREAM_RETRY_DELAY", 2.0)
+UPSTREAM_COALESCE = env_bool("UPSTREAM_COALESCE", True)
+
+# Upstream guard: quota bucket, adaptive concurrency and circuit breaker
+UPSTREAM_RATE_PER_SECOND = env_float("UPSTREAM_RATE_PER_SECOND", 10.0)  # 0 disables the bucket
+UPSTREAM_RATE_BURST = env_int("UPSTREAM_RATE_BURST", 20)
+UPSTREAM_CONCURRENCY_INITIAL = env_int("UPSTREAM_CONCURRENCY_INITIAL", 16)
+UPSTREAM_CONCURRENCY_MIN = env_int("UPSTREAM_CONCURRENCY_MIN", 2)
+UPSTREAM_CONCURRENCY_MAX = env_int("UPSTREAM_CONCURRENCY_MAX", 64)
+UPSTREAM_QUEUE_TIMEOUT = env_float("UPSTREAM_QUEUE_TIMEOUT", 10.0)
+BREAKER_FAILURE_THRESHOLD = env_float("BREAKER_FAILURE_THRESHOLD", 0.5)
+BREAKER_WINDOW = env_int("BREAKER_WINDOW", 20)
+BREAKER_MIN_CALLS = env_int("BREAKER_MIN_CALLS", 10)
+BREAKER_COOLDOWN = env_float("BREAKER_COOLDOWN", 30.0)
+BREAKER_HALF_OPEN_PROBES = env_int("BREAKER_HALF_OPEN_PROBES", 1)
+
+# Admission: weighted fair share of upstream slots per role (X-User-Role), round-robin
+# per client (X-Client-Id) within a role, and bounded wait queues (0 means unbounded)
+ADMISSION_ROLE_WEIGHTS = env_weights("ADMISSION_ROLE_WEIGHTS", "farmer:8,expert:4,supervisor:2,crp:1")
+ADMISSION_DEFAULT_ROLE = os.getenv("ADMISSION_DEFAULT_ROLE", "farmer").strip().lower()
+ADMISSION_QUEUE_MAX = env_int("ADMISSION_QUEUE_MAX", 200)  # Waiters per backend
+ADMISSION_CLIENT_QUEUE_MAX = env_int("ADMISSION_CLIENT_QUEUE_MAX", 20)
+# Shared secret a trusted caller (the Node backend) sends as X-Service-Token; only then are its
+# X-Client-Id and X-User-Role honoured, otherwise requests count as their peer address at the default role
+ADMISSION_SERVICE_TOKEN = os.getenv("ADMISSION_SERVICE_TOKEN")
+
+# Upstream backends: a JSON list, or the path of a JSON file holding one (see
+# services/backends.py); empty means the single Gemini backend configured above
+UPSTREAM_BACKENDS = os.getenv("UPSTREAM_BACKENDS", "")
+BACKEND_EWMA_ALPHA = env_float("BACKEND_EWMA_ALPHA", 0.2)
+BACKEND_ERROR_THRESHOLD = env_float("BACKEND_ERROR_THRESHOLD", 0.5)  # EWMA error rate marking a backend unhealthy
+BACKEND_PROBE_INTERVAL = env_float("BACKEND_PROBE_INTERVAL", 30.0)  # Seconds before an unhealthy backend is tried again
+# Send a second request to the next backend when the first outlives its backend's p95
+UPSTREAM_HEDGE = env_bool("UPSTREAM_HEDGE", False)
+UPSTREAM_HEDGE_MIN_SAMPLES = env_int("UPSTREAM_HEDGE_MIN_SAMPLES", 20)
+
+# /analyze fan-out deadlines (seconds); the total budget also bounds /text-query/stream
+ANALYZE_TEXT_DEADLINE = env_float("ANALYZE_TEXT_DEADLINE", 45.0)
+ANALYZE_VISION_DEADLINE = env_float("ANALYZE_VISION_DEADLINE", 75.0)
+ANALYZE_TOTAL_BUDGET = env_float("ANALYZE_TOTAL_BUDGET", 80.0)
+
+# Extra relevance keywords and phrase rewrites (JSON, per language), compiled at startup
+RESPONSE_RULES_PATH = os.getenv(
+    "RESPONSE_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_rules.json")
+)
+
+# Local agronomy knowledge index (BM25 over a curated question/answer corpus)
+KNOWLEDGE_ENABLED = env_bool("KNOWLEDGE_ENABLED", True)
+KNOWLEDGE_PATH = os.getenv(
+    "KNOWLEDGE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "agronomy_knowledge.json")
+)
+KNOWLEDGE_TOP_K = env_int("KNOWLEDGE_TOP_K", 3)  # Snippets added to the prompt
+# Answer from the corpus without a model call when the best document holds this
+# share of the query's term weight and outscores the runner-up by the margin
+KNOWLEDGE_DIRECT_COVERAGE = env_float("KNOWLEDGE_DIRECT_COVERAGE", 0.9)
+KNOWLEDGE_DIRECT_MARGIN = env_float("KNOWLEDGE_DIRECT_MARGIN", 1.5)
+KNOWLEDGE_GROUNDING_COVERAGE = env_float("KNOWLEDGE_GROUNDING_COVERAGE", 0.5)
+KNOWLEDGE_RELOAD_INTERVAL = env_float("KNOWLEDGE_RELOAD_INTERVAL", 30.0)  # 0 disables the file watch
+
+# Response cache
+CACHE_ENABLED = env_bool("CACHE_ENABLED", True)
+CACHE_MAX_ENTRIES = env_int("CACHE_MAX_ENTRIES", 1024)
+CACHE_TTL_SECONDS = env_float("CACHE_TTL_SECONDS", 24 * 3600.0)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join("data", "response_cache.sqlite3"))
+# Seconds a worker may keep serving from memory after another worker purged the cache
+CACHE_PURGE_CHECK_INTERVAL = env_float("CACHE_PURGE_CHECK_INTERVAL", 1.0)
+
+# Per-farmer conversation sessions (in-process, LRU + TTL)
+SESSION_ENABLED = env_bool("SESSION_ENABLED", True)
+SESSION_MAX_SESSIONS = env_int("SESSION_MAX_SESSIONS", 10000)
+SESSION_TTL_SECONDS = env_float("SESSION_TTL_SECONDS", 6 * 3600.0)
+SESSION_RECENT_TURNS = env_int("SESSION_RECENT_TURNS", 3)  # Turns kept verbatim; older ones are summarized
+SESSION_MAX_SUMMARIES = env_int("SESSION_MAX_SUMMARIES", 12)
+SESSION_ANSWER_CHARS = env_int("SESSION_ANSWER_CHARS", 600)  # Stored length of each recent answer
+SESSION_TOKEN_BUDGET = env_int("SESSION_TOKEN_BUDGET", 800)  # Conversation context plus the new query
+
+# Shared secret for /api/v1/admin endpoints; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Near-duplicate query matching
+SIMILARITY_ENABLED = env_bool("SIMILARITY_ENABLED", True)
+SIMILARITY_THRESHOLD = env_float("SIMILARITY_THRESHOLD", 0.8)
+SIMILARITY_NUM_PERM = env_int("SIMILARITY_NUM_PERM", 64)
+SIMILARITY_BANDS = env_int("SIMILARITY_BANDS", 16)
+SIMILARITY_MAX_ENTRIES = env_int("SIMILARITY_MAX_ENTRIES", 5000)
+
+# Perceptual-hash cache of image analyses
+IMAGE_CACHE_ENABLED = env_bool("IMAGE_CACHE_ENABLED", True)
+IMAGE_CACHE_MAX_DISTANCE = env_int("IMAGE_CACHE_MAX_DISTANCE", 6)
+IMAGE_CACHE_MAX_ENTRIES = env_int("IMAGE_CACHE_MAX_ENTRIES", 2000)
+
+# Image ingestion
+IMAGE_MAX_UPLOAD_BYTES = env_int("IMAGE_MAX_UPLOAD_BYTES", 10 * 1024 * 1024)
+IMAGE_MAX_DIMENSION = env_int("IMAGE_MAX_DIMENSION", 1024)
+# Largest decoded size accepted (width x height), checked from the header before decoding;
+# a small compressed PNG can otherwise expand to hundreds of MB
+IMAGE_MAX_PIXELS = env_int("IMAGE_MAX_PIXELS", 50_000_000)
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = env_int("IMAGE_QUALITY", 80)
+IMAGE_WORKERS = env_int("IMAGE_WORKERS", 2)
+IMAGE_MEMO_ENTRIES = env_int("IMAGE_MEMO_ENTRIES", 32)
+# Declared content types accepted for uploaded images; empty accepts any
+IMAGE_ALLOWED_TYPES = {
+    mime.strip().lower() for mime in os.getenv(
+        "IMAGE_ALLOWED_TYPES",
+        "image/jpeg,image/png,image/webp,image/gif,image/bmp,image/tiff,application/octet-stream"
+    ).split(",") if mime.strip()
+}
+QUERY_MAX_CHARS = env_int("QUERY_MAX_CHARS", 4000)
+
+# Asynchronous /analyze jobs
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = env_int("JOB_WORKERS", 2)
+JOB_QUEUE_MAX = env_int("JOB_QUEUE_MAX", 500)
+JOB_TTL_SECONDS = env_float("JOB_TTL_SECONDS", 24 * 3600.0)
+JOB_MAX_WAIT = env_float("JOB_MAX_WAIT", 30.0)  # Longest long-poll a client may ask for
+JOB_CALLBACK_TIMEOUT = env_float("JOB_CALLBACK_TIMEOUT", 10.0)
+JOB_CALLBACK_RETRIES = env_int("JOB_CALLBACK_RETRIES", 3)
+# Comma-separated hosts callbacks may target, private ones included; empty allows any host
+# that resolves only to public addresses
+JOB_CALLBACK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+# Bulk sync endpoint
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 100)
+BATCH_CONCURRENCY = env_int("BATCH_CONCURRENCY", 4)
+BATCH_MAX_BYTES = env_int("BATCH_MAX_BYTES", 64 * 1024 * 1024)
+
+# Startup warm-up and probes
+WARMUP_CONNECTIONS = env_bool("WARMUP_CONNECTIONS", True)  # Open a pooled connection to each backend at startup
+WARMUP_TIMEOUT = env_float("WARMUP_TIMEOUT", 60.0)  # Seconds each warm-up step may take
+READINESS_REQUIRES_UPSTREAM = env_bool("READINESS_REQUIRES_UPSTREAM", True)
+API_PROBE_TTL = env_float("API_PROBE_TTL", 300.0)  # Seconds a successful /test-api probe is reused
+API_PROBE_RETRY_INTERVAL = env_float("API_PROBE_RETRY_INTERVAL", 30.0)  # Seconds a failed probe is reused
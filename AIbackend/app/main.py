@@ -1,10 +1,25 @@
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from app.config import KNOWLEDGE_RELOAD_INTERVAL
+from app.schemas import FastJSONResponse, LivenessResponse, ReadinessResponse, StaticJSON
+from app.services import admission, metrics, probes
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Farmer Assistant AI",
     description="Professional AI assistant for agricultural guidance and crop analysis",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS
@@ -22,9 +37,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Include only the farmer assistant router
-from app.routers import farmerAssistant
+# Request timing and trace propagation (traceparent / X-Request-ID)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Attribute requests to a client and role (X-Client-Id / X-User-Role) for fair upstream scheduling
+app.add_middleware(admission.AdmissionMiddleware)
+
+# Include the farmer assistant and admin routers
+from app.routers import admin, farmerAssistant
+from app.services import ingest, upstream
+from app.services.cache import response_cache
+from app.services.jobs import job_queue
+from app.services.knowledge import knowledge_index
 app.include_router(farmerAssistant.router, prefix="/api/v1")
+app.include_router(admin.router, prefix="/api/v1")
+
+probes.warmup.record("import", time.perf_counter() - _import_started)
+_import_finished = time.perf_counter()
 
 @app.get("/")
 async def root():
@@ -34,10 +63,22 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "text_query": "/api/v1/farmer-assistant/text-query",
+            "text_query_stream": "/api/v1/farmer-assistant/text-query/stream",
             "image_analysis": "/api/v1/farmer-assistant/analyze",
+            "image_analysis_stream": "/api/v1/farmer-assistant/analyze/stream",
+            "image_analysis_jobs": "/api/v1/farmer-assistant/analyze/jobs",
+            "batch": "/api/v1/farmer-assistant/batch",
+            "sessions": "/api/v1/farmer-assistant/sessions/{session_id}",
             "health_check": "/api/v1/farmer-assistant/health",
             "capabilities": "/api/v1/farmer-assistant/capabilities",
-            "test_api": "/api/v1/farmer-assistant/test-api"
+            "test_api": "/api/v1/farmer-assistant/test-api",
+            "cache_admin": "/api/v1/admin/cache",
+            "jobs_admin": "/api/v1/admin/jobs",
+            "knowledge_admin": "/api/v1/admin/knowledge",
+            "sessions_admin": "/api/v1/admin/sessions",
+            "metrics": "/metrics",
+            "liveness": "/livez",
+            "readiness": "/readyz"
         }
     }
 
@@ -45,11 +86,59 @@ async def root():
 async def test():
     return {"message": "Farmer Assistant AI is working"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latencies, request counters and in-flight gauges in Prometheus text format"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+LIVE = StaticJSON(LivenessResponse())
+
+@app.get("/livez", response_model=LivenessResponse)
+async def liveness():
+    """Cheap liveness probe: the event loop is answering"""
+    return LIVE.response()
+
+@app.get("/readyz", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readiness():
+    """Readiness probe: 200 once warm-up has finished and an upstream backend is usable, 503 otherwise"""
+    ready, checks = probes.readiness()
+    body = ReadinessResponse(status="ready" if ready else "not_ready", checks=checks, warmup=probes.warmup.state())
+    return FastJSONResponse(body.model_dump(mode="json"), status_code=200 if ready else 503)
+
+async def load_knowledge():
+    await asyncio.to_thread(knowledge_index.load)
+    if knowledge_index.enabled and KNOWLEDGE_RELOAD_INTERVAL > 0:
+        app.state.knowledge_watch = asyncio.create_task(knowledge_index.watch(KNOWLEDGE_RELOAD_INTERVAL))
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_queue.start(farmerAssistant.run_analysis_job)
+
 @app.on_event("startup")
-async def print_routes():
-    print("🌾 Farmer Assistant AI Service Started")
-    print("Available routes:")
-    for route in app.routes:
-        if hasattr(route, 'path'):
-            print(f"  {route.path} - {route.methods}")
+async def start_warmup():
+    # Caches, indexes and upstream connections warm up while the server already
+    # answers liveness probes; /readyz reports ready once they are done
+    probes.warmup.start({
+        "modules": probes.preload_modules,
+        "similarity_index": farmerAssistant.warm_similarity_index,
+        "knowledge": load_knowledge,
+        "connections": probes.warm_connections,
+    })
+    probes.warmup.record("startup", time.perf_counter() - _import_finished)
+    logger.info(
+        f"Farmer Assistant AI Service started with {len(app.routes)} routes "
+        f"(import {probes.warmup.timings['import']:.2f}s, startup {probes.warmup.timings['startup']:.2f}s), "
+        "warming up in the background"
+    )
 
+@app.on_event("shutdown")
+async def close_upstream_client():
+    probes.warmup.stop()
+    await job_queue.stop()
+    job_queue.close()
+    watch = getattr(app.state, "knowledge_watch", None)
+    if watch is not None:
+        watch.cancel()
+    await upstream.aclose()
+    response_cache.close()
+    ingest.shutdown()
@@ -0,0 +1,140 @@
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query
+from typing import List, Optional
+import asyncio
+import hmac
+import logging
+
+from app.config import ADMIN_TOKEN, ADMISSION_ROLE_WEIGHTS
+from app.routers.farmerAssistant import PROMPT_VERSION
+from app.services import cache, ingest, similarity, upstream
+from app.services.backends import registry
+from app.services.cache import response_cache
+from app.services.image_hash import image_index
+from app.services.jobs import job_queue
+from app.services.knowledge import KnowledgeDoc, knowledge_index
+from app.services.sessions import session_store
+from app.services.similarity import similarity_index
+
+logger = logging.getLogger(__name__)
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Reject the request unless it carries the configured admin token.
+
+    Fails closed: without ADMIN_TOKEN the admin API is disabled, since it
+    can purge caches and publish knowledge answered word for word to farmers.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled: set ADMIN_TOKEN to enable it")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/cache")
+async def inspect_cache(limit: int = Query(50, ge=0, le=1000)):
+    """Show response cache statistics and the most recent persisted entries"""
+    return {
+        "stats": await response_cache.stats(),
+        "similarity": similarity_index.stats(),
+        "images": image_index.stats(),
+        "ingest": dict(ingest.stats),
+        "entries": await response_cache.entries(limit)
+    }
+
+
+@router.delete("/cache")
+async def purge_cache(
+    model: Optional[str] = Query(None),
+    query: Optional[str] = Query(None),
+    prompt_version: Optional[str] = Query(None)
+):
+    """
+    Purge the response cache.
+
+    - **model** + **query**: drop the cached answer of one query
+    - **model** only: drop every answer of that model
+    - nothing: drop everything
+    """
+    if query and not model:
+        raise HTTPException(status_code=400, detail="Purging a single query requires the model name")
+    key = None
+    if query:
+        version = prompt_version or PROMPT_VERSION
+        key = cache.make_key(model, version, query)
+        removed_similar = int(similarity_index.discard(similarity.namespace(model, version), query))
+    elif model:
+        removed_similar = similarity_index.clear(similarity.namespace(model, ""))
+    else:
+        removed_similar = similarity_index.clear()
+    removed = await response_cache.purge(key=key, model=model)
+    removed["similarity"] = removed_similar
+    # Image analyses are not keyed by query text, so any purge drops them all
+    removed["images"] = image_index.clear()
+    logger.info(f"Response cache purged: {removed}")
+    return {"success": True, "removed": removed}
+
+
+@router.get("/upstream")
+async def inspect_upstream():
+    """Show how many identical in-flight upstream calls were coalesced and who is waiting for a slot"""
+    return {
+        "coalescing": upstream.coalescer.stats(),
+        "admission": {
+            "role_weights": ADMISSION_ROLE_WEIGHTS,
+            "queued": {backend.name: backend.guard.limiter.queued_by_role() for backend in registry.backends},
+        },
+    }
+
+
+@router.get("/jobs")
+async def inspect_jobs():
+    """Show the analysis job queue: workers, queue depth and stored jobs by status"""
+    return {"jobs": await job_queue.summary()}
+
+
+@router.get("/sessions")
+async def inspect_sessions():
+    """Show how many conversation sessions this worker holds and their approximate memory"""
+    return {"sessions": session_store.stats()}
+
+
+@router.get("/knowledge")
+async def inspect_knowledge():
+    """Show the knowledge index size, build time and lookup timings"""
+    return {"knowledge": knowledge_index.stats()}
+
+
+@router.post("/knowledge/reload")
+async def reload_knowledge():
+    """Rebuild the knowledge index from the corpus file, dropping documents added through the API"""
+    try:
+        documents = await asyncio.to_thread(knowledge_index.reload)
+    except (OSError, ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not load knowledge corpus: {str(e)}")
+    return {"success": True, "documents": documents}
+
+
+@router.put("/knowledge/{doc_id}")
+async def upsert_knowledge(
+    doc_id: str,
+    question: str = Body(...),
+    answer: str = Body(...),
+    tags: List[str] = Body([])
+):
+    """Add or replace one knowledge document until the next reload from the corpus file"""
+    if not question.strip() or not answer.strip():
+        raise HTTPException(status_code=400, detail="question and answer must not be empty")
+    knowledge_index.upsert(KnowledgeDoc(doc_id, question.strip(), answer.strip(), tuple(tags)))
+    return {"success": True, "doc_id": doc_id}
+
+
+@router.delete("/knowledge/{doc_id}")
+async def delete_knowledge(doc_id: str):
+    """Remove one knowledge document until the next reload from the corpus file"""
+    if not knowledge_index.remove(doc_id):
+        raise HTTPException(status_code=404, detail="Knowledge document not found")
+    return {"success": True, "doc_id": doc_id}
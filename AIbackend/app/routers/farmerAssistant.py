@@ -1,37 +1,63 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, UploadFile, Form
+from fastapi.responses import StreamingResponse
+from dataclasses import asdict, dataclass
+from typing import Annotated, AsyncIterator, Optional, Tuple
+import asyncio
 import base64
-import requests
-import io
-from PIL import Image
+import binascii
+import json
 import logging
-import os
-from dotenv import load_dotenv
-import time
 
-router = APIRouter(prefix="/farmer-assistant", tags=["farmer-assistant"])
+from app.config import (
+    ANALYZE_TEXT_DEADLINE,
+    ANALYZE_TOTAL_BUDGET,
+    ANALYZE_VISION_DEADLINE,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_BYTES,
+    BATCH_MAX_ITEMS,
+    JOB_MAX_WAIT,
+    RESPONSE_RULES_PATH,
+)
+from app.services import admission, answer_filter, backends, cache, ingest, jobs, metrics, probes, similarity, upstream
+from app.services.cache import response_cache
+from app.services.image_hash import image_index
+from app.services.ingest import IngestError, IngestedImage
+from app.services.jobs import JobError, job_queue
+from app.services.knowledge import knowledge_index
+from app.services.sessions import SessionError, session_store
+from app.services.similarity import similarity_index
+from app.services.upstream import UpstreamError
+from app.schemas import (
+    IMAGE_FORM_LIMIT,
+    TEXT_FORM_LIMIT,
+    AnalysisJobForm,
+    AnalysisResponse,
+    AnalyzeForm,
+    ApiTestResponse,
+    BatchLine,
+    BodyLimit,
+    Capabilities,
+    CapabilitiesResponse,
+    HealthResponse,
+    ImageReport,
+    InputType,
+    JobAccepted,
+    JobStatus,
+    LimitedBodyRoute,
+    ModelTypes,
+    SessionForgotten,
+    StaticJSON,
+    TextQueryForm,
+    TextQueryResponse,
+    dumps,
+    event_stream_docs,
+)
 
-# Load environment variables if .env file exists
-try:
-    load_dotenv()
-except Exception as e:
-    logging.warning(f"Could not load .env file: {e}")
-
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-if not GEMINI_API_KEY:
-    logging.warning("GEMINI_API_KEY is not set. Please set your Gemini API key in environment variables.")
+router = APIRouter(prefix="/farmer-assistant", tags=["farmer-assistant"], route_class=LimitedBodyRoute)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create a session for better connection management
-session = requests.Session()
-session.headers.update({
-    "Content-Type": "application/json"
-})
-
 # Agricultural keywords to validate responses
 AGRICULTURAL_KEYWORDS = [
     "crop", "farm", "soil", "irrigation", "fertilizer", "pest", "disease",
@@ -39,25 +65,68 @@ AGRICULTURAL_KEYWORDS = [
     "seeds", "organic", "sustainable", "agricultural", "farming", "cultivation"
 ]
 
+# Bump whenever prompts or post-processing change so stale cached answers are not served
+PROMPT_VERSION = "4"
+
+CACHE_HIT = "hit"
+CACHE_MISS = "miss"
+CACHE_SIMILAR = "similar"
+CACHE_BYPASS = "bypass"
+# Answered from the local agronomy knowledge index
+CACHE_KNOWLEDGE = "knowledge"
+# Answered with conversation context, so neither looked up in nor added to the caches
+CACHE_SESSION = "session"
+
+SERVICE_NAME = "Farmer Assistant AI"
+SERVICE_CAPABILITIES = ["text_analysis", "image_analysis", "agricultural_guidance"]
+
+MODEL_TIMEOUT_MESSAGE = "Request timed out. The AI service is taking too long to respond. Please try again."
+API_KEY_MISSING_MESSAGE = "API key not configured. Please set GEMINI_API_KEY or configure UPSTREAM_BACKENDS."
+IRRELEVANT_ANALYSIS_MESSAGE = "Could not generate agricultural analysis. Please try again with a farming-related query or agricultural image."
+IRRELEVANT_QUERY_MESSAGE = "Could not generate agricultural analysis. Please try again with a farming-related query."
+
+# Phrases rewritten in every answer; more (per language) come from RESPONSE_RULES_PATH
+RESPONSE_REPLACEMENTS = {
+    "I'm sorry": "Please note",
+    "I cannot": "This image doesn't clearly show",
+    "I'm not a farmer": "As a farming assistant",
+    "you should consult": "it's recommended to consult"
+}
+
+response_rules = answer_filter.load_rules(AGRICULTURAL_KEYWORDS, RESPONSE_REPLACEMENTS, RESPONSE_RULES_PATH)
+
 def clean_farmer_response(text: str) -> str:
     """Clean and format the farmer assistant response"""
-    replacements = {
-        "I'm sorry": "Please note",
-        "I cannot": "This image doesn't clearly show",
-        "I'm not a farmer": "As a farming assistant",
-        "you should consult": "it's recommended to consult"
-    }
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-    return text
+    return response_rules.clean(text)
 
 def is_agricultural_response(text: str) -> bool:
     """Validate if the response contains agricultural content"""
-    text_lower = text.lower()
-    return any(keyword in text_lower for keyword in AGRICULTURAL_KEYWORDS)
+    return response_rules.is_relevant(text)
 
-def prepare_messages(text_input: Optional[str], encoded_image: Optional[str], supports_vision: bool):
-    """Prepare the messages payload based on model capabilities"""
+def knowledge_context(matches: list) -> Optional[str]:
+    """Format knowledge index matches as reference notes for the prompt"""
+    if not matches:
+        return None
+    notes = "\n".join(f"- Q: {match.doc.question}\n  A: {match.doc.answer}" for match in matches)
+    return (
+        "REFERENCE NOTES (from a curated agronomy knowledge base; use them where they apply to the query):\n"
+        f"{notes}"
+    )
+
+def prepare_messages(
+    text_input: Optional[str],
+    encoded_image: Optional[str],
+    supports_vision: bool,
+    mime_type: Optional[str] = None,
+    knowledge: Optional[str] = None,
+    history: Optional[str] = None
+):
+    """
+    Prepare the messages payload based on model capabilities.
+
+    `knowledge` (reference notes) and `history` (the farmer's conversation so
+    far) are added to the prompt when given.
+    """
     if supports_vision and encoded_image:
         farmer_prompt = (
             "You are a professional agricultural assistant. Analyze this agricultural image and provide:\n"
@@ -75,12 +144,16 @@ def prepare_messages(text_input: Optional[str], encoded_image: Optional[str], su
             user_text = f"FARMER QUERY: {text_input}\n\n{farmer_prompt}"
         else:
             user_text = farmer_prompt
+        if knowledge:
+            user_text = f"{user_text}\n\n{knowledge}"
+        if history:
+            user_text = f"{history}\n\n{user_text}"
             
         return [{
             "role": "user",
             "content": [
                 {"type": "text", "text": user_text},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+                {"type": "image_url", "image_url": {"url": f"data:{mime_type or 'image/jpeg'};base64,{encoded_image}"}}
             ]
         }]
         
@@ -107,352 +180,942 @@ def prepare_messages(text_input: Optional[str], encoded_image: Optional[str], su
         content = text_input if text_input else (
             "Please provide a farming-related question or describe an agricultural issue you need help with."
         )
+        if knowledge:
+            content = f"{knowledge}\n\nFARMER QUERY: {content}"
+        if history:
+            content = f"{history}\n\n{content}"
         return [system_msg, {"role": "user", "content": content}]
 
-@router.post("/analyze")
-async def farmer_assistant_analysis(
-    image: Optional[UploadFile] = File(None),
-    query: Optional[str] = Form(None)
-):
+def build_gemini_payload(messages: list) -> dict:
+    """
+    Convert prepare_messages output into a generateContent payload.
+
+    Gemini has no system role here, so system text is prepended to the user
+    text; data-URL images become inline_data parts.
+    """
+    texts = []
+    images = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                texts.append(part["text"])
+            elif part["type"] == "image_url":
+                header, data = part["image_url"]["url"].split(",", 1)
+                mime_type = header[len("data:"):].split(";", 1)[0]
+                images.append({"inline_data": {"mime_type": mime_type, "data": data}})
+    return {"contents": [{"parts": [{"text": "\n\n".join(texts)}] + images}]}
+
+async def lookup_answer(cache_key: str, model_name: str, text_input: str) -> Tuple[Optional[str], str]:
+    """Look a text query up in the exact cache, then among near-duplicate past queries"""
+    with metrics.span("cache_lookup", model_name):
+        answer, status = await _lookup_answer(cache_key, model_name, text_input)
+    metrics.cache_lookups.inc(model=model_name, result=status)
+    return answer, status
+
+async def _lookup_answer(cache_key: str, model_name: str, text_input: str) -> Tuple[Optional[str], str]:
+    cached, _tier = await response_cache.get(cache_key)
+    if cached is not None:
+        return cached, CACHE_HIT
+    match = similarity_index.lookup(similarity.namespace(model_name, PROMPT_VERSION), text_input)
+    if match is not None:
+        matched_query, answer, score = match
+        logger.info(f"Near-duplicate match for {model_name} ({score:.2f}): {matched_query!r}")
+        return answer, CACHE_SIMILAR
+    return None, CACHE_MISS
+
+async def store_answer(cache_key: str, model_name: str, text_input: str, answer: str):
+    """Remember a cleaned answer for exact and near-duplicate lookups"""
+    await response_cache.set(cache_key, model_name, text_input, answer)
+    similarity_index.add(similarity.namespace(model_name, PROMPT_VERSION), text_input, answer)
+
+def drop_derived_indexes():
+    """Forget near-duplicate and image matches after another worker purged the response cache"""
+    similarity_index.clear()
+    image_index.clear()
+
+response_cache.on_purge(drop_derived_indexes)
+
+async def warm_similarity_index():
+    """Seed the near-duplicate index from answers persisted by any worker"""
+    # Build the MinHash permutations (and import numpy) off the event loop
+    await asyncio.to_thread(lambda: similarity_index.hasher)
+    loaded = 0
+    for key, model_name, query, answer in reversed(await response_cache.recent(similarity_index.max_entries)):
+        # Rows written under an older prompt version no longer match their key
+        if key == cache.make_key(model_name, PROMPT_VERSION, query):
+            similarity_index.add(similarity.namespace(model_name, PROMPT_VERSION), query, answer)
+            loaded += 1
+    logger.info(f"Similarity index warmed with {loaded} cached answers")
+
+# Model reported by /text-query
+TEXT_QUERY_MODEL = "gemini-pro"
+
+# Models used by /analyze and their capabilities
+MODELS = [
+    ("llama-3.3-70b", "llama-3.3-70b-versatile", False),  # Text-only model
+    ("llama-vision", "llama-3.2-11b-vision-preview", True),  # Vision-capable model
+]
+
+@dataclass
+class ModelCall:
+    """Everything one model needs to answer a request"""
+    model_name: str
+    supports_vision: bool
+    text_input: Optional[str]
+    image: Optional[IngestedImage]
+    fallback_message: str = IRRELEVANT_ANALYSIS_MESSAGE
+    payload: Optional[dict] = None
+    cache_key: Optional[str] = None
+    # Set when the call was resolved without the upstream (cache hit or input problem)
+    answer: Optional[str] = None
+    cache_status: str = CACHE_BYPASS
+    # Conversation context of the farmer's session, if any
+    history: Optional[str] = None
+
+    @property
+    def timeout(self) -> float:
+        return 60 if self.supports_vision else 30
+
+async def plan_model_call(
+    model_name: str,
+    supports_vision: bool,
+    text_input: Optional[str],
+    image: Optional[IngestedImage],
+    history: Optional[str] = None
+) -> ModelCall:
+    """Build the upstream payload of one /analyze model, or resolve it from the caches"""
+    call = ModelCall(model_name, supports_vision, text_input, image, history=history)
+    encoded_image = image.encoded if image else None
+
+    # Skip if no text and model doesn't support images
+    if not text_input and not supports_vision and not encoded_image:
+        call.answer = "Please provide either text query or agricultural image"
+        return call
+
+    # Special handling for text-only models with image input
+    if not supports_vision and encoded_image and not text_input:
+        call.answer = "This model requires text input (doesn't support images)"
+        return call
+    # For text models with both inputs, we'll just use the text
+    model_image = encoded_image if supports_vision else None
+
+    # Answers that only depend on the text can be served from the cache; answers
+    # that also depend on the conversation so far cannot be shared at all
+    if text_input and not model_image and not history:
+        call.cache_key = cache.make_key(model_name, PROMPT_VERSION, text_input)
+        cached, status = await lookup_answer(call.cache_key, model_name, text_input)
+        if cached is not None:
+            call.answer, call.cache_status = cached, status
+            return call
+    elif image is not None and not history:
+        # Re-sent or recompressed photos reuse the earlier analysis
+        with metrics.span("cache_lookup", model_name):
+            await response_cache.sync_purges()
+            match = image_index.lookup(similarity.namespace(model_name, PROMPT_VERSION), text_input, image.perceptual_hash)
+        if match is not None:
+            answer, distance = match
+            logger.info(f"Image match for {model_name} at Hamming distance {distance}")
+            call.answer, call.cache_status = answer, CACHE_HIT if distance == 0 else CACHE_SIMILAR
+            metrics.cache_lookups.inc(model=model_name, result=call.cache_status)
+            return call
+        metrics.cache_lookups.inc(model=model_name, result=CACHE_MISS)
+
+    knowledge = None
+    if text_input:
+        found = knowledge_index.search(text_input)
+        # An image still needs the model to look at it
+        if found.direct is not None and not model_image:
+            call.answer, call.cache_status = found.direct.answer, CACHE_KNOWLEDGE
+            return call
+        knowledge = knowledge_context(found.matches)
+
+    # Check if API key is available
+    if not upstream.configured():
+        call.answer = API_KEY_MISSING_MESSAGE
+        return call
+
+    messages = prepare_messages(
+        text_input, model_image, supports_vision, image.mime_type if image else None, knowledge, history
+    )
+    call.payload = build_gemini_payload(messages)
+    return call
+
+async def plan_text_query(text_input: str, history: Optional[str] = None) -> ModelCall:
+    """Build the /text-query payload, or resolve it from the caches"""
+    call = ModelCall(
+        TEXT_QUERY_MODEL, False, text_input, None, fallback_message=IRRELEVANT_QUERY_MESSAGE, history=history
+    )
+    if not history:
+        call.cache_key = cache.make_key(TEXT_QUERY_MODEL, PROMPT_VERSION, text_input)
+        cached, status = await lookup_answer(call.cache_key, TEXT_QUERY_MODEL, text_input)
+        if cached is not None:
+            call.answer, call.cache_status = cached, status
+            return call
+    found = knowledge_index.search(text_input)
+    if found.direct is not None:
+        call.answer, call.cache_status = found.direct.answer, CACHE_KNOWLEDGE
+        return call
+    knowledge = knowledge_context(found.matches)
+    text = f"FARMER QUERY: {text_input}" if knowledge or history else text_input
+    if knowledge:
+        text = f"{knowledge}\n\n{text}"
+    if history:
+        text = f"{history}\n\n{text}"
+    call.payload = {
+        "contents": [
+            {"parts": [{"text": text}]}
+        ]
+    }
+    return call
+
+async def remember_answer(call: ModelCall, answer: str) -> str:
+    """Cache a cleaned answer where later calls can find it and return the cache status"""
+    if call.history:
+        return CACHE_SESSION
+    if call.cache_key is not None:
+        await store_answer(call.cache_key, call.model_name, call.text_input, answer)
+        return CACHE_MISS
+    if call.image is not None:
+        image_index.add(similarity.namespace(call.model_name, PROMPT_VERSION), call.text_input, call.image.perceptual_hash, answer)
+        return CACHE_MISS
+    return CACHE_BYPASS
+
+def postprocess_answer(answer: str, model_name: str) -> Optional[str]:
+    """Validate and clean an upstream answer, or return None when it is off-topic"""
+    with metrics.span("postprocess", model_name):
+        return response_rules.check_and_clean(answer)
+
+async def answer_text_query(text_input: str, history: Optional[str] = None) -> Tuple[str, str]:
+    """Answer a /text-query question with its cache status, raising UpstreamError on failure"""
+    call = await plan_text_query(text_input, history)
+    if call.answer is not None:
+        return call.answer, call.cache_status
+    if not upstream.configured():
+        raise UpstreamError(API_KEY_MISSING_MESSAGE)
+    answer = postprocess_answer(
+        await upstream.generate_text(call.payload, timeout=call.timeout, label=TEXT_QUERY_MODEL), TEXT_QUERY_MODEL
+    )
+    if answer is None:
+        return call.fallback_message, CACHE_BYPASS
+    logger.info("Successfully processed text-only query")
+    return answer, await remember_answer(call, answer)
+
+async def run_model(
+    model_name: str,
+    supports_vision: bool,
+    text_input: Optional[str],
+    image: Optional[IngestedImage],
+    history: Optional[str] = None
+) -> Tuple[str, str]:
+    """Produce the answer of a single model for /analyze, with its cache status"""
+    try:
+        call = await plan_model_call(model_name, supports_vision, text_input, image, history)
+        if call.answer is not None:
+            return call.answer, call.cache_status
+
+        try:
+            answer = await upstream.generate_text(call.payload, timeout=call.timeout, label=model_name)
+        except UpstreamError as e:
+            if e.retry_after is not None:
+                # Refused a slot; run_models_concurrently decides whether that fails the request
+                raise
+            return e.message, CACHE_BYPASS
+
+        answer = postprocess_answer(answer, model_name)
+        if answer is None:
+            return call.fallback_message, CACHE_BYPASS
+        return answer, await remember_answer(call, answer)
+
+    except UpstreamError:
+        raise
+    except Exception as e:
+        logger.error(f"Model {model_name} setup error: {str(e)}")
+        return f"Service error: {str(e)}", CACHE_BYPASS
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+async def stream_model_events(call: ModelCall) -> AsyncIterator[Tuple[str, dict]]:
+    """Yield (event, data) pairs relaying one model's answer while it is generated"""
+    model_name = call.model_name
+    if call.answer is not None:
+        yield "chunk", {"model": model_name, "text": call.answer}
+        yield "done", {"model": model_name, "cache": call.cache_status}
+        return
+
+    stream_filter = response_rules.stream()
+    try:
+        async for chunk in upstream.stream_text(call.payload, timeout=call.timeout, label=model_name):
+            text = stream_filter.feed(chunk)
+            if text:
+                yield "chunk", {"model": model_name, "text": text}
+    except UpstreamError as e:
+        yield "error", {"model": model_name, "detail": e.message}
+        return
+
+    text = stream_filter.finish()
+    if text is None:
+        yield "chunk", {"model": model_name, "text": call.fallback_message}
+        yield "done", {"model": model_name, "cache": CACHE_BYPASS}
+        return
+    if text:
+        yield "chunk", {"model": model_name, "text": text}
+    # The full answer is only cached once the stream completed
+    yield "done", {"model": model_name, "cache": await remember_answer(call, stream_filter.answer)}
+
+async def events_within_budget(model_name: str, model_events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Relay one model's events until ANALYZE_TOTAL_BUDGET runs out.
+
+    The events are produced in their own task so a stalled upstream can be
+    given up on; the relay then ends with an error event instead of holding
+    the stream open.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in model_events:
+                await queue.put(item)
+        except Exception as e:
+            logger.error(f"Model {model_name} stream error: {str(e)}")
+            await queue.put(("error", {"model": model_name, "detail": f"Service error: {str(e)}"}))
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    budget_ends = loop.time() + ANALYZE_TOTAL_BUDGET
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=max(budget_ends - loop.time(), 0))
+            except asyncio.TimeoutError:
+                logger.warning(f"Model {model_name} cancelled after the {ANALYZE_TOTAL_BUDGET}s request budget")
+                yield "error", {"model": model_name, "detail": MODEL_TIMEOUT_MESSAGE}
+                return
+            if item is None:
+                return
+            yield item
+    finally:
+        # Also runs when the client disconnects mid-stream
+        task.cancel()
+
+async def stream_models_concurrently(
+    text_input: Optional[str],
+    image: Optional[IngestedImage],
+    history: Optional[str] = None,
+    collected: Optional[dict] = None
+) -> AsyncIterator[str]:
+    """
+    Relay every model in MODELS as one SSE stream.
+
+    Events from all models are interleaved as they arrive and carry the
+    model name. The same per-model deadlines and overall budget as
+    run_models_concurrently apply; a model that misses them gets an error
+    event instead of holding the stream open. When `collected` is given it
+    receives each model's full answer text and cache status.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump(model_name: str, supports_vision: bool):
+        call = await plan_model_call(model_name, supports_vision, text_input, image, history)
+        async for event, data in stream_model_events(call):
+            await queue.put((event, data))
+
+    async def produce(model_name: str, supports_vision: bool):
+        deadline = ANALYZE_VISION_DEADLINE if supports_vision else ANALYZE_TEXT_DEADLINE
+        try:
+            await asyncio.wait_for(pump(model_name, supports_vision), timeout=deadline)
+        except asyncio.TimeoutError:
+            logger.warning(f"Model {model_name} exceeded its {deadline}s deadline")
+            await queue.put(("error", {"model": model_name, "detail": MODEL_TIMEOUT_MESSAGE}))
+        except Exception as e:
+            logger.error(f"Model {model_name} stream error: {str(e)}")
+            await queue.put(("error", {"model": model_name, "detail": f"Service error: {str(e)}"}))
+        finally:
+            await queue.put((None, {"model": model_name}))
+
+    tasks = [
+        asyncio.create_task(produce(model_name, supports_vision))
+        for model_name, _model, supports_vision in MODELS
+    ]
+    remaining = {model_name for model_name, _model, _vision in MODELS}
+    loop = asyncio.get_running_loop()
+    budget_ends = loop.time() + ANALYZE_TOTAL_BUDGET
+    try:
+        while remaining:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=max(budget_ends - loop.time(), 0))
+            except asyncio.TimeoutError:
+                for model_name in sorted(remaining):
+                    logger.warning(f"Model {model_name} cancelled after the {ANALYZE_TOTAL_BUDGET}s request budget")
+                    yield sse_event("error", {"model": model_name, "detail": MODEL_TIMEOUT_MESSAGE})
+                break
+            if event is None:
+                remaining.discard(data["model"])
+                continue
+            if collected is not None:
+                collect_event(collected, event, data)
+            yield sse_event(event, data)
+        yield sse_event("end", {})
+    finally:
+        # Also runs when the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
+def collect_event(collected: dict, event: str, data: dict):
+    """Accumulate streamed answers into {model: [text, cache status]}"""
+    entry = collected.setdefault(data["model"], ["", CACHE_BYPASS])
+    if event == "chunk":
+        entry[0] += data["text"]
+    elif event == "done":
+        entry[1] = data["cache"]
+
+async def run_models_concurrently(
+    text_input: Optional[str],
+    image: Optional[IngestedImage],
+    history: Optional[str] = None
+) -> Tuple[dict, dict]:
+    """
+    Call every model in MODELS at the same time.
+
+    Each model is bounded by its own deadline and the whole fan-out by
+    ANALYZE_TOTAL_BUDGET; models that miss either are cancelled and reported
+    as timed out so the farmer still gets the answers that did arrive.
+    Returns the answers and the cache status of each model, or raises the
+    UpstreamError when every model was refused an upstream slot.
+    """
+    async def bounded(model_name: str, supports_vision: bool) -> Tuple[str, str]:
+        deadline = ANALYZE_VISION_DEADLINE if supports_vision else ANALYZE_TEXT_DEADLINE
+        try:
+            return await asyncio.wait_for(
+                run_model(model_name, supports_vision, text_input, image, history),
+                timeout=deadline
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Model {model_name} exceeded its {deadline}s deadline")
+            return MODEL_TIMEOUT_MESSAGE, CACHE_BYPASS
+
+    tasks = {
+        model_name: asyncio.create_task(bounded(model_name, supports_vision))
+        for model_name, _model, supports_vision in MODELS
+    }
+    done, pending = await asyncio.wait(tasks.values(), timeout=ANALYZE_TOTAL_BUDGET)
+    for task in pending:
+        task.cancel()
+
+    responses = {}
+    cache_status = {}
+    refused = []
+    for model_name, task in tasks.items():
+        if task not in done:
+            logger.warning(f"Model {model_name} cancelled after the {ANALYZE_TOTAL_BUDGET}s request budget")
+            responses[model_name], cache_status[model_name] = MODEL_TIMEOUT_MESSAGE, CACHE_BYPASS
+        elif isinstance(task.exception(), UpstreamError):
+            refused.append(task.exception())
+            responses[model_name], cache_status[model_name] = task.exception().message, CACHE_BYPASS
+        else:
+            responses[model_name], cache_status[model_name] = task.result()
+    if refused and len(refused) == len(tasks):
+        raise refused[0]
+    return responses, cache_status
+
+def upstream_http_error(e: UpstreamError) -> HTTPException:
+    """503 with Retry-After when the call was refused a slot, 500 otherwise"""
+    if e.retry_after is not None:
+        return HTTPException(
+            status_code=503,
+            detail=e.message,
+            headers={"Retry-After": str(max(int(e.retry_after + 0.5), 1))}
+        )
+    return HTTPException(status_code=500, detail=e.message)
+
+async def read_analysis_inputs(image: Optional[UploadFile], query: Optional[str]) -> Tuple[Optional[str], Optional[IngestedImage]]:
+    """Validate the /analyze form fields and ingest the image if one was sent"""
+    # Validate at least one input is provided
+    if image is None and query is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Either image or text query must be provided"
+        )
+
+    # Process text input
+    text_input = query.strip() if query else None
+
+    # Process image if provided
+    ingested = None
+    if image:
+        try:
+            ingested = await ingest.ingest_upload(image)
+        except IngestError as e:
+            logger.error(f"Image rejected: {e.message}")
+            raise HTTPException(status_code=e.status_code, detail=e.message)
+    return text_input, ingested
+
+def event_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    """Wrap SSE text in a response that proxies will not buffer"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def session_history(session_id: Optional[str], text_input: Optional[str]) -> Optional[str]:
+    """Conversation context of a farmer's session, rejecting malformed session IDs"""
+    if not session_id:
+        return None
+    try:
+        session_store.validate(session_id)
+    except SessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    return session_store.context(session_id, text_input)
+
+def remember_turn(session_id: Optional[str], text_input: Optional[str], has_image: bool, answers: dict):
+    """
+    Add a finished /analyze turn to the farmer's session.
+
+    `answers` maps each model to (answer, cache status). The vision model's
+    answer is kept for image turns and the text model's otherwise; fallback
+    and error answers (cache status bypass) are not kept.
+    """
+    if not session_id:
+        return
+    preferred = sorted(MODELS, key=lambda model: model[2] != has_image)
+    for model_name, _model, _vision in preferred:
+        answer, status = answers.get(model_name, (None, CACHE_BYPASS))
+        if answer and status != CACHE_BYPASS:
+            session_store.record(session_id, text_input, answer)
+            return
+
+async def analysis_result(
+    text_input: Optional[str],
+    ingested: Optional[IngestedImage],
+    session_id: Optional[str] = None
+) -> AnalysisResponse:
+    """Run every model and build the /analyze response body"""
+    history = session_history(session_id, text_input)
+    responses, cache_status = await run_models_concurrently(text_input, ingested, history)
+    remember_turn(
+        session_id, text_input, ingested is not None,
+        {model_name: (responses[model_name], cache_status[model_name]) for model_name in responses}
+    )
+    return AnalysisResponse(
+        input_type=InputType(has_image=ingested is not None, has_text=text_input is not None),
+        responses=responses,
+        cache=cache_status,
+        image=ImageReport(**ingested.report()) if ingested else None
+    )
+
+async def run_analysis_job(inputs: dict) -> dict:
+    """Job queue runner: the stored /analyze/jobs inputs back through analysis_result"""
+    ingested = IngestedImage(**inputs["image"]) if inputs.get("image") else None
+    principal = inputs.get("principal")
+    with admission.acting_as(admission.Principal(**principal) if principal else admission.ANONYMOUS):
+        result = await analysis_result(inputs.get("query"), ingested)
+    return result.model_dump(mode="json")
+
+@router.post("/analyze", response_model=AnalysisResponse)
+@IMAGE_FORM_LIMIT
+async def farmer_assistant_analysis(form: Annotated[AnalyzeForm, Form()]):
     """
     Analyze agricultural images and answer farming queries.
     
     - **image**: Upload an agricultural image (crops, soil, pests, etc.)
     - **query**: Ask a farming-related question
     - **Both**: Provide both image and text for comprehensive analysis
+    - **session_id**: Optional farmer or conversation ID; earlier turns are used as context
     """
     try:
-        # Validate at least one input is provided
-        if image is None and query is None:
-            raise HTTPException(
-                status_code=400,
-                detail="Either image or text query must be provided"
-            )
+        text_input, ingested = await read_analysis_inputs(form.image, form.query)
+        return await analysis_result(text_input, ingested, form.session_id)
 
-        # Process text input
-        text_input = query.strip() if query else None
+    except HTTPException:
+        raise
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        logger.error(f"Farmer assistant analysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-        # Process image if provided
-        encoded_image = None
-        if image:
-            try:
-                image_content = await image.read()
-                if not image_content:
-                    raise HTTPException(status_code=400, detail="Empty image file")
-                
-                # Verify it's a valid image
-                img = Image.open(io.BytesIO(image_content))
-                img.verify()
-                
-                # Encode image
-                encoded_image = base64.b64encode(image_content).decode("utf-8")
-                logger.info("Agricultural image successfully processed and encoded")
-            except Exception as e:
-                logger.error(f"Invalid image format: {str(e)}")
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Invalid image format: {str(e)}"
-                )
-
-        # Define models and their capabilities
-        models = [
-            ("llama-3.3-70b", "llama-3.3-70b-versatile", False),  # Text-only model
-            ("llama-vision", "llama-3.2-11b-vision-preview", True),  # Vision-capable model
-        ]
+@router.post("/analyze/stream", response_class=StreamingResponse, responses=event_stream_docs("chunk, done, error and end events"))
+@IMAGE_FORM_LIMIT
+async def farmer_assistant_analysis_stream(form: Annotated[AnalyzeForm, Form()]):
+    """
+    Streaming variant of /analyze using Server-Sent Events.
 
-        responses = {}
-        for model_name, model, supports_vision in models:
-            try:
-                # Skip if no text and model doesn't support images
-                if not text_input and not supports_vision and not encoded_image:
-                    responses[model_name] = "Please provide either text query or agricultural image"
-                    continue
-
-                messages = prepare_messages(text_input, encoded_image, supports_vision)
-
-                # Special handling for text-only models with image input
-                if not supports_vision and encoded_image:
-                    if not text_input:
-                        responses[model_name] = "This model requires text input (doesn't support images)"
-                        continue
-                    # For text models with both inputs, we'll just use the text
-                    messages = prepare_messages(text_input, None, False)
-
-                # Check if API key is available
-                if not GEMINI_API_KEY:
-                    responses[model_name] = "API key not configured. Please set GEMINI_API_KEY environment variable."
-                    continue
-
-                # Gemini API expects a different payload
-                payload = {
-                    "contents": [
-                        {"parts": [{"text": messages[0]["content"] if isinstance(messages[0], dict) else messages[0]["content"][0]["text"]}]}
-                    ]
-                }
-                params = {"key": GEMINI_API_KEY}
-
-                max_retries = 3
-                retry_delay = 2
-                for attempt in range(max_retries):
-                    try:
-                        response = session.post(
-                            GEMINI_API_URL,
-                            params=params,
-                            json=payload,
-                            timeout=60 if supports_vision else 30
-                        )
-                        response.raise_for_status()
-                        result = response.json()
-                        answer = result["candidates"][0]["content"]["parts"][0]["text"]
-                        if not is_agricultural_response(answer):
-                            answer = "Could not generate agricultural analysis. Please try again with a farming-related query or agricultural image."
-                        else:
-                            answer = clean_farmer_response(answer)
-                        responses[model_name] = answer
-                        logger.info(f"Successfully processed {model_name} response")
-                        break
-                    except Exception as e:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"Gemini API error, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            responses[model_name] = f"Gemini API error: {str(e)}"
-                            
-                    except requests.exceptions.ConnectionError as e:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"Connection error for {model_name}, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                        else:
-                            responses[model_name] = "Connection error: Unable to reach AI service. Please check your internet connection and try again."
-                            logger.error(f"Model {model_name} connection failed after {max_retries} attempts: {str(e)}")
-                            
-                    except requests.exceptions.Timeout as e:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"Timeout for {model_name}, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            responses[model_name] = "Request timed out. The AI service is taking too long to respond. Please try again."
-                            logger.error(f"Model {model_name} timed out after {max_retries} attempts: {str(e)}")
-                            
-                    except requests.exceptions.HTTPError as e:
-                        error_msg = f"API error: {str(e)}"
-                        if e.response.status_code == 400:
-                            try:
-                                error_data = e.response.json()
-                                error_msg = error_data.get("error", {}).get("message", error_msg)
-                            except:
-                                pass
-                        elif e.response.status_code == 401:
-                            error_msg = "Authentication failed. Please check your API key."
-                        elif e.response.status_code == 429:
-                            error_msg = "Rate limit exceeded. Please wait a moment and try again."
-                        elif e.response.status_code >= 500:
-                            if attempt < max_retries - 1:
-                                logger.warning(f"Server error for {model_name}, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2
-                                continue
-                            else:
-                                error_msg = "AI service is temporarily unavailable. Please try again later."
-                        
-                        responses[model_name] = f"Analysis unavailable: {error_msg}"
-                        logger.warning(f"Model {model_name} failed: {error_msg}")
-                        break  # Don't retry HTTP errors
-                        
-                    except Exception as e:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"Unexpected error for {model_name}, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            responses[model_name] = f"Unexpected error: {str(e)}"
-                            logger.error(f"Model {model_name} error: {str(e)}")
-                
-            except Exception as e:
-                responses[model_name] = f"Service error: {str(e)}"
-                logger.error(f"Model {model_name} setup error: {str(e)}")
-
-        return {
-            "success": True,
-            "message": "Farmer Assistant Analysis Complete",
-            "input_type": {
-                "has_image": encoded_image is not None,
-                "has_text": text_input is not None
-            },
-            "responses": responses
+    Emits `chunk` events ({model, text}) while answers are generated, one
+    `done` ({model, cache}) or `error` ({model, detail}) event per model and a
+    final `end` event.
+    """
+    text_input, ingested = await read_analysis_inputs(form.image, form.query)
+    history = session_history(form.session_id, text_input)
+
+    async def events():
+        collected = {}
+        async for event in stream_models_concurrently(text_input, ingested, history, collected):
+            yield event
+        remember_turn(form.session_id, text_input, ingested is not None, collected)
+
+    return event_stream(events())
+
+@router.post("/analyze/jobs", status_code=202, response_model=JobAccepted)
+@IMAGE_FORM_LIMIT
+async def submit_analysis_job(request: Request, form: Annotated[AnalysisJobForm, Form()]):
+    """
+    Queue an /analyze request and return a job ID straight away.
+
+    - **priority**: high, normal or low
+    - **callback_url**: optional URL the finished job is POSTed to
+
+    Identical submissions (same query and image) share one job. Poll
+    GET /analyze/jobs/{job_id}, optionally with `wait` to long-poll.
+    """
+    try:
+        if form.callback_url:
+            await jobs.check_callback_url(form.callback_url)
+        text_input, ingested = await read_analysis_inputs(form.image, form.query)
+        key = jobs.content_key(
+            PROMPT_VERSION,
+            cache.normalize_query(text_input or ""),
+            ingested.encoded if ingested else ""
+        )
+        inputs = {
+            "query": text_input,
+            "image": asdict(ingested) if ingested else None,
+            "principal": asdict(admission.current_principal()),
         }
+        job = await job_queue.submit(key, inputs, jobs.PRIORITIES[form.priority], form.callback_url)
+    except JobError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
 
-    except Exception as e:
-        logger.error(f"Farmer assistant analysis error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return JobAccepted(
+        job_id=job["job_id"],
+        status=job["status"],
+        deduplicated=job["deduplicated"],
+        poll_url=request.app.url_path_for("get_analysis_job", job_id=job["job_id"])
+    )
+
+@router.get("/analyze/jobs/{job_id}", response_model=JobStatus)
+async def get_analysis_job(job_id: str, wait: float = 0):
+    """
+    Status of an analysis job, with the /analyze response once it is done.
+
+    - **wait**: seconds to wait for the job to finish before answering (long-poll)
+    """
+    job = await job_queue.get(job_id, wait=min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return JobStatus(**job)
 
-@router.get("/health")
+@router.delete("/sessions/{session_id}", response_model=SessionForgotten)
+async def forget_session(session_id: str):
+    """Forget a farmer's conversation so the next query starts afresh"""
+    if not session_store.forget(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return SessionForgotten(session_id=session_id)
+
+@router.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint for the farmer assistant service"""
-    return {
-        "status": "healthy",
-        "service": "Farmer Assistant AI",
-        "models_available": ["llama-3.3-70b-versatile", "llama-3.2-11b-vision-preview"],
-        "capabilities": ["text_analysis", "image_analysis", "agricultural_guidance"],
-        "model_types": {
-            "text_only": "llama-3.3-70b-versatile",
-            "vision": "llama-3.2-11b-vision-preview"
-        }
+    """Health check endpoint for the farmer assistant service, with the live upstream backends"""
+    backend_states = [state for state in upstream.registry.state() if state["configured"]]
+    live = {
+        capability: [state["name"] for state in backend_states if state["healthy"].get(capability)]
+        for capability in (backends.TEXT, backends.VISION)
     }
+    degraded = (
+        not all(live.values())
+        or any(state["guard"]["circuit"] != "closed" for state in backend_states)
+    )
+    return HealthResponse(
+        status="degraded" if degraded else "healthy",
+        backends=backend_states,
+        service=SERVICE_NAME,
+        models_available=[state["model"] or state["name"] for state in backend_states],
+        capabilities=SERVICE_CAPABILITIES,
+        model_types=ModelTypes(text_only=live[backends.TEXT], vision=live[backends.VISION])
+    )
 
-@router.get("/capabilities")
+CAPABILITIES = StaticJSON(CapabilitiesResponse(
+    service="Professional Farmer Assistant",
+    capabilities=Capabilities(
+        image_analysis=[
+            "Crop health assessment",
+            "Soil condition analysis",
+            "Pest and disease identification",
+            "Growth stage evaluation",
+            "Irrigation system analysis"
+        ],
+        text_queries=[
+            "Crop management advice",
+            "Soil fertility recommendations",
+            "Pest control strategies",
+            "Irrigation best practices",
+            "Harvest timing guidance",
+            "Weather impact assessment",
+            "Organic farming methods",
+            "Sustainable agriculture practices"
+        ],
+        professional_features=[
+            "Agricultural terminology",
+            "Practical recommendations",
+            "Best practices guidance",
+            "Regional considerations",
+            "Expert consultation advice"
+        ]
+    )
+))
+
+@router.get("/capabilities", response_model=CapabilitiesResponse)
 async def get_capabilities():
     """Get information about what the farmer assistant can do"""
-    return {
-        "service": "Professional Farmer Assistant",
-        "capabilities": {
-            "image_analysis": [
-                "Crop health assessment",
-                "Soil condition analysis", 
-                "Pest and disease identification",
-                "Growth stage evaluation",
-                "Irrigation system analysis"
-            ],
-            "text_queries": [
-                "Crop management advice",
-                "Soil fertility recommendations",
-                "Pest control strategies",
-                "Irrigation best practices",
-                "Harvest timing guidance",
-                "Weather impact assessment",
-                "Organic farming methods",
-                "Sustainable agriculture practices"
-            ],
-            "professional_features": [
-                "Agricultural terminology",
-                "Practical recommendations",
-                "Best practices guidance",
-                "Regional considerations",
-                "Expert consultation advice"
-            ]
-        }
-    }
+    return CAPABILITIES.response()
 
-@router.get("/test-api")
+@router.get("/test-api", response_model=ApiTestResponse, response_model_exclude_none=True)
 async def test_api_connection():
-    """Test the connection to Gemini API"""
-    if not GEMINI_API_KEY:
-        return {
-            "status": "error",
-            "message": "API key not configured",
-            "details": "Please set GEMINI_API_KEY environment variable"
-        }
-    try:
-        payload = {
-            "contents": [
-                {"parts": [{"text": "Hello"}]}
-            ]
-        }
-        params = {"key": GEMINI_API_KEY}
-        response = session.post(
-            GEMINI_API_URL,
-            params=params,
-            json=payload,
-            timeout=10
-        )
-        response.raise_for_status()
-        return {
-            "status": "success",
-            "message": "API connection successful",
-            "api_key_configured": True
-        }
-    except requests.exceptions.ConnectionError:
-        return {
-            "status": "error",
-            "message": "Connection failed",
-            "details": "Unable to reach Gemini API. Check your internet connection."
-        }
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 401:
-            return {
-                "status": "error",
-                "message": "Authentication failed",
-                "details": "Invalid API key. Please check your GEMINI_API_KEY."
-            }
-        else:
-            return {
-                "status": "error",
-                "message": f"API error: {e.response.status_code}",
-                "details": str(e)
-            }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": "Unexpected error",
-            "details": str(e)
-        }
+    """
+    Test the connection to the preferred text backend.
+
+    The upstream is called at most once per API_PROBE_TTL seconds after a
+    success (API_PROBE_RETRY_INTERVAL after a failure); checks in between
+    get the last result with `cached` set.
+    """
+    result, cached = await probes.api_probe.result()
+    return ApiTestResponse(**result, cached=cached)
 
-@router.post("/text-query")
-async def text_only_query(query: str = Form(...)):
+@router.post("/text-query", response_model=TextQueryResponse)
+@TEXT_FORM_LIMIT
+async def text_only_query(form: Annotated[TextQueryForm, Form()]):
     """
     Handle text-only farming queries using the versatile model.
     - **query**: Your farming-related question or agricultural issue description
+    - **session_id**: Optional farmer or conversation ID; earlier turns are used as context
     """
     try:
-        if not query or not query.strip():
+        if not form.query.strip():
             raise HTTPException(
                 status_code=400,
                 detail="Query text is required"
             )
-        text_input = query.strip()
-        if not GEMINI_API_KEY:
-            raise HTTPException(
-                status_code=500,
-                detail="API key not configured. Please set GEMINI_API_KEY environment variable."
-            )
-        payload = {
-            "contents": [
-                {"parts": [{"text": text_input}]}
-            ]
-        }
-        params = {"key": GEMINI_API_KEY}
-        max_retries = 3
-        retry_delay = 2
-        for attempt in range(max_retries):
-            try:
-                response = session.post(
-                    GEMINI_API_URL,
-                    params=params,
-                    json=payload,
-                    timeout=30
-                )
-                response.raise_for_status()
-                result = response.json()
-                answer = result["candidates"][0]["content"]["parts"][0]["text"]
-                if not is_agricultural_response(answer):
-                    answer = "Could not generate agricultural analysis. Please try again with a farming-related query."
-                else:
-                    answer = clean_farmer_response(answer)
-                logger.info("Successfully processed text-only query")
-                return {
-                    "success": True,
-                    "message": "Text Query Analysis Complete",
-                    "query": text_input,
-                    "response": answer,
-                    "model_used": "gemini-pro"
-                }
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Gemini API error, attempt {attempt + 1}/{max_retries}: {str(e)}")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                    continue
-                else:
-                    raise HTTPException(status_code=500, detail=f"Analysis unavailable: Gemini API error: {str(e)}")
+        text_input = form.query.strip()
+        history = session_history(form.session_id, text_input)
+        try:
+            answer, cache_status = await answer_text_query(text_input, history)
+        except UpstreamError as e:
+            raise upstream_http_error(e)
+        if form.session_id and cache_status != CACHE_BYPASS:
+            session_store.record(form.session_id, text_input, answer)
+        return TextQueryResponse(
+            query=text_input,
+            response=answer,
+            model_used=TEXT_QUERY_MODEL,
+            cache=cache_status
+        )
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Text query error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") 
+
+@router.post("/text-query/stream", response_class=StreamingResponse, responses=event_stream_docs("chunk, done or error, and end events"))
+@TEXT_FORM_LIMIT
+async def text_only_query_stream(form: Annotated[TextQueryForm, Form()]):
+    """
+    Streaming variant of /text-query using Server-Sent Events.
+
+    Emits `chunk` events ({model, text}) while the answer is generated,
+    then `done` ({model, cache}) or `error` ({model, detail}) and `end`.
+    The stream is bounded by ANALYZE_TOTAL_BUDGET like /analyze.
+    """
+    if not form.query.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Query text is required"
+        )
+    text_input = form.query.strip()
+    session_id = form.session_id
+    call = await plan_text_query(text_input, session_history(session_id, text_input))
+    if call.answer is None and not upstream.configured():
+        raise HTTPException(status_code=500, detail=API_KEY_MISSING_MESSAGE)
+
+    async def events():
+        collected = {}
+        async for event, data in events_within_budget(TEXT_QUERY_MODEL, stream_model_events(call)):
+            collect_event(collected, event, data)
+            yield sse_event(event, data)
+        yield sse_event("end", {})
+        answer, status = collected.get(TEXT_QUERY_MODEL, ("", CACHE_BYPASS))
+        if session_id and answer and status != CACHE_BYPASS:
+            session_store.record(session_id, text_input, answer)
+
+    return event_stream(events())
+
+
+@dataclass
+class BatchItem:
+    """One queued question from an offline sync"""
+    id: str
+    query: Optional[str] = None
+    image: Optional[bytes] = None
+    # "text" answers like /text-query, "analyze" like /analyze
+    mode: str = "text"
+
+def parse_batch_item(index: int, raw: dict, files: dict) -> BatchItem:
+    """Validate one manifest entry; images come inline as base64 or by multipart field name"""
+    if not isinstance(raw, dict):
+        raise ValueError("item must be an object")
+    item_id = str(raw.get("id", index))
+    query = raw.get("query")
+    if query is not None and not isinstance(query, str):
+        raise ValueError("query must be a string")
+    query = query.strip() if query and query.strip() else None
+
+    image = None
+    if raw.get("image_base64"):
+        try:
+            image = base64.b64decode(raw["image_base64"], validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError("image_base64 is not valid base64")
+    elif raw.get("image"):
+        if raw["image"] not in files:
+            raise ValueError(f"no uploaded file named {raw['image']!r}")
+        image = files[raw["image"]]
+
+    if query is None and image is None:
+        raise ValueError("Either image or text query must be provided")
+    mode = raw.get("mode") or ("analyze" if image is not None else "text")
+    if mode not in ("text", "analyze"):
+        raise ValueError("mode must be 'text' or 'analyze'")
+    if mode == "text" and query is None:
+        raise ValueError("Query text is required")
+    return BatchItem(item_id, query, image, mode)
+
+async def read_batch(request: Request) -> list:
+    """
+    Read a batch request body into (index, BatchItem or error) pairs.
+
+    NDJSON bodies carry one item per line. Multipart bodies carry an `items`
+    field (or file) with a JSON array of items plus the image files they
+    reference.
+    """
+    content_type = request.headers.get("content-type", "")
+    files = {}
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form(max_files=BATCH_MAX_ITEMS, max_fields=BATCH_MAX_ITEMS + 1)
+        for name, value in form.multi_items():
+            if not isinstance(value, str):
+                files[name] = await ingest.read_upload(value)
+        manifest = form.get("items") or "[]"
+        if not isinstance(manifest, str):
+            # Sent as a file part: already read above
+            manifest = files.pop("items")
+        try:
+            raw_items = json.loads(manifest)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=400, detail=f"items is not valid JSON: {e}")
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="items must be a JSON array")
+    else:
+        raw_items = []
+        body = await request.body()
+        for line_number, line in enumerate(body.decode("utf-8").splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"Line {line_number} is not valid JSON: {e}")
+
+    if not raw_items:
+        raise HTTPException(status_code=400, detail="Batch contains no items")
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large: limit is {BATCH_MAX_ITEMS} items")
+
+    parsed = []
+    for index, raw in enumerate(raw_items):
+        try:
+            parsed.append((index, parse_batch_item(index, raw, files)))
+        except ValueError as e:
+            parsed.append((index, str(e)))
+    return parsed
+
+async def process_batch_item(item: BatchItem) -> dict:
+    """Answer one batch item exactly like the matching single-item endpoint"""
+    if item.mode == "text":
+        answer, cache_status = await answer_text_query(item.query)
+        return {"response": answer, "model_used": TEXT_QUERY_MODEL, "cache": cache_status}
+
+    ingested = await ingest.ingest_bytes(item.image) if item.image is not None else None
+    responses, cache_status = await run_models_concurrently(item.query, ingested)
+    return {
+        "responses": responses,
+        "cache": cache_status,
+        "image": ingested.report() if ingested else None
+    }
+
+async def stream_batch_results(items: list) -> AsyncIterator[bytes]:
+    """Process batch items with bounded concurrency and yield NDJSON lines as each finishes"""
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(index: int, item) -> BatchLine:
+        if isinstance(item, str):
+            return BatchLine(index=index, status="error", detail=item)
+        async with slots:
+            try:
+                result = await process_batch_item(item)
+            except UpstreamError as e:
+                return BatchLine(index=index, id=item.id, status="error", detail=e.message)
+            except IngestError as e:
+                return BatchLine(index=index, id=item.id, status="error", detail=e.message)
+            except Exception as e:
+                logger.error(f"Batch item {item.id} error: {str(e)}")
+                return BatchLine(index=index, id=item.id, status="error", detail=f"Service error: {str(e)}")
+        return BatchLine(index=index, id=item.id, status="ok", result=result)
+
+    def ndjson(line: BatchLine) -> bytes:
+        return dumps(line.model_dump(exclude_none=True)) + b"\n"
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in items]
+    succeeded = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            line = await finished
+            succeeded += line.status == "ok"
+            yield ndjson(line)
+        yield ndjson(BatchLine(summary={"total": len(tasks), "succeeded": succeeded, "failed": len(tasks) - succeeded}))
+    finally:
+        # Also runs when the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
+BATCH_BODY_LIMIT = BodyLimit(
+    BATCH_MAX_BYTES, ("multipart/form-data", "application/x-ndjson", "application/jsonl", "application/json", "text/plain")
+)
+
+@router.post(
+    "/batch",
+    response_class=StreamingResponse,
+    responses={200: {"description": "One BatchLine per item, then a summary line", "content": {"application/x-ndjson": {}}}}
+)
+@BATCH_BODY_LIMIT
+async def batch_query(request: Request):
+    """
+    Answer many queued farmer questions and photos in one request.
+
+    Send either NDJSON (one item per line) or multipart with an `items` JSON
+    array plus image files. Each item has an optional **id**, a **query**, an
+    optional image (**image_base64**, or **image** naming a multipart file)
+    and an optional **mode** (`text` or `analyze`). Results stream back as
+    NDJSON in completion order, followed by a summary line.
+    """
+    try:
+        items = await read_batch(request)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    logger.info(f"Batch of {len(items)} items accepted")
+    return StreamingResponse(stream_batch_results(items), media_type="application/x-ndjson")
@@ -0,0 +1,264 @@
+import json
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field
+
+from app.config import IMAGE_MAX_UPLOAD_BYTES, QUERY_MAX_CHARS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORM_TYPES = ("multipart/form-data", "application/x-www-form-urlencoded")
+# Room for the form fields and multipart boundaries around an upload
+_FORM_OVERHEAD = 64 * 1024
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson (several times faster than json for answer-sized bodies)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class StaticJSON:
+    """A response body that never changes, serialized once at import"""
+
+    def __init__(self, model: BaseModel):
+        self.body = dumps(model.model_dump(mode="json"))
+
+    def response(self) -> Response:
+        return Response(self.body, media_type="application/json")
+
+
+class BodyLimit:
+    """
+    Declared size and content type limits of a request body.
+
+    Used as a decorator below the route decorator; LimitedBodyRoute enforces
+    it before the body is parsed. A Content-Length over the limit or a
+    content type not listed is refused from the headers alone, and a chunked
+    body is cut off as soon as it grows past the limit, so an oversized
+    upload is never buffered or spooled to disk.
+    """
+
+    def __init__(self, max_bytes: int, content_types: Tuple[str, ...] = FORM_TYPES):
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+
+    def __call__(self, endpoint: Callable) -> Callable:
+        endpoint.body_limit = self
+        return endpoint
+
+    def too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Request too large: limit is {self.max_bytes} bytes")
+
+    def check_headers(self, request: Request):
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        if self.content_types and content_type and content_type not in self.content_types:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported content type {content_type}: use {' or '.join(self.content_types)}"
+            )
+        try:
+            length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if length > self.max_bytes:
+            raise self.too_large()
+
+    def guard_receive(self, receive: Callable) -> Callable:
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise self.too_large()
+            return message
+
+        return limited_receive
+
+
+class LimitedBodyRoute(APIRoute):
+    """APIRoute that enforces the BodyLimit declared on its endpoint"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        limit: Optional[BodyLimit] = getattr(self.endpoint, "body_limit", None)
+        if limit is None:
+            return handler
+
+        async def limited_handler(request: Request) -> Response:
+            limit.check_headers(request)
+            return await handler(Request(request.scope, limit.guard_receive(request.receive)))
+
+        return limited_handler
+
+
+TEXT_FORM_LIMIT = BodyLimit(_FORM_OVERHEAD + QUERY_MAX_CHARS * 4)
+IMAGE_FORM_LIMIT = BodyLimit(_FORM_OVERHEAD + QUERY_MAX_CHARS * 4 + IMAGE_MAX_UPLOAD_BYTES)
+
+
+# Requests (uploaded images are size- and type-checked by ingest.ingest_upload)
+
+class TextQueryForm(BaseModel):
+    query: str = Field(..., max_length=QUERY_MAX_CHARS, description="Your farming-related question")
+    session_id: Optional[str] = Field(None, max_length=128, description="Farmer or conversation ID")
+
+
+class AnalyzeForm(BaseModel):
+    image: Optional[UploadFile] = Field(None, description="Crop, soil or pest photo")
+    query: Optional[str] = Field(None, max_length=QUERY_MAX_CHARS, description="Farming question")
+    session_id: Optional[str] = Field(None, max_length=128, description="Farmer or conversation ID")
+
+
+class AnalysisJobForm(BaseModel):
+    image: Optional[UploadFile] = Field(None, description="Crop, soil or pest photo")
+    query: Optional[str] = Field(None, max_length=QUERY_MAX_CHARS, description="Farming question")
+    priority: Literal["high", "normal", "low"] = "normal"
+    callback_url: Optional[str] = Field(None, max_length=2048, description="URL the finished job is POSTed to")
+
+
+# Responses
+
+class ImageReport(BaseModel):
+    original_bytes: int
+    payload_bytes: int
+    bytes_saved: int
+    width: int
+    height: int
+    mime_type: str
+
+
+class InputType(BaseModel):
+    has_image: bool
+    has_text: bool
+
+
+class AnalysisResponse(BaseModel):
+    success: bool = True
+    message: str = "Farmer Assistant Analysis Complete"
+    input_type: InputType
+    # Answer and cache status (hit, similar, miss, bypass, knowledge, session) per model
+    responses: Dict[str, str]
+    cache: Dict[str, str]
+    image: Optional[ImageReport] = None
+
+
+class TextQueryResponse(BaseModel):
+    success: bool = True
+    message: str = "Text Query Analysis Complete"
+    query: str
+    response: str
+    model_used: str
+    cache: str
+
+
+class JobAccepted(BaseModel):
+    success: bool = True
+    job_id: str
+    status: str
+    deduplicated: bool
+    poll_url: str
+
+
+class JobStatus(BaseModel):
+    success: bool = True
+    job_id: str
+    status: str
+    created_at: float
+    finished_at: Optional[float] = None
+    result: Optional[AnalysisResponse] = None
+    error: Optional[str] = None
+
+
+class SessionForgotten(BaseModel):
+    success: bool = True
+    session_id: str
+
+
+class ModelTypes(BaseModel):
+    text_only: List[str]
+    vision: List[str]
+
+
+class HealthResponse(BaseModel):
+    status: Literal["healthy", "degraded"]
+    backends: List[Dict[str, Any]]
+    service: str
+    models_available: List[str]
+    capabilities: List[str]
+    model_types: ModelTypes
+
+
+class Capabilities(BaseModel):
+    image_analysis: List[str]
+    text_queries: List[str]
+    professional_features: List[str]
+
+
+class CapabilitiesResponse(BaseModel):
+    service: str
+    capabilities: Capabilities
+
+
+class ApiTestResponse(BaseModel):
+    status: Literal["success", "error"]
+    message: str
+    details: Optional[str] = None
+    api_key_configured: Optional[bool] = None
+    # When the upstream was actually called, and whether this answer reused that call
+    checked_at: Optional[float] = None
+    cached: Optional[bool] = None
+
+
+class LivenessResponse(BaseModel):
+    status: Literal["alive"] = "alive"
+
+
+class WarmupStep(BaseModel):
+    status: Literal["pending", "running", "done", "failed"]
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class WarmupState(BaseModel):
+    finished: bool
+    steps: Dict[str, WarmupStep]
+    # Seconds per startup phase: import, startup and warmup
+    timings: Dict[str, float]
+
+
+class ReadinessResponse(BaseModel):
+    status: Literal["ready", "not_ready"]
+    checks: Dict[str, bool]
+    warmup: WarmupState
+
+
+class BatchLine(BaseModel):
+    """One NDJSON line of a /batch response: an item result or, last, the summary"""
+    index: Optional[int] = None
+    id: Optional[str] = None
+    status: Optional[Literal["ok", "error"]] = None
+    detail: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    summary: Optional[Dict[str, int]] = None
+
+
+def event_stream_docs(description: str) -> dict:
+    """OpenAPI `responses` entry for a Server-Sent Events endpoint"""
+    return {200: {"description": description, "content": {"text/event-stream": {}}}}
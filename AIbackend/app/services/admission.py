@@ -0,0 +1,205 @@
+import contextvars
+import hmac
+import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from app.config import (
+    ADMISSION_CLIENT_QUEUE_MAX,
+    ADMISSION_DEFAULT_ROLE,
+    ADMISSION_QUEUE_MAX,
+    ADMISSION_ROLE_WEIGHTS,
+    ADMISSION_SERVICE_TOKEN,
+)
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set by the Node backend on every call it forwards, with the shared service token
+CLIENT_HEADER = "x-client-id"
+ROLE_HEADER = "x-user-role"
+SERVICE_TOKEN_HEADER = "x-service-token"
+
+_NAME_LIMIT = 64
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Who a request is made for: a client (user or device ID) and its role"""
+    client: str
+    role: str
+
+
+ANONYMOUS = Principal("anonymous", ADMISSION_DEFAULT_ROLE)
+
+_principal: contextvars.ContextVar[Optional[Principal]] = contextvars.ContextVar("farmer_principal", default=None)
+
+
+def current_principal() -> Principal:
+    return _principal.get() or ANONYMOUS
+
+
+@contextmanager
+def acting_as(principal: Principal):
+    """Attribute the upstream calls made inside the block to `principal`"""
+    token = _principal.set(principal)
+    try:
+        yield
+    finally:
+        _principal.reset(token)
+
+
+def is_trusted(headers: dict) -> bool:
+    """Whether the request carries the shared service token of a trusted caller"""
+    token = headers.get(SERVICE_TOKEN_HEADER)
+    if not ADMISSION_SERVICE_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), ADMISSION_SERVICE_TOKEN.encode("utf-8"))
+
+
+def principal_from(headers: dict, fallback_client: str) -> Principal:
+    """
+    Principal of a request from its lowercased headers.
+
+    The client and role headers are only honoured from a trusted caller
+    (see is_trusted): anyone else could claim the heaviest role or rotate
+    client IDs to dodge the per-client queue limit, so their requests are
+    attributed to their peer address at the default role. Unknown roles are
+    served at the default role's weight; a trusted request without a client
+    header is attributed to its peer address.
+    """
+    if not is_trusted(headers):
+        return Principal(fallback_client, ADMISSION_DEFAULT_ROLE)
+    role = headers.get(ROLE_HEADER, "").strip().lower()[:_NAME_LIMIT]
+    if role not in ADMISSION_ROLE_WEIGHTS:
+        role = ADMISSION_DEFAULT_ROLE
+    client = headers.get(CLIENT_HEADER, "").strip()[:_NAME_LIMIT] or fallback_client
+    return Principal(client, role)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware attributing each request, and the upstream calls it makes, to its principal"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        peer = scope.get("client")
+        with acting_as(principal_from(headers, peer[0] if peer else ANONYMOUS.client)):
+            await self.app(scope, receive, send)
+
+
+class _RoleQueue:
+    """Waiters of one role, one FIFO per client, clients served round-robin"""
+
+    __slots__ = ("weight", "position", "clients", "size")
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.position = 0.0
+        self.clients: "OrderedDict[str, Deque[Any]]" = OrderedDict()
+        self.size = 0
+
+
+class FairQueue:
+    """
+    Waiters for upstream slots, grouped by role and by client.
+
+    Roles share the slots in proportion to their weights (stride scheduling:
+    each served waiter advances its role by 1/weight and the role furthest
+    behind goes next). Within a role, clients take turns, so one client's
+    bulk sync waits behind its own queue rather than everyone else's. A role
+    that was idle rejoins at the current position instead of cashing in the
+    time it was away.
+
+    `refusal()` enforces the total and per-client depth limits before a
+    waiter is added.
+    """
+
+    def __init__(self, weights: Dict[str, float], max_depth: int, max_per_client: int):
+        self.weights = weights
+        self.max_depth = max_depth
+        self.max_per_client = max_per_client
+        self._roles: Dict[str, _RoleQueue] = {}
+        self._position = 0.0
+        self._size = 0
+
+    def _role(self, role: str) -> _RoleQueue:
+        queue = self._roles.get(role)
+        if queue is None:
+            queue = self._roles[role] = _RoleQueue(self.weights.get(role, 1.0))
+        return queue
+
+    def refusal(self, principal: Principal) -> Optional[str]:
+        """Why `principal` may not join the queue now (queue_full, client_limit), or None"""
+        if self.max_depth > 0 and self._size >= self.max_depth:
+            return "queue_full"
+        if self.max_per_client > 0:
+            queue = self._roles.get(principal.role)
+            waiting = queue.clients.get(principal.client) if queue is not None else None
+            if waiting is not None and len(waiting) >= self.max_per_client:
+                return "client_limit"
+        return None
+
+    def push(self, waiter, principal: Principal):
+        queue = self._role(principal.role)
+        if queue.size == 0:
+            queue.position = max(queue.position, self._position)
+        queue.clients.setdefault(principal.client, deque()).append(waiter)
+        queue.size += 1
+        self._size += 1
+
+    def pop(self):
+        """The next waiter by weighted turn; the queue must not be empty"""
+        queue = min((q for q in self._roles.values() if q.size), key=lambda q: q.position)
+        client, waiting = next(iter(queue.clients.items()))
+        waiter = waiting.popleft()
+        if waiting:
+            queue.clients.move_to_end(client)
+        else:
+            del queue.clients[client]
+        queue.size -= 1
+        self._size -= 1
+        self._position = queue.position
+        queue.position += 1.0 / queue.weight
+        return waiter
+
+    def discard(self, waiter, principal: Principal):
+        """Remove a waiter that gave up; a no-op when it was already served"""
+        queue = self._roles.get(principal.role)
+        waiting = queue.clients.get(principal.client) if queue is not None else None
+        if waiting is None or waiter not in waiting:
+            return
+        waiting.remove(waiter)
+        if not waiting:
+            del queue.clients[principal.client]
+        queue.size -= 1
+        self._size -= 1
+
+    def depth_by_role(self) -> Dict[str, int]:
+        return {role: queue.size for role, queue in self._roles.items() if queue.size}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+
+def waiter_queue() -> FairQueue:
+    return FairQueue(ADMISSION_ROLE_WEIGHTS, ADMISSION_QUEUE_MAX, ADMISSION_CLIENT_QUEUE_MAX)
+
+
+admission_rejected = metrics.registry.register(metrics.Counter(
+    "farmer_admission_rejected_total", "Upstream calls refused a slot, by reason (queue_full, client_limit, timeout)",
+    ("role", "reason")
+))
+admission_wait = metrics.registry.register(metrics.Histogram(
+    "farmer_admission_wait_seconds", "Time upstream calls waited for a concurrency slot, by role", ("role",)
+))
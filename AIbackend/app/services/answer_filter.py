@@ -0,0 +1,185 @@
+import json
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+
+def _automaton(words: Iterable[str]):
+    """Aho-Corasick automaton over `words`, or None when there are none"""
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+class ResponseRules:
+    """
+    Relevance keywords and phrase rewrites, compiled once at startup.
+
+    Keywords go into an Aho-Corasick automaton matched against the lowercased
+    answer, which stops at the first hit. Rewrite phrases go into a second
+    automaton matched against the answer as is; its matches are applied
+    leftmost-longest. Either way the text is scanned once, at a cost that
+    does not grow with the number of keywords and phrases (in however many
+    languages) configured. Without the pyahocorasick package both fall back
+    to one substring search per keyword or phrase.
+    """
+
+    def __init__(self, keywords: Iterable[str], replacements: Dict[str, str]):
+        self.keywords = sorted({keyword.lower() for keyword in keywords if keyword})
+        self.replacements = {old: new for old, new in replacements.items() if old}
+        longest = max([len(k) for k in self.keywords] + [len(old) for old in self.replacements] + [1])
+        # Characters a streamed answer must hold back in case a match continues in the next chunk
+        self.holdback = longest - 1
+        self._automaton = _automaton(self.keywords) if ahocorasick is not None else None
+        self._rewrite_automaton = _automaton(self.replacements) if ahocorasick is not None else None
+
+    def is_relevant(self, text: str) -> bool:
+        lowered = text.lower()
+        if self._automaton is None:
+            return any(keyword in lowered for keyword in self.keywords)
+        for _ in self._automaton.iter(lowered):
+            return True
+        return False
+
+    def _rewrite_spans(self, text: str) -> list:
+        """(start, end, phrase) of the rewrite phrases in `text`, leftmost-longest and non-overlapping"""
+        found = []
+        if self._rewrite_automaton is not None:
+            # iter() reports every match, overlapping ones included, by end position
+            for last, phrase in self._rewrite_automaton.iter(text):
+                found.append((last - len(phrase) + 1, -len(phrase), phrase))
+        elif ahocorasick is None:
+            for phrase in self.replacements:
+                start = text.find(phrase)
+                while start != -1:
+                    found.append((start, -len(phrase), phrase))
+                    start = text.find(phrase, start + 1)
+        spans = []
+        position = 0
+        for start, negative_length, phrase in sorted(found):
+            if start >= position:
+                spans.append((start, start - negative_length, phrase))
+                position = start - negative_length
+        return spans
+
+    def clean(self, text: str) -> str:
+        return self.scan(text, len(text))[0]
+
+    def check_and_clean(self, text: str) -> Optional[str]:
+        """Clean an answer, or return None when it has no agricultural keyword"""
+        if not self.is_relevant(text):
+            return None
+        return self.clean(text)
+
+    def scan(self, text: str, end: int) -> Tuple[str, int]:
+        """
+        Rewrite the phrases of `text` that start before `end`.
+
+        Returns the cleaned text up to the cut point and the cut point itself:
+        `end`, or later when a phrase straddles it.
+        """
+        out = []
+        position = 0
+        for start, stop, phrase in self._rewrite_spans(text):
+            if start >= end:
+                break
+            out.append(text[position:start])
+            out.append(self.replacements[phrase])
+            position = stop
+        cut = max(end, position)
+        out.append(text[position:cut])
+        return "".join(out), cut
+
+    def stream(self) -> "StreamingAnswerFilter":
+        return StreamingAnswerFilter(self)
+
+
+class StreamingAnswerFilter:
+    """
+    Apply a ResponseRules check-and-clean to a streamed answer.
+
+    Each chunk is scanned as it arrives rather than the whole answer at the
+    end. Nothing is released until a keyword shows the answer is
+    agricultural, and the last `holdback` characters are always kept back so
+    a keyword or phrase split across two chunks is still found.
+    """
+
+    def __init__(self, rules: ResponseRules):
+        self.rules = rules
+        self.relevant = False
+        self._pending = ""
+        self._held = []
+        self._released = []
+
+    @property
+    def answer(self) -> str:
+        """Everything released so far"""
+        return "".join(self._released)
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the cleaned text that is safe to send"""
+        self._pending += chunk
+        return self._advance(len(self._pending) - self.rules.holdback)
+
+    def finish(self) -> Optional[str]:
+        """Return the remaining text, or None if the answer never became agricultural"""
+        text = self._advance(len(self._pending))
+        return text if self.relevant else None
+
+    def _advance(self, safe: int) -> str:
+        if not self.relevant:
+            # Only the held-back tail is looked at twice, so relevance costs one pass overall
+            self.relevant = self.rules.is_relevant(self._pending)
+        if safe > 0:
+            cleaned, cut = self.rules.scan(self._pending, safe)
+            self._pending = self._pending[cut:]
+            self._held.append(cleaned)
+        if not self.relevant:
+            return ""
+        text = "".join(self._held)
+        self._held = []
+        self._released.append(text)
+        return text
+
+
+def load_rules(keywords: Iterable[str], replacements: Dict[str, str], path: Optional[str] = None) -> ResponseRules:
+    """
+    Compile the built-in keywords and rewrites plus those of a JSON rules file.
+
+    The file holds `{"keywords": [...], "replacements": {old: new}}`, usually
+    with entries per language. A missing or malformed file is logged and the
+    built-in rules are used alone.
+    """
+    keywords = list(keywords)
+    replacements = dict(replacements)
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                extra = json.load(f)
+            keywords.extend(extra.get("keywords", []))
+            replacements.update(extra.get("replacements", {}))
+        except FileNotFoundError:
+            logger.warning(f"Response rules file {path} not found, using built-in rules only")
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Could not load response rules from {path}: {str(e)}")
+
+    if ahocorasick is None:
+        logger.warning("pyahocorasick not installed, falling back to per-keyword and per-phrase scans of answers")
+    started = time.perf_counter()
+    rules = ResponseRules(keywords, replacements)
+    logger.info(
+        f"Compiled {len(rules.keywords)} keywords and {len(rules.replacements)} rewrites "
+        f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+    return rules
@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from app.config import (
+    BACKEND_ERROR_THRESHOLD,
+    BACKEND_EWMA_ALPHA,
+    BACKEND_PROBE_INTERVAL,
+    GEMINI_API_KEY,
+    GEMINI_API_URL,
+    GEMINI_STREAM_URL,
+    UPSTREAM_BACKENDS,
+    UPSTREAM_HEDGE_MIN_SAMPLES,
+)
+from app.services import metrics
+from app.services.guard import OPEN, UpstreamGuard
+
+logger = logging.getLogger(__name__)
+
+GEMINI = "gemini"
+OPENAI = "openai"
+TEXT = "text"
+VISION = "vision"
+
+_RECENT_LATENCIES = 200
+
+
+def needs_vision(payload: dict) -> bool:
+    """Whether a generateContent payload carries an image"""
+    return any(
+        "inline_data" in part
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def to_chat_messages(payload: dict) -> list:
+    """Translate a generateContent payload into OpenAI chat messages"""
+    messages = []
+    for content in payload.get("contents", []):
+        parts = []
+        for part in content.get("parts", []):
+            if "text" in part:
+                parts.append({"type": "text", "text": part["text"]})
+            elif "inline_data" in part:
+                data = part["inline_data"]
+                parts.append({
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{data['mime_type']};base64,{data['data']}"}
+                })
+        if len(parts) == 1 and parts[0]["type"] == "text":
+            messages.append({"role": "user", "content": parts[0]["text"]})
+        else:
+            messages.append({"role": "user", "content": parts})
+    return messages
+
+
+class LatencyStats:
+    """EWMA latency and error rate of one backend for one capability"""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.last_failure = 0.0
+        self.calls = 0
+        self._recent = deque(maxlen=_RECENT_LATENCIES)
+
+    def observe(self, seconds: float, ok: bool):
+        self.calls += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.last_failure = time.monotonic()
+            return
+        self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+        self._recent.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self._recent) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+
+    def state(self) -> dict:
+        p95 = self.p95()
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "calls": self.calls,
+        }
+
+
+class Backend:
+    """
+    One upstream that can answer generateContent-style payloads.
+
+    `gemini` backends take the payload as is; `openai` backends (OpenAI,
+    Groq, vLLM, Ollama or any other chat completions endpoint, including a
+    local stand-in) get it translated to chat messages. Each backend has its
+    own guard, so a failing or rate-limited backend is shed without
+    blocking the others.
+    """
+
+    def __init__(self, name: str, kind: str, url: str, capabilities: Iterable[str],
+                 api_key: Optional[str] = None, model: Optional[str] = None, stream_url: Optional[str] = None):
+        if kind not in (GEMINI, OPENAI):
+            raise ValueError(f"Backend {name}: unknown type {kind!r}")
+        self.name = name
+        self.kind = kind
+        self.url = url
+        self.stream_url = stream_url or (url.replace(":generateContent", ":streamGenerateContent") if kind == GEMINI else url)
+        self.api_key = api_key
+        self.model = model
+        self.capabilities = frozenset(capabilities)
+        self.guard = UpstreamGuard()
+        self.stats: Dict[str, LatencyStats] = {
+            capability: LatencyStats(BACKEND_EWMA_ALPHA) for capability in self.capabilities
+        }
+
+    @property
+    def configured(self) -> bool:
+        # Gemini always needs a key; a local OpenAI-compatible server may not
+        return bool(self.api_key) or self.kind == OPENAI
+
+    def healthy(self, capability: str) -> bool:
+        """Breaker closed and error rate acceptable, or long enough since the last failure to probe again"""
+        if self.guard.breaker.state == OPEN:
+            return False
+        stats = self.stats[capability]
+        return (
+            stats.error_rate < BACKEND_ERROR_THRESHOLD
+            or time.monotonic() - stats.last_failure > BACKEND_PROBE_INTERVAL
+        )
+
+    def request(self, payload: dict, stream: bool = False) -> dict:
+        """Keyword arguments for httpx to send `payload` to this backend"""
+        if self.kind == GEMINI:
+            params = {"key": self.api_key}
+            if stream:
+                params["alt"] = "sse"
+            return {"url": self.stream_url if stream else self.url, "params": params, "json": payload}
+        body = {"model": self.model, "messages": to_chat_messages(payload)}
+        if stream:
+            body["stream"] = True
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+        return {"url": self.stream_url if stream else self.url, "headers": headers, "json": body}
+
+    async def post(self, client: httpx.AsyncClient, payload: dict, timeout: float) -> httpx.Response:
+        return await client.post(timeout=timeout, **self.request(payload))
+
+    def extract_text(self, result: dict) -> str:
+        """Pull the answer text out of a complete response"""
+        if self.kind == GEMINI:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        return result["choices"][0]["message"]["content"]
+
+    def extract_stream_text(self, data: str) -> str:
+        """Text of one SSE `data:` payload, which may be empty"""
+        if self.kind == OPENAI and data == "[DONE]":
+            return ""
+        result = json.loads(data)
+        if self.kind == GEMINI:
+            candidates = result.get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts", [])
+            return "".join(part.get("text", "") for part in parts)
+        choices = result.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content") or ""
+
+    def state(self) -> dict:
+        return {
+            "name": self.name,
+            "type": self.kind,
+            "model": self.model,
+            "capabilities": sorted(self.capabilities),
+            "configured": self.configured,
+            "healthy": {capability: self.healthy(capability) for capability in sorted(self.capabilities)},
+            "stats": {capability: stats.state() for capability, stats in sorted(self.stats.items())},
+            "guard": self.guard.state(),
+        }
+
+
+class BackendRegistry:
+    """The configured backends, and the choice of which one serves a call"""
+
+    def __init__(self, backends: List[Backend]):
+        if not backends:
+            raise ValueError("At least one upstream backend is required")
+        self.backends = backends
+
+    def configured(self) -> bool:
+        return any(backend.configured for backend in self.backends)
+
+    def candidates(self, capability: str, exclude: Iterable[Backend] = ()) -> List[Backend]:
+        """
+        Backends able to serve `capability`, fastest first.
+
+        Healthy backends come before unhealthy ones; a backend without
+        samples yet sorts first so it gets measured.
+        """
+        excluded = set(exclude)
+        eligible = [
+            backend for backend in self.backends
+            if capability in backend.capabilities and backend.configured and backend not in excluded
+        ]
+
+        def rank(backend: Backend):
+            latency = backend.stats[capability].latency
+            return (not backend.healthy(capability), latency if latency is not None else 0.0)
+
+        return sorted(eligible, key=rank)
+
+    def choose(self, capability: str, exclude: Iterable[Backend] = ()) -> Optional[Backend]:
+        ranked = self.candidates(capability, exclude)
+        return ranked[0] if ranked else None
+
+    def state(self) -> List[dict]:
+        return [backend.state() for backend in self.backends]
+
+
+def load_backends(spec: str) -> List[Backend]:
+    """
+    Backends from UPSTREAM_BACKENDS: a JSON list, or the path of a file holding one.
+
+    Each entry has `name`, `type` (gemini or openai), `url`, optional
+    `stream_url` and `model`, `capabilities` (text and/or vision) and the API
+    key either inline as `api_key` or, preferably, named by `api_key_env`.
+    Without a spec the single Gemini backend of GEMINI_API_URL is used.
+    """
+    if not spec.strip():
+        return [Backend(GEMINI, GEMINI, GEMINI_API_URL, (TEXT, VISION), GEMINI_API_KEY, stream_url=GEMINI_STREAM_URL)]
+    if not spec.lstrip().startswith("["):
+        with open(spec, encoding="utf-8") as f:
+            spec = f.read()
+    backends = []
+    for entry in json.loads(spec):
+        api_key = entry.get("api_key")
+        if not api_key and entry.get("api_key_env"):
+            api_key = os.getenv(entry["api_key_env"])
+        backends.append(Backend(
+            name=entry["name"],
+            kind=entry.get("type", GEMINI),
+            url=entry["url"],
+            capabilities=entry.get("capabilities", (TEXT,)),
+            api_key=api_key,
+            model=entry.get("model"),
+            stream_url=entry.get("stream_url"),
+        ))
+    return backends
+
+
+registry = BackendRegistry(load_backends(UPSTREAM_BACKENDS))
+logger.info(f"Upstream backends: {', '.join(f'{b.name} ({b.kind}, {sorted(b.capabilities)})' for b in registry.backends)}")
+
+
+def _per_backend(value) -> dict:
+    return {(backend.name,): value(backend) for backend in registry.backends}
+
+
+metrics.registry.register(metrics.Gauge(
+    "farmer_upstream_in_flight", "Upstream calls currently holding a slot", ("backend",),
+    callback=lambda: _per_backend(lambda b: b.guard.limiter.in_flight)
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_upstream_queued", "Upstream calls waiting for a slot", ("backend",),
+    callback=lambda: _per_backend(lambda b: b.guard.limiter.queued)
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_admission_queued", "Upstream calls waiting for a slot, by role", ("backend", "role"),
+    callback=lambda: {
+        (backend.name, role): depth
+        for backend in registry.backends for role, depth in backend.guard.limiter.queued_by_role().items()
+    }
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_upstream_concurrency_limit", "Current adaptive upstream concurrency limit", ("backend",),
+    callback=lambda: _per_backend(lambda b: int(b.guard.limiter.limit))
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_upstream_circuit_open", "1 while the backend's circuit breaker is open", ("backend",),
+    callback=lambda: _per_backend(lambda b: int(b.guard.breaker.state == OPEN))
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_backend_latency_seconds", "EWMA latency of successful calls per backend and capability",
+    ("backend", "capability"),
+    callback=lambda: {
+        (backend.name, capability): stats.latency
+        for backend in registry.backends for capability, stats in backend.stats.items()
+        if stats.latency is not None
+    }
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_backend_error_rate", "EWMA error rate per backend and capability", ("backend", "capability"),
+    callback=lambda: {
+        (backend.name, capability): stats.error_rate
+        for backend in registry.backends for capability, stats in backend.stats.items()
+    }
+))
+hedges = metrics.registry.register(metrics.Counter(
+    "farmer_upstream_hedges_total", "Second requests sent because the first passed its backend's p95",
+    ("model", "backend")
+))
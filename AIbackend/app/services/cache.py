@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from app.config import (
+    CACHE_DB_PATH,
+    CACHE_ENABLED,
+    CACHE_MAX_ENTRIES,
+    CACHE_PURGE_CHECK_INTERVAL,
+    CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?;:\"'"
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a farmer query so trivially different spellings share a key"""
+    return _WHITESPACE.sub(" ", text.lower()).strip(_EDGE_PUNCTUATION)
+
+
+def make_key(model: str, prompt_version: str, query: str) -> str:
+    """Build the cache key for a query answered by a model with a given prompt"""
+    raw = f"{prompt_version}\x1f{model}\x1f{normalize_query(query)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """Bounded in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        created_at, value = item
+        if time.time() - created_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, created_at: Optional[float] = None):
+        self._entries[key] = (created_at if created_at is not None else time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> bool:
+        return self._entries.pop(key, None) is not None
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskTier:
+    """
+    SQLite-backed tier shared by every uvicorn worker on the host.
+
+    WAL mode lets readers in other workers proceed while one worker writes.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        # Bumped by every purge so other workers know to drop their in-memory copies
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('purge_generation', 0)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[0] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, model: str, query: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, query, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, query, value, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def clear(self, model: Optional[str] = None) -> int:
+        with self._lock:
+            if model:
+                cursor = self._conn.execute("DELETE FROM responses WHERE model = ?", (model,))
+            else:
+                cursor = self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            return cursor.rowcount
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT value FROM cache_meta WHERE name = 'purge_generation'"
+            ).fetchone()[0]
+
+    def bump_generation(self) -> int:
+        with self._lock:
+            self._conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'purge_generation'")
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT value FROM cache_meta WHERE name = 'purge_generation'"
+            ).fetchone()[0]
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def entries(self, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, model, query, created_at, LENGTH(value) FROM responses "
+                "ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"key": key, "model": model, "query": query, "created_at": created_at, "size": size}
+            for key, model, query, created_at, size in rows
+        ]
+
+    def recent(self, limit: int) -> list:
+        """Newest unexpired (key, model, query, value) rows"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, model, query, value FROM responses WHERE created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?", (time.time() - self.ttl, limit)
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of cleaned answers: in-memory LRU in front of SQLite.
+
+    A purge is recorded as a new purge generation in SQLite. Every worker
+    checks the generation at most once per `purge_check_interval` seconds and,
+    when another worker purged, drops its memory tier and runs the
+    `on_purge` callbacks (which clear the per-process similarity and image
+    indexes), so a purged answer stops being served everywhere within that
+    interval.
+    """
+
+    def __init__(self, enabled: bool, max_entries: int, ttl: float, db_path: Optional[str],
+                 purge_check_interval: float = 1.0):
+        self.enabled = enabled
+        self.memory = MemoryTier(max_entries, ttl)
+        self.disk: Optional[DiskTier] = None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.purge_check_interval = purge_check_interval
+        self.remote_purges = 0
+        self._purge_callbacks: List[Callable[[], None]] = []
+        self._generation = 0
+        self._generation_checked_at = 0.0
+        if enabled and db_path:
+            try:
+                self.disk = DiskTier(db_path, ttl)
+                self._generation = self.disk.generation()
+                self._generation_checked_at = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Persistent response cache disabled, could not open {db_path}: {e}")
+
+    def on_purge(self, callback: Callable[[], None]):
+        """Run `callback` when another worker purges, to drop state derived from cached answers"""
+        self._purge_callbacks.append(callback)
+
+    async def sync_purges(self):
+        """Catch up with purges made by other workers; cheap when called more often than the check interval"""
+        if self.disk is None or time.monotonic() - self._generation_checked_at < self.purge_check_interval:
+            return
+        self._generation_checked_at = time.monotonic()
+        try:
+            generation = await asyncio.to_thread(self.disk.generation)
+        except Exception as e:
+            logger.warning(f"Response cache purge check failed: {e}")
+            return
+        if generation == self._generation:
+            return
+        self._generation = generation
+        self.remote_purges += 1
+        dropped = self.memory.clear()
+        for callback in self._purge_callbacks:
+            callback()
+        logger.info(f"Response cache purged by another worker, dropped {dropped} in-memory entries")
+
+    async def get(self, key: str) -> Tuple[Optional[str], str]:
+        """Return (value, status) where status is 'memory', 'disk' or 'miss'"""
+        if not self.enabled:
+            return None, "miss"
+        await self.sync_purges()
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits["memory"] += 1
+            return value, "memory"
+        if self.disk is not None:
+            try:
+                row = await asyncio.to_thread(self.disk.get, key)
+            except Exception as e:
+                logger.warning(f"Response cache read failed: {e}")
+                row = None
+            if row is not None:
+                created_at, value = row
+                self.memory.set(key, value, created_at)
+                self.hits["disk"] += 1
+                return value, "disk"
+        self.misses += 1
+        return None, "miss"
+
+    async def set(self, key: str, model: str, query: str, value: str):
+        if not self.enabled:
+            return
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, model, normalize_query(query), value)
+            except Exception as e:
+                logger.warning(f"Response cache write failed: {e}")
+
+    async def purge(self, key: Optional[str] = None, model: Optional[str] = None) -> dict:
+        """Drop one key, every entry of one model, or everything"""
+        if key:
+            removed_memory = int(self.memory.delete(key))
+            removed_disk = int(await asyncio.to_thread(self.disk.delete, key)) if self.disk else 0
+        else:
+            # The memory tier is not indexed by model, so a model purge clears it entirely
+            removed_memory = self.memory.clear()
+            removed_disk = await asyncio.to_thread(self.disk.clear, model) if self.disk else 0
+        if self.disk is not None:
+            self._generation = await asyncio.to_thread(self.disk.bump_generation)
+        return {"memory": removed_memory, "disk": removed_disk}
+
+    async def stats(self) -> dict:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.memory.ttl,
+            "memory": {"entries": len(self.memory), "max_entries": self.memory.max_entries},
+            "disk": {
+                "path": self.disk.path if self.disk else None,
+                "entries": await asyncio.to_thread(self.disk.count) if self.disk else 0,
+            },
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "remote_purges": self.remote_purges,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+    async def entries(self, limit: int = 50) -> list:
+        if self.disk is None:
+            return []
+        return await asyncio.to_thread(self.disk.entries, limit)
+
+    async def recent(self, limit: int) -> list:
+        """Newest persisted answers, used to warm per-process indexes"""
+        if self.disk is None:
+            return []
+        return await asyncio.to_thread(self.disk.recent, limit)
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+response_cache = ResponseCache(
+    enabled=CACHE_ENABLED,
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL_SECONDS,
+    db_path=CACHE_DB_PATH,
+    purge_check_interval=CACHE_PURGE_CHECK_INTERVAL,
+)
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from app.config import (
+    BREAKER_COOLDOWN,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_HALF_OPEN_PROBES,
+    BREAKER_MIN_CALLS,
+    BREAKER_WINDOW,
+    UPSTREAM_CONCURRENCY_INITIAL,
+    UPSTREAM_CONCURRENCY_MAX,
+    UPSTREAM_CONCURRENCY_MIN,
+    UPSTREAM_QUEUE_TIMEOUT,
+    UPSTREAM_RATE_BURST,
+    UPSTREAM_RATE_PER_SECOND,
+)
+from app.services import admission, metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class GuardRejected(Exception):
+    """Raised when the guard refuses to send a request upstream"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Client-side quota: at most `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, max_wait: float):
+        """Take a token, waiting up to max_wait seconds for one to accrue"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                if wait > max_wait:
+                    raise GuardRejected("Upstream quota exhausted. Please wait a moment and try again.", retry_after=wait)
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+
+
+class AIMDLimiter:
+    """
+    Adaptive cap on concurrent upstream calls.
+
+    Every successful call grows the limit by roughly one per round of calls;
+    a timeout, 429 or 5xx cuts it multiplicatively. Waiters are served by
+    weighted fair turns across roles and clients (see admission.FairQueue),
+    and refused outright once the wait queue is full.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.7):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._waiters = admission.waiter_queue()
+
+    async def acquire(self, max_wait: float):
+        principal = admission.current_principal()
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            admission.admission_wait.observe(0.0, role=principal.role)
+            return
+        refusal = self._waiters.refusal(principal)
+        if refusal is not None:
+            admission.admission_rejected.inc(role=principal.role, reason=refusal)
+            raise GuardRejected("AI service is busy. Please try again shortly.", retry_after=max_wait)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.push(waiter, principal)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout=max_wait)
+        except asyncio.TimeoutError:
+            admission.admission_rejected.inc(role=principal.role, reason="timeout")
+            raise GuardRejected("AI service is busy. Please try again shortly.", retry_after=max_wait)
+        except asyncio.CancelledError:
+            # A slot handed over just before cancellation must not leak
+            if waiter.done() and not waiter.cancelled():
+                self.release(overloaded=False, adjust=False)
+            raise
+        finally:
+            self._waiters.discard(waiter, principal)
+            admission.admission_wait.observe(time.perf_counter() - started, role=principal.role)
+
+    def release(self, overloaded: bool, adjust: bool = True):
+        self.in_flight -= 1
+        if adjust:
+            if overloaded:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def queued_by_role(self) -> dict:
+        return self._waiters.depth_by_role()
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the upstream is unhealthy.
+
+    Opens when the failure rate over the last `window` calls reaches
+    `threshold` (after at least `min_calls`). After `cooldown` seconds it lets
+    a few probe calls through; one success closes it, one failure re-opens it.
+    """
+
+    def __init__(self, threshold: float, window: int, min_calls: int, cooldown: float, probes: int):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.probes = max(probes, 1)
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = 0
+        self.opened_count = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+            self._probing = 0
+            logger.info("Circuit half-open: probing upstream")
+        if self.state == HALF_OPEN:
+            if self._probing >= self.probes:
+                return False
+            self._probing += 1
+        return True
+
+    def release_probe(self):
+        """Give back a half-open probe slot that was not used to judge the upstream"""
+        if self.state == HALF_OPEN:
+            self._probing = max(self._probing - 1, 0)
+
+    def retry_after(self) -> float:
+        return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def cooling_down(self) -> bool:
+        """
+        Whether calls are refused outright right now.
+
+        Unlike `state == OPEN`, this turns false once the cooldown has passed,
+        even though the switch to half-open only happens in allow(), on the
+        next call.
+        """
+        return self.state == OPEN and self.retry_after() > 0
+
+    def record(self, success: bool):
+        if self.state == HALF_OPEN:
+            self._probing = max(self._probing - 1, 0)
+            if success:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.info("Circuit closed: upstream recovered")
+            else:
+                self._open()
+            return
+        self._outcomes.append(success)
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls and self.failure_rate() >= self.threshold:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+        logger.warning(f"Circuit opened: upstream failing, pausing calls for {self.cooldown}s")
+
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+
+def is_overload(e: BaseException) -> bool:
+    """Whether a failure means the upstream is struggling rather than the request being bad"""
+    if isinstance(e, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+
+class UpstreamGuard:
+    """Circuit breaker, quota bucket and adaptive concurrency limit in front of the upstream"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            BREAKER_FAILURE_THRESHOLD, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_COOLDOWN, BREAKER_HALF_OPEN_PROBES
+        )
+        self.bucket = TokenBucket(UPSTREAM_RATE_PER_SECOND, UPSTREAM_RATE_BURST)
+        self.limiter = AIMDLimiter(UPSTREAM_CONCURRENCY_INITIAL, UPSTREAM_CONCURRENCY_MIN, UPSTREAM_CONCURRENCY_MAX)
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, label: str = ""):
+        """Hold one upstream slot for the duration of a call and record how it went"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise GuardRejected(
+                "AI service is temporarily unavailable. Please try again later.",
+                retry_after=self.breaker.retry_after()
+            )
+        try:
+            with metrics.span("upstream_queue", label):
+                # The fair queue decides who goes next, so the quota is taken
+                # after the slot rather than in arrival order ahead of it
+                await self.limiter.acquire(UPSTREAM_QUEUE_TIMEOUT)
+                try:
+                    await self.bucket.acquire(UPSTREAM_QUEUE_TIMEOUT)
+                except BaseException:
+                    self.limiter.release(overloaded=False, adjust=False)
+                    raise
+        except BaseException:
+            self.breaker.release_probe()
+            self.rejected += 1
+            raise
+
+        # True: upstream healthy, False: upstream overloaded, None: call abandoned by us
+        healthy = None
+        try:
+            yield
+            healthy = True
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except BaseException as e:
+            healthy = not is_overload(e)
+            raise
+        finally:
+            if healthy is None:
+                self.breaker.release_probe()
+            else:
+                self.breaker.record(healthy)
+            self.limiter.release(overloaded=healthy is False, adjust=healthy is not None)
+
+    def state(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "failure_rate": round(self.breaker.failure_rate(), 3),
+            "times_opened": self.breaker.opened_count,
+            "retry_after": round(self.breaker.retry_after(), 1) if self.breaker.state == OPEN else 0,
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "queued_by_role": self.limiter.queued_by_role(),
+            "quota_tokens": round(self.bucket.tokens, 2) if self.bucket.rate > 0 else None,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,145 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from app.config import (
+    IMAGE_CACHE_ENABLED,
+    IMAGE_CACHE_MAX_DISTANCE,
+    IMAGE_CACHE_MAX_ENTRIES,
+)
+from app.services.cache import normalize_query
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# numpy and PIL are imported on first use (or by the startup warm-up) to keep them off the cold start path
+
+logger = logging.getLogger(__name__)
+
+_PHASH_SIZE = 32
+_PHASH_BITS = 8
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int):
+    """Orthonormal DCT-II basis, so a 2-D DCT is two matrix products"""
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def _bit_weights(bits: int):
+    import numpy as np
+
+    return np.uint64(1) << np.arange(bits, dtype=np.uint64)
+
+
+def phash(img: "Image.Image") -> int:
+    """64-bit perceptual hash from the low-frequency DCT coefficients"""
+    import numpy as np
+    from PIL import Image
+
+    dct = _dct_matrix(_PHASH_SIZE)
+    gray = img.convert("L").resize((_PHASH_SIZE, _PHASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (dct @ pixels @ dct.T)[:_PHASH_BITS, :_PHASH_BITS].ravel()
+    # The DC term only reflects overall brightness, so leave it out of the median
+    bits = low > np.median(low[1:])
+    return int(np.sum(_bit_weights(_PHASH_BITS * _PHASH_BITS)[bits], dtype=np.uint64))
+
+
+def content_digest(content: bytes) -> str:
+    """Exact identity of an upload's bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class ImageResultIndex:
+    """
+    Perceptual-hash index of analysed images and their cleaned answers.
+
+    Hashes live in one contiguous uint64 array so a lookup is a single
+    vectorized XOR + popcount over every stored entry.
+    """
+
+    def __init__(self, enabled: bool, max_distance: int, max_entries: int):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, int], str]" = OrderedDict()
+        self._keys: list = []
+        self._hashes = None
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _rebuild(self):
+        import numpy as np
+
+        self._keys = list(self._entries)
+        self._hashes = np.fromiter((key[2] for key in self._keys), dtype=np.uint64, count=len(self._keys))
+        self._dirty = False
+
+    def add(self, namespace: str, query: Optional[str], image_hash: int, answer: str):
+        if not self.enabled:
+            return
+        key = (namespace, normalize_query(query or ""), image_hash)
+        self._entries[key] = answer
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def lookup(self, namespace: str, query: Optional[str], image_hash: int) -> Optional[Tuple[str, int]]:
+        """Return (answer, Hamming distance) of the closest compatible image"""
+        if not self.enabled or not self._entries:
+            return None
+        import numpy as np
+
+        if self._dirty:
+            self._rebuild()
+        distances = np.bitwise_count(self._hashes ^ np.uint64(image_hash))
+        close = np.flatnonzero(distances <= self.max_distance)
+        wanted_query = normalize_query(query or "")
+        best = None
+        for position in close[np.argsort(distances[close], kind="stable")]:
+            key = self._keys[position]
+            if key[0] == namespace and key[1] == wanted_query and key in self._entries:
+                best = (key, int(distances[position]))
+                break
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        key, distance = best
+        self._entries.move_to_end(key)
+        return self._entries[key], distance
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._dirty = True
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_distance": self.max_distance,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+image_index = ImageResultIndex(
+    enabled=IMAGE_CACHE_ENABLED,
+    max_distance=IMAGE_CACHE_MAX_DISTANCE,
+    max_entries=IMAGE_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,203 @@
+import asyncio
+import base64
+import contextvars
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+
+from app.config import (
+    IMAGE_ALLOWED_TYPES,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_MAX_PIXELS,
+    IMAGE_MAX_UPLOAD_BYTES,
+    IMAGE_MEMO_ENTRIES,
+    IMAGE_OUTPUT_FORMAT,
+    IMAGE_QUALITY,
+    IMAGE_WORKERS,
+)
+from app.services import image_hash, metrics
+
+logger = logging.getLogger(__name__)
+
+_READ_CHUNK = 64 * 1024
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+class IngestError(Exception):
+    """Raised when an upload cannot be turned into a model payload"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass
+class IngestedImage:
+    """An upload after validation, orientation fix and downscaling"""
+    encoded: str
+    mime_type: str
+    perceptual_hash: int
+    width: int
+    height: int
+    original_bytes: int
+    payload_bytes: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(self.original_bytes - self.payload_bytes, 0)
+
+    def report(self) -> dict:
+        return {
+            "original_bytes": self.original_bytes,
+            "payload_bytes": self.payload_bytes,
+            "bytes_saved": self.bytes_saved,
+            "width": self.width,
+            "height": self.height,
+            "mime_type": self.mime_type,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-ingest")
+# Bounds queued work as well as running work, so a burst of uploads cannot pile up decoded images
+_slots = asyncio.Semaphore(IMAGE_WORKERS * 2)
+_memo: "OrderedDict[str, IngestedImage]" = OrderedDict()
+stats = {"processed": 0, "memo_hits": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = IMAGE_MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, giving up as soon as it exceeds max_bytes"""
+    if upload.size is not None and upload.size > max_bytes:
+        raise IngestError(f"Image too large: limit is {max_bytes} bytes", status_code=413)
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(_READ_CHUNK)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise IngestError(f"Image too large: limit is {max_bytes} bytes", status_code=413)
+    if not buffer:
+        raise IngestError("Empty image file")
+    return bytes(buffer)
+
+
+def process_image(content: bytes) -> IngestedImage:
+    """
+    Decode, orient and downscale an upload, then re-encode it for the model.
+
+    Runs in the ingest thread pool. The original bytes are kept when
+    re-encoding would not make them smaller and they carry no metadata.
+    """
+    # Imported here so replicas that never see an image do not pay for PIL at startup
+    from PIL import Image, ImageOps
+
+    try:
+        with metrics.span("image_decode"):
+            img = Image.open(io.BytesIO(content))
+            # Image.open only reads the header, so this runs before any pixels are decoded
+            width, height = img.size
+            if width * height > IMAGE_MAX_PIXELS:
+                raise IngestError(
+                    f"Image too large: {width}x{height} pixels, limit is {IMAGE_MAX_PIXELS} pixels",
+                    status_code=413
+                )
+            source_format = img.format
+            # Let the JPEG decoder scale down while decoding instead of after
+            img.draft("RGB", (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+            img.load()
+    except IngestError:
+        raise
+    except Exception as e:
+        raise IngestError(f"Invalid image format: {str(e)}")
+
+    # EXIF and XMP can carry the farmer's GPS position, and an orientation tag
+    # means the stored pixels are not what the farmer saw: such an upload is
+    # never forwarded as is
+    carries_metadata = bool(img.getexif()) or any(key in img.info for key in ("exif", "xmp", "XML:com.adobe.xmp"))
+    img = ImageOps.exif_transpose(img)
+    with metrics.span("image_hash"):
+        perceptual_hash = image_hash.phash(img)
+
+    with metrics.span("image_encode"):
+        needs_resize = max(img.size) > IMAGE_MAX_DIMENSION
+        if needs_resize:
+            img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+        payload = output.getvalue()
+    mime_type = _MIME_TYPES.get(IMAGE_OUTPUT_FORMAT, "image/jpeg")
+
+    if (not needs_resize and not carries_metadata and len(payload) >= len(content)
+            and source_format in _MIME_TYPES):
+        payload = content
+        mime_type = _MIME_TYPES[source_format]
+
+    with metrics.span("base64"):
+        encoded = base64.b64encode(payload).decode("ascii")
+    return IngestedImage(
+        encoded=encoded,
+        mime_type=mime_type,
+        perceptual_hash=perceptual_hash,
+        width=img.width,
+        height=img.height,
+        original_bytes=len(content),
+        payload_bytes=len(payload),
+    )
+
+
+async def ingest_upload(upload: UploadFile) -> IngestedImage:
+    """Read an upload with a size cap and prepare it off the event loop"""
+    content_type = (upload.content_type or "").split(";")[0].strip().lower()
+    if IMAGE_ALLOWED_TYPES and content_type and content_type not in IMAGE_ALLOWED_TYPES:
+        raise IngestError(f"Unsupported image type {content_type}", status_code=415)
+    with metrics.span("upload_read"):
+        content = await read_upload(upload)
+    return await ingest_bytes(content)
+
+
+async def ingest_bytes(content: bytes) -> IngestedImage:
+    """Prepare already-read image bytes off the event loop"""
+    if not content:
+        raise IngestError("Empty image file")
+    if len(content) > IMAGE_MAX_UPLOAD_BYTES:
+        raise IngestError(f"Image too large: limit is {IMAGE_MAX_UPLOAD_BYTES} bytes", status_code=413)
+    digest = image_hash.content_digest(content)
+    ingested = _memo.get(digest)
+    if ingested is not None:
+        # Byte-identical re-sends reuse the earlier decode and re-encode
+        _memo.move_to_end(digest)
+        stats["memo_hits"] += 1
+    else:
+        with metrics.span("image_queue"):
+            await _slots.acquire()
+        try:
+            with metrics.span("image_process"):
+                loop = asyncio.get_running_loop()
+                # Carry the request's trace into the worker so its stage spans reach Server-Timing
+                context = contextvars.copy_context()
+                ingested = await loop.run_in_executor(_executor, context.run, process_image, content)
+        finally:
+            _slots.release()
+        _memo[digest] = ingested
+        while len(_memo) > IMAGE_MEMO_ENTRIES:
+            _memo.popitem(last=False)
+        stats["processed"] += 1
+
+    stats["bytes_in"] += ingested.original_bytes
+    stats["bytes_out"] += ingested.payload_bytes
+    logger.info(
+        f"Image ingested: {ingested.original_bytes} -> {ingested.payload_bytes} bytes "
+        f"({ingested.width}x{ingested.height}, saved {ingested.bytes_saved})"
+    )
+    return ingested
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,484 @@
+import asyncio
+import hashlib
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import (
+    ANALYZE_TOTAL_BUDGET,
+    JOB_CALLBACK_ALLOWED_HOSTS,
+    JOB_CALLBACK_RETRIES,
+    JOB_CALLBACK_TIMEOUT,
+    JOB_DB_PATH,
+    JOB_QUEUE_MAX,
+    JOB_TTL_SECONDS,
+    JOB_WORKERS,
+)
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+_PURGE_INTERVAL = 600
+_RECOVER_INTERVAL = 60
+
+
+class JobError(Exception):
+    """Raised when a job cannot be submitted or found"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def content_key(*parts: str) -> str:
+    """Identity of a job's inputs, so identical submissions share one job"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+async def check_callback_url(url: str) -> str:
+    """
+    Accept only http(s) callbacks to public addresses, or to the hosts of
+    JOB_CALLBACK_ALLOWED_HOSTS when an allowlist is set.
+
+    Hosts on the allowlist are trusted as configured, private ones included
+    (e.g. the Node backend on localhost). Any other host must resolve only
+    to public addresses, so a caller cannot make the service POST to
+    loopback, link-local (cloud metadata) or internal addresses.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise JobError("callback_url must be an http or https URL")
+    host = parsed.hostname.lower()
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if host not in JOB_CALLBACK_ALLOWED_HOSTS:
+            raise JobError(f"callback_url host {host} is not allowed")
+        return url
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError) as e:
+        raise JobError(f"callback_url host {host} cannot be resolved: {str(e)}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if not address.is_global:
+            raise JobError(f"callback_url host {host} is not a public address")
+    return url
+
+
+class JobStore:
+    """
+    SQLite store of jobs, their inputs and results.
+
+    Inputs are kept until the job finishes, so queued work survives a
+    restart; finished jobs are kept for JOB_TTL_SECONDS.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " content_key TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " priority INTEGER NOT NULL,"
+            " inputs TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_content_key ON jobs (content_key)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_callbacks ("
+            " job_id TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, url))"
+        )
+        self._conn.commit()
+
+    def find_reusable(self, key: str) -> Optional[dict]:
+        """A pending or unexpired successful job with the same inputs"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE content_key = ? AND status != ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (key, FAILED, time.time() - self.ttl)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def create(self, job_id: str, key: str, priority: int, inputs: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, content_key, status, priority, inputs, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, QUEUED, priority, inputs, now, now)
+            )
+            self._conn.commit()
+
+    def add_callback(self, job_id: str, url: str):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO job_callbacks (job_id, url) VALUES (?, ?)", (job_id, url))
+            self._conn.commit()
+
+    def callbacks(self, job_id: str) -> list:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT url FROM job_callbacks WHERE job_id = ?", (job_id,)
+            ).fetchall()]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["finished_at"] and time.time() - row["finished_at"] > self.ttl):
+            return None
+        return dict(row)
+
+    def claim(self, job_id: str) -> Optional[str]:
+        """Mark a queued job running and return its inputs, or None if someone else took it"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), job_id, QUEUED)
+            )
+            self._conn.commit()
+            if cursor.rowcount == 0:
+                return None
+            return self._conn.execute("SELECT inputs FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def finish(self, job_id: str, result: Optional[str], error: Optional[str]):
+        now = time.time()
+        with self._lock:
+            # Inputs (possibly a whole image) are no longer needed once the job is done
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, inputs = NULL, updated_at = ?, finished_at = ? "
+                "WHERE id = ?",
+                (FAILED if error else DONE, result, error, now, now, job_id)
+            )
+            self._conn.commit()
+
+    def release(self, job_id: str):
+        """Put a running job back in the queue, e.g. when its worker is stopped mid-run"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, RUNNING)
+            )
+            self._conn.commit()
+
+    def pending(self, stale_after: float) -> list:
+        """
+        Jobs to (re)queue: everything queued, plus running jobs that have not
+        been touched for longer than any job can run, i.e. whose process died
+        without releasing them.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, RUNNING, time.time() - stale_after)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT id, priority FROM jobs WHERE status = ? ORDER BY priority, created_at", (QUEUED,)
+            ).fetchall()
+        return [(row["id"], row["priority"]) for row in rows]
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM job_callbacks WHERE job_id NOT IN (SELECT id FROM jobs)")
+            self._conn.commit()
+            return cursor.rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    Bounded priority queue of analysis jobs served by a fixed worker pool.
+
+    Submitting stores the job and returns at once. Workers take jobs in
+    priority order (then submission order), run them through the runner
+    given to start(), store the result and notify waiters and callbacks.
+    """
+
+    def __init__(self, db_path: str, ttl: float, workers: int, max_queued: int):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.store: Optional[JobStore] = None
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._deliveries = set()
+        self._queued_ids = set()
+        self._events: Dict[str, asyncio.Event] = {}
+        self._sequence = itertools.count()
+        self._runner: Optional[Callable[[dict], Awaitable[dict]]] = None
+        self.stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "callbacks_failed": 0}
+
+    async def start(self, runner: Callable[[dict], Awaitable[dict]]):
+        """Open the store, start the workers and requeue jobs left over from a previous run"""
+        try:
+            self.store = await asyncio.to_thread(JobStore, self.db_path, self.ttl)
+        except Exception as e:
+            logger.warning(f"Analysis jobs disabled, could not open {self.db_path}: {e}")
+            return
+        self._runner = runner
+        self._queue = asyncio.PriorityQueue()
+        await asyncio.to_thread(self.store.purge_expired)
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        tasks = self._tasks + list(self._deliveries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job_id: str, priority: int):
+        self._events.setdefault(job_id, asyncio.Event())
+        self._queued_ids.add(job_id)
+        self._queue.put_nowait((priority, next(self._sequence), job_id))
+
+    async def _recover(self) -> int:
+        """
+        Queue jobs that are queued in the store but not in this process:
+        left over from a previous run, released by a stopped worker, or
+        running in a process that died. Another process may queue the same
+        job; claim() lets only one of them run it.
+        """
+        # A job cannot legitimately stay running past the /analyze budget plus callbacks
+        pending = await asyncio.to_thread(self.store.pending, ANALYZE_TOTAL_BUDGET * 2)
+        requeued = 0
+        for job_id, priority in pending:
+            if job_id not in self._queued_ids:
+                self._enqueue(job_id, priority)
+                requeued += 1
+        if requeued:
+            logger.info(f"Requeued {requeued} unfinished analysis jobs")
+        return requeued
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, key: str, inputs: dict, priority: int, callback_url: Optional[str] = None) -> dict:
+        """Queue a job, or return the existing job with the same content key"""
+        if self._queue is None:
+            raise JobError("Analysis jobs are not available right now", status_code=503)
+        existing = await asyncio.to_thread(self.store.find_reusable, key)
+        if existing is not None:
+            self.stats["deduplicated"] += 1
+            job_id, deduplicated = existing["id"], True
+        else:
+            if self.depth >= self.max_queued:
+                raise JobError("Too many queued analysis jobs. Please try again later.", status_code=503)
+            job_id, deduplicated = uuid.uuid4().hex, False
+            await asyncio.to_thread(self.store.create, job_id, key, priority, json.dumps(inputs))
+            self._enqueue(job_id, priority)
+            self.stats["submitted"] += 1
+
+        if callback_url:
+            await asyncio.to_thread(self.store.add_callback, job_id, callback_url)
+            if deduplicated and existing["status"] in (DONE, FAILED):
+                # Already finished: deliver straight away instead of waiting for a worker
+                self._deliver(job_id, [callback_url])
+        job = await self.get(job_id)
+        job["deduplicated"] = deduplicated
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        """Return a job, waiting up to `wait` seconds for it to finish"""
+        if self.store is None:
+            return None
+        deadline = time.monotonic() + wait
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None or job["status"] in (DONE, FAILED):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = self._events.get(job_id)
+            if event is None:
+                # Submitted to another worker process: fall back to polling the store
+                await asyncio.sleep(min(1.0, remaining))
+            else:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        return self._public(job) if job is not None else None
+
+    @staticmethod
+    def _public(job: dict) -> dict:
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+        }
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            self._queued_ids.discard(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} worker error: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        inputs = await asyncio.to_thread(self.store.claim, job_id)
+        if inputs is None:
+            return
+        result, error = None, None
+        with metrics.span("job_run"):
+            try:
+                result = json.dumps(await self._runner(json.loads(inputs)))
+            except asyncio.CancelledError:
+                # Stopped mid-run (shutdown or restart): hand the job back instead of leaving it
+                # running forever. Written synchronously since this task is being cancelled.
+                self.store.release(job_id)
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                error = f"Internal server error: {str(e)}"
+        await asyncio.to_thread(self.store.finish, job_id, result, error)
+        self.stats["failed" if error else "completed"] += 1
+        jobs_finished.inc(status=FAILED if error else DONE)
+
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+        callbacks = await asyncio.to_thread(self.store.callbacks, job_id)
+        if callbacks:
+            self._deliver(job_id, callbacks)
+
+    def _deliver(self, job_id: str, urls: list):
+        """Notify callbacks in the background, so a slow callback URL never holds a worker"""
+        task = asyncio.create_task(self._notify(job_id, urls))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def _notify(self, job_id: str, urls: list):
+        """POST the finished job to each callback URL, retrying with backoff"""
+        job = await self.get(job_id)
+        if job is None:
+            return
+        async with httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT) as client:
+            for url in urls:
+                try:
+                    # Checked again at delivery: the host may resolve differently than at submission
+                    await check_callback_url(url)
+                except JobError as e:
+                    self.stats["callbacks_failed"] += 1
+                    logger.warning(f"Callback for job {job_id} to {url} refused: {e.message}")
+                    continue
+                delay = 1.0
+                for attempt in range(JOB_CALLBACK_RETRIES):
+                    try:
+                        response = await client.post(url, json=job)
+                        response.raise_for_status()
+                        break
+                    except httpx.HTTPError as e:
+                        if attempt == JOB_CALLBACK_RETRIES - 1:
+                            self.stats["callbacks_failed"] += 1
+                            logger.warning(f"Callback for job {job_id} to {url} failed: {str(e)}")
+                        else:
+                            await asyncio.sleep(delay)
+                            delay *= 2
+
+    async def _maintain(self):
+        """Requeue interrupted jobs every _RECOVER_INTERVAL and purge expired ones every _PURGE_INTERVAL"""
+        last_purge = time.monotonic()
+        while True:
+            await asyncio.sleep(_RECOVER_INTERVAL)
+            try:
+                await self._recover()
+            except Exception as e:
+                logger.warning(f"Job recovery failed: {e}")
+            if time.monotonic() - last_purge < _PURGE_INTERVAL:
+                continue
+            last_purge = time.monotonic()
+            try:
+                removed = await asyncio.to_thread(self.store.purge_expired)
+                if removed:
+                    logger.info(f"Purged {removed} expired analysis jobs")
+            except Exception as e:
+                logger.warning(f"Job purge failed: {e}")
+
+    async def summary(self) -> dict:
+        return {
+            "enabled": self.store is not None,
+            "workers": self.workers,
+            "queued_in_process": self.depth,
+            "max_queued": self.max_queued,
+            "stored": await asyncio.to_thread(self.store.counts) if self.store else {},
+            **self.stats,
+        }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+job_queue = JobQueue(JOB_DB_PATH, JOB_TTL_SECONDS, JOB_WORKERS, JOB_QUEUE_MAX)
+
+jobs_finished = metrics.registry.register(metrics.Counter(
+    "farmer_jobs_finished_total", "Analysis jobs finished, by outcome", ("status",)
+))
+
+metrics.registry.register(metrics.Gauge(
+    "farmer_jobs_queued", "Analysis jobs waiting for a worker in this process",
+    callback=lambda: {(): job_queue.depth}
+))
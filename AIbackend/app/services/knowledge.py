@@ -0,0 +1,308 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import (
+    KNOWLEDGE_DIRECT_COVERAGE,
+    KNOWLEDGE_DIRECT_MARGIN,
+    KNOWLEDGE_ENABLED,
+    KNOWLEDGE_GROUNDING_COVERAGE,
+    KNOWLEDGE_PATH,
+    KNOWLEDGE_TOP_K,
+)
+from app.services import metrics
+from app.services.cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = frozenset(
+    "a an and are as at be by can could do does for from how i if in is it its me my of on or should "
+    "so that the their them there these this to was what when where which who why will with would you your".split()
+)
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+# The question is what a farmer's query most resembles, so its words count double
+_QUESTION_WEIGHT = 2
+
+
+def _stem(token: str) -> str:
+    """Fold the common English plural and -ing forms so `tomatoes`/`tomato` and `sowing`/`sow` meet"""
+    if len(token) >= 6 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(token) for token in _TOKEN.findall(normalize_query(text)) if token not in _STOPWORDS]
+
+
+@dataclass
+class KnowledgeDoc:
+    """One curated question and answer"""
+    doc_id: str
+    question: str
+    answer: str
+    tags: Tuple[str, ...] = ()
+
+    def terms(self) -> List[str]:
+        return tokenize(self.question) * _QUESTION_WEIGHT + tokenize(" ".join(self.tags)) + tokenize(self.answer)
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "KnowledgeDoc":
+        if not raw.get("id") or not raw.get("question") or not raw.get("answer"):
+            raise ValueError("knowledge documents need an id, a question and an answer")
+        return cls(str(raw["id"]), raw["question"], raw["answer"], tuple(raw.get("tags") or ()))
+
+
+@dataclass
+class KnowledgeMatch:
+    doc: KnowledgeDoc
+    score: float
+    # Share of the query's term weight (IDF) found in the document
+    coverage: float
+
+
+@dataclass
+class KnowledgeResult:
+    """Ranked matches of a query; `direct` is set when the best one can be served as the answer"""
+    matches: List[KnowledgeMatch] = field(default_factory=list)
+    direct: Optional[KnowledgeDoc] = None
+
+
+class _Postings:
+    """Inverted index: term -> {doc_id: term frequency}, plus document lengths"""
+
+    def __init__(self):
+        self.docs: Dict[str, KnowledgeDoc] = {}
+        self.terms: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def add(self, doc: KnowledgeDoc):
+        if doc.doc_id in self.docs:
+            self.remove(doc.doc_id)
+        terms = doc.terms()
+        self.docs[doc.doc_id] = doc
+        self.lengths[doc.doc_id] = len(terms)
+        self.total_length += len(terms)
+        for term in terms:
+            postings = self.terms.setdefault(term, {})
+            postings[doc.doc_id] = postings.get(doc.doc_id, 0) + 1
+
+    def remove(self, doc_id: str) -> bool:
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return False
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in set(doc.terms()):
+            postings = self.terms.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.terms[term]
+        return True
+
+    def approx_bytes(self) -> int:
+        """Rough size of the index structures, not counting the document text"""
+        size = sys.getsizeof(self.terms) + sys.getsizeof(self.lengths)
+        for term, postings in self.terms.items():
+            size += sys.getsizeof(term) + sys.getsizeof(postings)
+        return size
+
+
+def read_corpus(path: str) -> List[KnowledgeDoc]:
+    """Load `{"documents": [{id, question, answer, tags}]}` from a JSON file"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return [KnowledgeDoc.from_dict(item) for item in raw.get("documents", [])]
+
+
+class KnowledgeIndex:
+    """
+    In-process BM25 index over a curated agronomy corpus.
+
+    A query that covers nearly all of its weighted terms in one document, and
+    clearly outscores the runner-up, is answered straight from that document.
+    Weaker matches are returned as snippets to ground the model prompt.
+
+    reload() rebuilds the index from the corpus file off to the side and swaps
+    it in; upsert() and remove() change single documents in place until the
+    next reload.
+    """
+
+    def __init__(self, enabled: bool, path: str, top_k: int, direct_coverage: float,
+                 direct_margin: float, grounding_coverage: float):
+        self.enabled = enabled
+        self.path = path
+        self.top_k = top_k
+        self.direct_coverage = direct_coverage
+        self.direct_margin = direct_margin
+        self.grounding_coverage = grounding_coverage
+        self._index = _Postings()
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.build_seconds = 0.0
+        self.stats_counts = {"direct": 0, "grounded": 0, "miss": 0}
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+        self.postings_scored = 0
+
+    def reload(self) -> int:
+        """Rebuild the index from the corpus file and return the number of documents"""
+        started = time.perf_counter()
+        mtime = os.path.getmtime(self.path)
+        index = _Postings()
+        for doc in read_corpus(self.path):
+            index.add(doc)
+        with self._lock:
+            self._index = index
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        self.build_seconds = time.perf_counter() - started
+        logger.info(
+            f"Knowledge index loaded {len(index.docs)} documents, {len(index.terms)} terms "
+            f"in {self.build_seconds * 1000:.1f}ms"
+        )
+        return len(index.docs)
+
+    def load(self):
+        """Initial load at startup; a missing or broken corpus leaves the index empty"""
+        if not self.enabled:
+            return
+        try:
+            self.reload()
+        except FileNotFoundError:
+            logger.warning(f"Knowledge corpus {self.path} not found, knowledge index is empty")
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Could not load knowledge corpus from {self.path}: {str(e)}")
+
+    def changed_on_disk(self) -> bool:
+        try:
+            return os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return False
+
+    async def watch(self, interval: float):
+        """Reload whenever the corpus file changes"""
+        while True:
+            await asyncio.sleep(interval)
+            if not self.changed_on_disk():
+                continue
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                # Keep serving the previous index until the file is fixed
+                self._mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                logger.warning(f"Knowledge corpus reload failed: {str(e)}")
+
+    def upsert(self, doc: KnowledgeDoc):
+        with self._lock:
+            self._index.add(doc)
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._index.remove(doc_id)
+
+    def get(self, doc_id: str) -> Optional[KnowledgeDoc]:
+        return self._index.docs.get(doc_id)
+
+    def search(self, query: str) -> KnowledgeResult:
+        """Rank documents for a query and decide whether the best one answers it outright"""
+        if not self.enabled or not query:
+            return KnowledgeResult()
+        started = time.perf_counter()
+        with metrics.span("knowledge_lookup"):
+            result = self._search(set(tokenize(query)))
+        elapsed = time.perf_counter() - started
+        self.lookup_seconds += elapsed
+        self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+
+        outcome = "direct" if result.direct else "grounded" if result.matches else "miss"
+        self.stats_counts[outcome] += 1
+        knowledge_lookups.inc(result=outcome)
+        return result
+
+    def _search(self, terms: Iterable[str]) -> KnowledgeResult:
+        with self._lock:
+            index = self._index
+            count = len(index.docs)
+            if not count or not terms:
+                return KnowledgeResult()
+            average_length = index.total_length / count
+            scores: Dict[str, float] = {}
+            covered: Dict[str, float] = {}
+            total_weight = 0.0
+            for term in terms:
+                postings = index.terms.get(term, {})
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                total_weight += idf
+                self.postings_scored += len(postings)
+                for doc_id, frequency in postings.items():
+                    norm = _K1 * (1 - _B + _B * index.lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (_K1 + 1) / (frequency + norm)
+                    covered[doc_id] = covered.get(doc_id, 0.0) + idf
+            ranked = heapq.nlargest(max(self.top_k, 2), scores.items(), key=lambda item: item[1])
+            matches = [
+                KnowledgeMatch(index.docs[doc_id], score, covered[doc_id] / total_weight)
+                for doc_id, score in ranked
+            ]
+
+        result = KnowledgeResult(matches=[m for m in matches[:self.top_k] if m.coverage >= self.grounding_coverage])
+        if matches and len(set(terms)) >= 2:
+            # A single-word query ("wheat") is a topic, not a question
+            best = matches[0]
+            runner_up = matches[1].score if len(matches) > 1 else 0.0
+            if best.coverage >= self.direct_coverage and best.score >= runner_up * self.direct_margin:
+                result.direct = best.doc
+        return result
+
+    def stats(self) -> dict:
+        lookups = sum(self.stats_counts.values())
+        with self._lock:
+            index = self._index
+            documents, terms, index_bytes = len(index.docs), len(index.terms), index.approx_bytes()
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "documents": documents,
+            "terms": terms,
+            "index_bytes": index_bytes,
+            "loaded_at": self.loaded_at,
+            "build_ms": round(self.build_seconds * 1000, 2),
+            **self.stats_counts,
+            "avg_lookup_ms": round(self.lookup_seconds * 1000 / lookups, 3) if lookups else 0.0,
+            "max_lookup_ms": round(self.max_lookup_seconds * 1000, 3),
+            "avg_postings_scored": round(self.postings_scored / lookups, 1) if lookups else 0.0,
+        }
+
+
+knowledge_index = KnowledgeIndex(
+    enabled=KNOWLEDGE_ENABLED,
+    path=KNOWLEDGE_PATH,
+    top_k=KNOWLEDGE_TOP_K,
+    direct_coverage=KNOWLEDGE_DIRECT_COVERAGE,
+    direct_margin=KNOWLEDGE_DIRECT_MARGIN,
+    grounding_coverage=KNOWLEDGE_GROUNDING_COVERAGE,
+)
+
+knowledge_lookups = metrics.registry.register(metrics.Counter(
+    "farmer_knowledge_lookups_total", "Knowledge index lookups by outcome (direct, grounded, miss)", ("result",)
+))
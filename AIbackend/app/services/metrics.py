@@ -0,0 +1,304 @@
+import contextvars
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+QUANTILES = (0.5, 0.95, 0.99)
+_RESERVOIR_SIZE = 1024
+
+
+def _quantiles(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), callback: Optional[Callable[[], dict]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # A callback returns {label-values tuple: value} and is read at scrape time
+        self._callback = callback
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        lines = self.header()
+        values = self._callback() if self._callback else self._values
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Prometheus histogram that also exports p50/p95/p99.
+
+    The quantiles come from a reservoir of the most recent observations per
+    label set and are exported as a separate `<name>_quantiles` gauge family.
+    Observations may come from the image ingest threads, hence the lock.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], list] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._recent: Dict[Tuple[str, ...], deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+                self._recent[key] = deque(maxlen=_RESERVOIR_SIZE)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._sums[key] += value
+            self._recent[key].append(value)
+
+    def quantiles(self, **labels) -> dict:
+        with self._lock:
+            return _quantiles(self._recent.get(self._key(labels), ()))
+
+    def render(self) -> list:
+        with self._lock:
+            return self._render()
+
+    def _render(self) -> list:
+        lines = self.header()
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets, self._counts[key]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += self._counts[key][-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+
+        quantile_name = f"{self.name}_quantiles"
+        lines.append(f"# HELP {quantile_name} Recent p50/p95/p99 of {self.name}")
+        lines.append(f"# TYPE {quantile_name} gauge")
+        for key in sorted(self._recent):
+            for q, value in _quantiles(self._recent[key]).items():
+                labels = _format_labels(self.labelnames, key, f'quantile="{q}"')
+                lines.append(f"{quantile_name}{labels} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "farmer_stage_seconds", "Time spent in each request stage", ("stage", "model")
+))
+http_requests = registry.register(Counter(
+    "farmer_http_requests_total", "HTTP requests by route and status", ("method", "path", "status")
+))
+http_seconds = registry.register(Histogram(
+    "farmer_http_request_seconds", "End-to-end HTTP request latency", ("method", "path")
+))
+http_in_flight = registry.register(Gauge(
+    "farmer_http_in_flight_requests", "HTTP requests currently being served"
+))
+upstream_requests = registry.register(Counter(
+    "farmer_upstream_requests_total", "Upstream attempts by model and outcome", ("model", "status")
+))
+upstream_retries = registry.register(Counter(
+    "farmer_upstream_retries_total", "Upstream attempts that were retried", ("model",)
+))
+cache_lookups = registry.register(Counter(
+    "farmer_cache_lookups_total", "Answer cache lookups by result", ("model", "result")
+))
+
+# Per-request trace: id plus accumulated stage timings, shared with tasks spawned by the request
+_trace: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("farmer_trace", default=None)
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace["trace_id"] if trace else None
+
+
+def observe_stage(stage: str, seconds: float, model: str = ""):
+    """Record time spent in a request stage in the stage histogram and the request trace"""
+    stage_seconds.observe(seconds, stage=stage, model=model)
+    trace = _trace.get()
+    if trace is not None:
+        name = f"{stage}[{model}]" if model else stage
+        trace["spans"][name] = round(trace["spans"].get(name, 0.0) + seconds, 6)
+
+
+@contextmanager
+def span(stage: str, model: str = ""):
+    """Time a block as one request stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, model)
+
+
+def _parse_trace_headers(headers: dict) -> Tuple[str, str]:
+    """Reuse the caller's W3C trace id when present so spans line up with the Node backend"""
+    match = _TRACEPARENT.match(headers.get("traceparent", "").strip())
+    if match:
+        return match.group(1), match.group(3)
+    return secrets.token_hex(16), "01"
+
+
+def server_timing(spans: dict) -> str:
+    """Server-Timing header value for trace spans, e.g. `upstream_queue.gemini-pro;dur=12.5`"""
+    return ", ".join(
+        f'{re.sub(r"[^A-Za-z0-9_.-]", "_", name.replace("[", ".").rstrip("]"))};dur={seconds * 1000:.1f}'
+        for name, seconds in spans.items()
+    )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request metrics and a per-request timing trace.
+
+    Runs around the whole response, including streamed bodies. Incoming
+    `traceparent` / `X-Request-ID` headers are honoured and echoed back so the
+    Node backend can correlate its spans with the structured trace logged here.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        trace_id, flags = _parse_trace_headers(headers)
+        request_id = headers.get("x-request-id") or trace_id
+        trace = {"trace_id": trace_id, "spans": {}}
+        token = _trace.set(trace)
+        status = {"code": 500}
+        method = scope["method"]
+        http_in_flight.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"traceparent", f"00-{trace_id}-{secrets.token_hex(8)}-{flags}".encode("latin-1")),
+                    (b"x-request-id", request_id.encode("latin-1")),
+                ]
+                if trace["spans"]:
+                    # Stages finished before the response started (all of them unless it streams),
+                    # e.g. upstream_queue (waiting for a slot) apart from upstream (the call itself)
+                    message["headers"].append((b"server-timing", server_timing(trace["spans"]).encode("latin-1")))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_requests.inc(method=method, path=path, status=status["code"])
+            http_seconds.observe(elapsed, method=method, path=path)
+            _trace.reset(token)
+            if trace["spans"]:
+                logger.info("request_trace " + json.dumps({
+                    "trace_id": trace_id,
+                    "request_id": request_id,
+                    "method": method,
+                    "path": path,
+                    "status": status["code"],
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "spans_ms": {name: round(seconds * 1000, 2) for name, seconds in trace["spans"].items()},
+                }))
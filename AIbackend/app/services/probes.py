@@ -0,0 +1,221 @@
+import asyncio
+import importlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from app.config import (
+    API_PROBE_RETRY_INTERVAL,
+    API_PROBE_TTL,
+    READINESS_REQUIRES_UPSTREAM,
+    WARMUP_CONNECTIONS,
+    WARMUP_TIMEOUT,
+)
+from app.services import backends, metrics, singleflight, upstream
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Imported lazily by the request path; loaded in a thread during warm-up instead
+HEAVY_MODULES = ("numpy", "PIL.Image", "PIL.ImageOps")
+
+
+class Warmup:
+    """
+    Startup work that runs in the background once the server is listening.
+
+    Liveness never waits for it; readiness does, so a new replica only gets
+    traffic once its caches, indexes and upstream connections are warm. A
+    step that fails or times out is logged and counts as finished: the
+    service still answers, only colder.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.steps: Dict[str, dict] = {}
+        # Seconds spent per phase: import, startup (until listening) and warmup
+        self.timings: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, phase: str, seconds: float):
+        self.timings[phase] = seconds
+        startup_seconds.set(seconds, phase=phase)
+
+    def start(self, steps: Dict[str, Callable[[], Awaitable]]):
+        """Run every step concurrently in the background"""
+        self.steps = {name: {"status": PENDING, "seconds": None, "error": None} for name in steps}
+        self._task = asyncio.create_task(self._run_all(steps))
+
+    async def _run_all(self, steps: Dict[str, Callable[[], Awaitable]]):
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run(name, step) for name, step in steps.items()))
+        self.record("warmup", time.perf_counter() - started)
+        failed = [name for name, step in self.steps.items() if step["status"] == FAILED]
+        logger.info(
+            f"Warm-up finished in {self.timings['warmup']:.2f}s"
+            + (f" ({', '.join(failed)} failed)" if failed else "")
+        )
+
+    async def _run(self, name: str, step: Callable[[], Awaitable]):
+        state = self.steps[name]
+        state["status"] = RUNNING
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), self.timeout)
+            state["status"] = DONE
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            state["status"] = FAILED
+            state["error"] = str(e) or type(e).__name__
+            logger.warning(f"Warm-up step {name} failed: {state['error']}")
+        state["seconds"] = round(time.perf_counter() - started, 3)
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.steps) and all(step["status"] in (DONE, FAILED) for step in self.steps.values())
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def state(self) -> dict:
+        return {
+            "finished": self.finished,
+            "steps": {name: dict(step) for name, step in self.steps.items()},
+            "timings": {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+        }
+
+
+async def preload_modules():
+    """Import the modules kept off the cold start path, in a thread so the loop keeps serving"""
+    await asyncio.to_thread(lambda: [importlib.import_module(name) for name in HEAVY_MODULES])
+
+
+async def warm_connections():
+    if WARMUP_CONNECTIONS and upstream.configured():
+        reached = await upstream.warm_connections()
+        logger.info(f"Pre-connected to {reached} upstream host(s)")
+
+
+def upstream_available() -> bool:
+    """
+    Whether some configured text backend would let a call through.
+
+    A breaker past its cooldown counts as available: it only moves to
+    half-open when a call is attempted, and an unready replica gets no
+    traffic to attempt one with.
+    """
+    return any(
+        backend.configured and backends.TEXT in backend.capabilities and not backend.guard.breaker.cooling_down()
+        for backend in upstream.registry.backends
+    )
+
+
+def readiness() -> Tuple[bool, Dict[str, bool]]:
+    """
+    Whether this replica should receive traffic, and the checks behind it.
+
+    The upstream checks can be left out of the decision
+    (READINESS_REQUIRES_UPSTREAM=0) for deployments that would rather keep
+    serving cached and knowledge-base answers during an upstream outage than
+    take every replica out of rotation.
+    """
+    checks = {
+        "warmup": warmup.finished,
+        "upstream_configured": upstream.configured(),
+        "upstream_available": upstream_available(),
+    }
+    if READINESS_REQUIRES_UPSTREAM:
+        return all(checks.values()), checks
+    return checks["warmup"], checks
+
+
+async def check_upstream() -> dict:
+    """One minimal call to the preferred text backend, as a /test-api result"""
+    if not upstream.configured():
+        return {
+            "status": "error",
+            "message": "API key not configured",
+            "details": "Please set GEMINI_API_KEY environment variable or configure UPSTREAM_BACKENDS",
+        }
+    payload = {
+        "contents": [{"parts": [{"text": "Hello"}]}],
+        "generationConfig": {"maxOutputTokens": 1},
+    }
+    try:
+        response = await upstream.post(payload, timeout=10)
+        response.raise_for_status()
+        return {"status": "success", "message": "API connection successful", "api_key_configured": True}
+    except httpx.TransportError:
+        return {
+            "status": "error",
+            "message": "Connection failed",
+            "details": "Unable to reach Gemini API. Check your internet connection.",
+        }
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401:
+            return {
+                "status": "error",
+                "message": "Authentication failed",
+                "details": "Invalid API key. Please check your GEMINI_API_KEY.",
+            }
+        return {"status": "error", "message": f"API error: {e.response.status_code}", "details": str(e)}
+    except Exception as e:
+        return {"status": "error", "message": "Unexpected error", "details": str(e)}
+
+
+class CachedProbe:
+    """
+    The last result of an upstream check, reused instead of calling again.
+
+    /test-api is polled by dashboards and deploy scripts; a real
+    generateContent call per poll spends quota and adds load exactly when
+    the upstream is struggling. A success is reused for `ttl` seconds and a
+    failure for `retry_interval`, and concurrent checks share one call, so
+    the upstream sees at most one probe per interval however often the
+    endpoint is polled.
+    """
+
+    def __init__(self, check: Callable[[], Awaitable[dict]], ttl: float, retry_interval: float):
+        self.check = check
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._result: Optional[dict] = None
+        self._expires = 0.0
+        self._flight = singleflight.SingleFlight()
+
+    async def result(self) -> Tuple[dict, bool]:
+        """The probe result and whether it was reused"""
+        if self._result is not None and time.monotonic() < self._expires:
+            api_probes.inc(outcome="cached")
+            return self._result, True
+        return await self._flight.do("probe", self._refresh), False
+
+    async def _refresh(self) -> dict:
+        result = await self.check()
+        result["checked_at"] = time.time()
+        self._result = result
+        self._expires = time.monotonic() + (self.ttl if result["status"] == "success" else self.retry_interval)
+        api_probes.inc(outcome=result["status"])
+        return result
+
+
+warmup = Warmup(WARMUP_TIMEOUT)
+api_probe = CachedProbe(check_upstream, API_PROBE_TTL, API_PROBE_RETRY_INTERVAL)
+
+startup_seconds = metrics.registry.register(metrics.Gauge(
+    "farmer_startup_seconds", "Seconds spent starting this process, by phase (import, startup, warmup)", ("phase",)
+))
+api_probes = metrics.registry.register(metrics.Counter(
+    "farmer_api_probes_total", "/test-api checks, by outcome (success, error, cached)", ("outcome",)
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_ready", "1 while this replica reports ready", callback=lambda: {(): int(readiness()[0])}
+))
@@ -0,0 +1,235 @@
+import logging
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.config import (
+    SESSION_ANSWER_CHARS,
+    SESSION_ENABLED,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_SUMMARIES,
+    SESSION_RECENT_TURNS,
+    SESSION_TOKEN_BUDGET,
+    SESSION_TTL_SECONDS,
+)
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9._:@-]{1,128}$")
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s|\n")
+_MARKUP = re.compile(r"[*#_`>]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class SessionError(Exception):
+    """Raised for an unusable session ID"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) without loading a tokenizer"""
+    return len(text) // 4 + 1
+
+
+def _plain(text: str) -> str:
+    return _WHITESPACE.sub(" ", _MARKUP.sub("", text)).strip()
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def summarize_turn(query: str, answer: str) -> str:
+    """One-line summary of an older turn: the question and the first sentence of the answer"""
+    first_sentence = _SENTENCE_END.split(_plain(answer), maxsplit=1)[0]
+    return f"{_clip(_plain(query), 120)} -> {_clip(first_sentence, 160)}"
+
+
+class Session:
+    """Recent turns verbatim plus one-line summaries of older ones"""
+
+    __slots__ = ("summaries", "turns", "updated_at", "size")
+
+    def __init__(self):
+        self.summaries: List[str] = []
+        self.turns: List[Tuple[str, str]] = []
+        self.updated_at = time.time()
+        self.size = 0
+
+    def add(self, query: str, answer: str, recent_turns: int, max_summaries: int, answer_chars: int):
+        self.turns.append((query, _clip(_plain(answer), answer_chars)))
+        while len(self.turns) > recent_turns:
+            self.summaries.append(summarize_turn(*self.turns.pop(0)))
+        del self.summaries[:-max_summaries]
+        self.updated_at = time.time()
+        self.size = (
+            sum(sys.getsizeof(line) for line in self.summaries)
+            + sum(sys.getsizeof(query) + sys.getsizeof(answer) for query, answer in self.turns)
+        )
+
+    def context(self, budget: int) -> Optional[str]:
+        """
+        The conversation as prompt text within `budget` tokens.
+
+        Newer material wins: the latest turns are added first, then the most
+        recent summaries, and whatever no longer fits is left out.
+        """
+        lines = []
+        used = 0
+        for query, answer in reversed(self.turns):
+            turn = f"Farmer: {query}\nAssistant: {answer}"
+            cost = estimate_tokens(turn)
+            if used + cost > budget:
+                break
+            lines.append(turn)
+            used += cost
+        else:
+            summaries = []
+            for summary in reversed(self.summaries):
+                cost = estimate_tokens(summary)
+                if used + cost > budget:
+                    break
+                summaries.append(f"- {summary}")
+                used += cost
+            if summaries:
+                lines.append("Earlier in this conversation:\n" + "\n".join(reversed(summaries)))
+        if not lines:
+            return None
+        return "CONVERSATION SO FAR (for context; answer only the new query):\n" + "\n".join(reversed(lines))
+
+
+class SessionStore:
+    """
+    Bounded in-process store of farmer conversations.
+
+    Sessions are evicted least recently used beyond max_sessions and expire
+    ttl seconds after their last turn. Each keeps `recent_turns` turns
+    verbatim (answers clipped) and compacts older turns into one-line
+    summaries, so neither memory nor prompt size grows with the length of a
+    conversation. Sessions live in the worker that served them; deployments
+    with several workers need sticky routing by session ID.
+    """
+
+    def __init__(self, enabled: bool, max_sessions: int, ttl: float, recent_turns: int,
+                 max_summaries: int, answer_chars: int, token_budget: int):
+        self.enabled = enabled
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.recent_turns = recent_turns
+        self.max_summaries = max_summaries
+        self.answer_chars = answer_chars
+        self.token_budget = token_budget
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.bytes = 0
+        self.evicted = {"lru": 0, "ttl": 0}
+
+    @staticmethod
+    def validate(session_id: str) -> str:
+        if not _SESSION_ID.match(session_id):
+            raise SessionError("session_id must be 1-128 letters, digits or . _ : @ -")
+        return session_id
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session.updated_at > self.ttl:
+            self._drop(session_id, "ttl")
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _drop(self, session_id: str, reason: Optional[str] = None):
+        session = self._sessions.pop(session_id)
+        self.bytes -= session.size
+        if reason is not None:
+            self.evicted[reason] += 1
+            sessions_evicted.inc(reason=reason)
+
+    def context(self, session_id: Optional[str], query: Optional[str]) -> Optional[str]:
+        """Conversation context for a new query, trimmed so history and query fit the token budget"""
+        if not self.enabled or not session_id:
+            return None
+        session = self._get(session_id)
+        if session is None:
+            return None
+        budget = self.token_budget - estimate_tokens(query or "")
+        history = session.context(budget) if budget > 0 else None
+        context_tokens.observe(estimate_tokens(history) if history else 0)
+        return history
+
+    def record(self, session_id: Optional[str], query: Optional[str], answer: str):
+        """Add a finished turn to a session, creating it on first use"""
+        if not self.enabled or not session_id:
+            return
+        session = self._get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = Session()
+        self.bytes -= session.size
+        session.add(query or "(image only)", answer, self.recent_turns, self.max_summaries, self.answer_chars)
+        self.bytes += session.size
+        self._expire_oldest()
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)), "lru")
+
+    def _expire_oldest(self):
+        """Drop expired sessions from the LRU end; they are the least recently updated"""
+        now = time.time()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.updated_at <= self.ttl:
+                break
+            self._drop(session_id, "ttl")
+
+    def forget(self, session_id: str) -> bool:
+        if session_id not in self._sessions:
+            return False
+        self._drop(session_id)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self.bytes,
+            "token_budget": self.token_budget,
+            "evicted": dict(self.evicted),
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+session_store = SessionStore(
+    enabled=SESSION_ENABLED,
+    max_sessions=SESSION_MAX_SESSIONS,
+    ttl=SESSION_TTL_SECONDS,
+    recent_turns=SESSION_RECENT_TURNS,
+    max_summaries=SESSION_MAX_SUMMARIES,
+    answer_chars=SESSION_ANSWER_CHARS,
+    token_budget=SESSION_TOKEN_BUDGET,
+)
+
+sessions_evicted = metrics.registry.register(metrics.Counter(
+    "farmer_sessions_evicted_total", "Conversation sessions evicted, by reason (lru, ttl)", ("reason",)
+))
+context_tokens = metrics.registry.register(metrics.Histogram(
+    "farmer_session_context_tokens", "Estimated tokens of conversation context added to a prompt",
+    buckets=(0, 50, 100, 200, 400, 800, 1600, 3200)
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_sessions_active", "Conversation sessions held in this process",
+    callback=lambda: {(): len(session_store)}
+))
+metrics.registry.register(metrics.Gauge(
+    "farmer_session_memory_bytes", "Approximate memory held by conversation sessions in this process",
+    callback=lambda: {(): session_store.bytes}
+))
@@ -0,0 +1,277 @@
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+from app.config import (
+    SIMILARITY_BANDS,
+    SIMILARITY_ENABLED,
+    SIMILARITY_MAX_ENTRIES,
+    SIMILARITY_NUM_PERM,
+    SIMILARITY_THRESHOLD,
+)
+from app.services.cache import normalize_query
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_APOSTROPHES = re.compile(r"['’]")
+# Words that flip the meaning of a question ("is it safe" vs "is it not safe");
+# contractions are matched with their apostrophe removed
+NEGATIONS = frozenset({
+    "no", "not", "never", "nor", "none", "without", "cannot", "cant", "dont", "doesnt", "didnt",
+    "isnt", "arent", "wasnt", "werent", "shouldnt", "wont", "wouldnt", "mustnt", "neednt",
+    "nahi", "nahin", "नहीं", "नही", "मत", "न",
+})
+# Crops, pests, diseases, inputs, growth stages and timing words. Shingles
+# barely change when one of these is swapped for another ("hopper in rice"
+# vs "hopper in cotton"), but the answer does, so they must match exactly
+CONTENT_WORDS = frozenset({
+    # crops
+    "rice", "paddy", "dhan", "wheat", "gehu", "gehun", "maize", "corn", "makka", "cotton", "kapas",
+    "sugarcane", "ganna", "soybean", "mustard", "sarson", "rapeseed", "chickpea", "chana", "gram",
+    "pigeonpea", "arhar", "tur", "lentil", "masoor", "moong", "urad", "groundnut", "peanut",
+    "sunflower", "sesame", "til", "bajra", "millet", "jowar", "sorghum", "ragi", "barley", "potato",
+    "tomato", "onion", "garlic", "chilli", "brinjal", "okra", "bhindi", "cabbage", "cauliflower",
+    "pea", "banana", "mango", "citrus", "grape", "pomegranate", "tea", "coffee", "jute", "turmeric",
+    "ginger", "coconut", "dhaincha", "sunhemp",
+    # pests and diseases
+    "aphid", "whitefly", "jassid", "thrip", "mite", "hopper", "planthopper", "leafhopper", "bollworm",
+    "armyworm", "borer", "termite", "nematode", "weevil", "locust", "caterpillar", "mealybug",
+    "blast", "blight", "rust", "smut", "wilt", "mildew", "rot", "curl", "mosaic", "khaira",
+    "phalaris", "weed",
+    # fertilizers and other inputs
+    "urea", "dap", "mop", "potash", "npk", "ssp", "zinc", "sulphur", "sulfur", "boron", "gypsum",
+    "lime", "compost", "vermicompost", "manure", "neem", "trichoderma", "rhizobium",
+    # growth stages
+    "nursery", "seedling", "germination", "vegetative", "tillering", "jointing", "booting",
+    "heading", "flowering", "podding", "fruiting", "grain", "milking", "maturity", "harvest",
+    "sowing", "transplanting",
+    # timing
+    "before", "after", "pre", "post", "early", "late", "kharif", "rabi", "zaid",
+})
+
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    """
+    Character n-grams of the padded query, across word boundaries.
+
+    The n-grams absorb typos and small inflection changes, and those that
+    span two words keep the set sensitive to word order ("urea better than
+    dap" is not "dap better than urea").
+    """
+    padded = f" {' '.join(_TOKEN.findall(normalize_query(text)))} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def _content_word(token: str) -> Optional[str]:
+    """The CONTENT_WORDS entry a token stands for, folding simple plurals (aphids, tomatoes)"""
+    for candidate in (token, token[:-1] if token.endswith("s") else None, token[:-2] if token.endswith("es") else None):
+        if candidate in CONTENT_WORDS:
+            return candidate
+    return None
+
+
+def exact_features(text: str) -> frozenset:
+    """
+    Numbers and negation words of a query, which must match exactly.
+
+    Shingles barely change between "10 acres" and "100 acres" or "safe" and
+    "not safe", yet those questions need different answers (a wrong dose is
+    worse than a cache miss), so a near-duplicate match requires these sets
+    to be equal.
+    """
+    normalized = _APOSTROPHES.sub("", normalize_query(text))
+    numbers = {number.replace(",", ".") for number in _NUMBER.findall(normalized)}
+    negations = {token for token in _TOKEN.findall(normalized) if token in NEGATIONS}
+    return frozenset(numbers | negations)
+
+
+def content_words(text: str) -> Tuple[str, ...]:
+    """The crop, pest, input, stage and timing words of a query, in order"""
+    words = (_content_word(token) for token in _TOKEN.findall(normalize_query(text)))
+    return tuple(word for word in words if word is not None)
+
+
+def match_key(text: str) -> Tuple[frozenset, Tuple[str, ...]]:
+    """What a candidate must share exactly with the query before its similarity counts"""
+    return exact_features(text), content_words(text)
+
+
+class MinHasher:
+    """Vectorized MinHash signatures over 32-bit shingle hashes"""
+
+    def __init__(self, num_perm: int, seed: int = 1):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._mask = np.uint64(0xFFFFFFFF)
+
+    def signature(self, items: Set[str]) -> "np.ndarray":
+        import numpy as np
+
+        if not items:
+            return np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint32)
+        hashes = np.fromiter(
+            (zlib.crc32(item.encode("utf-8")) for item in items),
+            dtype=np.uint64,
+            count=len(items)
+        )
+        permuted = (self._a * hashes + self._b) & self._mask
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class SimilarityIndex:
+    """
+    In-memory MinHash/LSH index of past queries and their cleaned answers.
+
+    Entries are grouped by namespace (model and prompt version) so an answer
+    is only reused for the same model and prompt. Candidates whose numbers,
+    negation words or content words differ from the query's are never
+    matched (see match_key). The index holds at most max_entries queries and evicts
+    the least recently used one beyond that.
+    """
+
+    def __init__(self, enabled: bool, threshold: float, num_perm: int, bands: int, max_entries: int):
+        if num_perm % bands:
+            raise ValueError("SIMILARITY_NUM_PERM must be a multiple of SIMILARITY_BANDS")
+        self.enabled = enabled
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self._hasher: Optional[MinHasher] = None
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, str, tuple]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[Tuple[str, str]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+
+    @property
+    def hasher(self) -> MinHasher:
+        # Built on first use so numpy is not imported at startup
+        if self._hasher is None:
+            self._hasher = MinHasher(self.num_perm)
+        return self._hasher
+
+    def _band_keys(self, namespace: str, signature: "np.ndarray"):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            yield (namespace, band, chunk.tobytes())
+
+    def add(self, namespace: str, query: str, answer: str):
+        """Insert or refresh one query/answer pair"""
+        if not self.enabled:
+            return
+        entry_id = (namespace, normalize_query(query))
+        if entry_id in self._entries:
+            signature, _answer, key = self._entries[entry_id]
+            self._entries[entry_id] = (signature, answer, key)
+            self._entries.move_to_end(entry_id)
+            return
+        signature = self.hasher.signature(shingles(query))
+        self._entries[entry_id] = (signature, answer, match_key(query))
+        for band_key in self._band_keys(namespace, signature):
+            self._buckets.setdefault(band_key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: Tuple[str, str]):
+        signature = self._entries.pop(entry_id)[0]
+        for band_key in self._band_keys(entry_id[0], signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def lookup(self, namespace: str, query: str) -> Optional[Tuple[str, str, float]]:
+        """Return (matched query, answer, similarity) for the closest entry above the threshold"""
+        if not self.enabled or not self._entries:
+            return None
+        started = time.perf_counter()
+        signature = self.hasher.signature(shingles(query))
+        key = match_key(query)
+        candidates = set()
+        for band_key in self._band_keys(namespace, signature):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        best = None
+        best_score = 0.0
+        for entry_id in candidates:
+            candidate_signature, _answer, candidate_key = self._entries[entry_id]
+            if candidate_key != key:
+                continue
+            score = float((candidate_signature == signature).sum()) / len(signature)
+            if score > best_score:
+                best, best_score = entry_id, score
+        self.lookup_seconds += time.perf_counter() - started
+
+        if best is None or best_score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best)
+        return best[1], self._entries[best][1], best_score
+
+    def discard(self, namespace: str, query: str) -> bool:
+        """Remove one query if it is indexed"""
+        entry_id = (namespace, normalize_query(query))
+        if entry_id not in self._entries:
+            return False
+        self._remove(entry_id)
+        return True
+
+    def clear(self, namespace_prefix: Optional[str] = None) -> int:
+        """Drop every entry, or only those whose namespace starts with the prefix"""
+        if namespace_prefix is None:
+            count = len(self._entries)
+            self._entries.clear()
+            self._buckets.clear()
+            return count
+        doomed = [entry_id for entry_id in self._entries if entry_id[0].startswith(namespace_prefix)]
+        for entry_id in doomed:
+            self._remove(entry_id)
+        return len(doomed)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "buckets": len(self._buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "avg_lookup_ms": round(self.lookup_seconds * 1000 / lookups, 3) if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def namespace(model: str, prompt_version: str) -> str:
+    """Namespace that keeps answers of different models and prompts apart"""
+    return f"{model}\x1f{prompt_version}"
+
+
+similarity_index = SimilarityIndex(
+    enabled=SIMILARITY_ENABLED,
+    threshold=SIMILARITY_THRESHOLD,
+    num_perm=SIMILARITY_NUM_PERM,
+    bands=SIMILARITY_BANDS,
+    max_entries=SIMILARITY_MAX_ENTRIES,
+)
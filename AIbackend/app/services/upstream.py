@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.config import (
+    UPSTREAM_COALESCE,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_HTTP2,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE,
+    UPSTREAM_HEDGE,
+    UPSTREAM_MAX_RETRIES,
+    UPSTREAM_RETRY_DELAY,
+)
+from app.services import backends, metrics, singleflight
+from app.services.backends import Backend, registry
+from app.services.guard import GuardRejected, is_overload
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+coalescer = singleflight.SingleFlight()
+
+
+class UpstreamError(Exception):
+    """Raised when no upstream backend could produce an answer"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared pooled async client, creating it on first use"""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = UPSTREAM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 package not installed, falling back to HTTP/1.1 for upstream calls")
+                http2 = False
+        _client = httpx.AsyncClient(
+            http2=http2,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(30.0, connect=UPSTREAM_CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+async def aclose():
+    """Close the shared client and release pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def warm_connections(timeout: float = UPSTREAM_CONNECT_TIMEOUT) -> int:
+    """
+    Open a pooled connection to each configured backend's host.
+
+    Any response, even a 404 for the bare origin, leaves a keep-alive
+    connection (DNS, TCP and TLS done) in the pool for the first real call.
+    Returns the number of hosts reached.
+    """
+    origins = sorted({
+        f"{url.scheme}://{url.netloc.decode('ascii')}"
+        for url in (httpx.URL(backend.url) for backend in registry.backends if backend.configured)
+    })
+    client = get_client()
+    results = await asyncio.gather(
+        *(client.head(origin, timeout=timeout) for origin in origins), return_exceptions=True
+    )
+    reached = 0
+    for origin, result in zip(origins, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not pre-connect to {origin}: {str(result) or type(result).__name__}")
+        else:
+            reached += 1
+    return reached
+
+
+def configured() -> bool:
+    """Whether any backend has the credentials it needs"""
+    return registry.configured()
+
+
+def capability_of(payload: dict) -> str:
+    return backends.VISION if backends.needs_vision(payload) else backends.TEXT
+
+
+async def post(payload: dict, timeout: float) -> httpx.Response:
+    """Send a single request to the preferred backend without retries"""
+    backend = registry.choose(capability_of(payload))
+    if backend is None:
+        raise UpstreamError("No upstream backend is configured")
+    return await backend.post(get_client(), payload, timeout)
+
+
+def failure_outcome(e: Exception) -> str:
+    """Short label for a failed attempt, used as the metrics status"""
+    if isinstance(e, GuardRejected):
+        return "rejected"
+    if isinstance(e, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(e, httpx.TransportError):
+        return "connection_error"
+    if isinstance(e, httpx.HTTPStatusError):
+        return str(e.response.status_code)
+    return "error"
+
+
+def record_failure(e: Exception, label: str, attempt: int, max_retries: int) -> Optional[UpstreamError]:
+    """Count a failed attempt and classify it"""
+    metrics.upstream_requests.inc(model=label, status=failure_outcome(e))
+    error = classify_failure(e, label, attempt, max_retries)
+    if error is None:
+        metrics.upstream_retries.inc(model=label)
+    return error
+
+
+def classify_failure(e: Exception, label: str, attempt: int, max_retries: int) -> Optional[UpstreamError]:
+    """
+    Decide what to do with a failed attempt.
+
+    Returns None when the attempt should be retried, otherwise the
+    UpstreamError (with a farmer-facing message) to raise. Connection errors,
+    timeouts and 5xx responses are retried; other HTTP errors are not.
+    """
+    last_attempt = attempt >= max_retries - 1
+
+    if isinstance(e, GuardRejected):
+        # Retrying would only add load the guard just refused
+        logger.warning(f"Model {label} not sent upstream: {e.message}")
+        return UpstreamError(e.message, status_code=503, retry_after=e.retry_after)
+
+    if isinstance(e, httpx.TimeoutException):
+        if last_attempt:
+            logger.error(f"Model {label} timed out after {max_retries} attempts: {str(e)}")
+            return UpstreamError(
+                "Request timed out. The AI service is taking too long to respond. Please try again."
+            )
+        logger.warning(f"Timeout for {label}, attempt {attempt + 1}/{max_retries}: {str(e)}")
+        return None
+
+    if isinstance(e, httpx.TransportError):
+        if last_attempt:
+            logger.error(f"Model {label} connection failed after {max_retries} attempts: {str(e)}")
+            return UpstreamError(
+                "Connection error: Unable to reach AI service. Please check your internet connection and try again."
+            )
+        logger.warning(f"Connection error for {label}, attempt {attempt + 1}/{max_retries}: {str(e)}")
+        return None
+
+    if isinstance(e, httpx.HTTPStatusError):
+        status_code = e.response.status_code
+        error_msg = f"API error: {str(e)}"
+        if status_code == 400:
+            try:
+                error_data = e.response.json()
+                error_msg = error_data.get("error", {}).get("message", error_msg)
+            except Exception:
+                pass
+        elif status_code == 401:
+            error_msg = "Authentication failed. Please check your API key."
+        elif status_code == 429:
+            error_msg = "Rate limit exceeded. Please wait a moment and try again."
+        elif status_code >= 500:
+            if not last_attempt:
+                logger.warning(f"Server error for {label}, attempt {attempt + 1}/{max_retries}: {str(e)}")
+                return None
+            error_msg = "AI service is temporarily unavailable. Please try again later."
+
+        logger.warning(f"Model {label} failed: {error_msg}")
+        return UpstreamError(f"Analysis unavailable: {error_msg}", status_code=status_code)
+
+    if last_attempt:
+        logger.error(f"Model {label} error: {str(e)}")
+        return UpstreamError(f"Unexpected error: {str(e)}")
+    logger.warning(f"Unexpected error for {label}, attempt {attempt + 1}/{max_retries}: {str(e)}")
+    return None
+
+
+async def generate_text(
+    payload: dict,
+    timeout: float = 30,
+    label: str = "gemini",
+    max_retries: int = UPSTREAM_MAX_RETRIES,
+    retry_delay: float = UPSTREAM_RETRY_DELAY
+) -> str:
+    """
+    Call the Gemini API and return the answer text.
+
+    Concurrent calls with an identical payload share one upstream call
+    (including its retries) unless UPSTREAM_COALESCE is off.
+    """
+    if not UPSTREAM_COALESCE:
+        return await _generate_text(payload, timeout, label, max_retries, retry_delay)
+    return await coalescer.do(
+        singleflight.payload_key(payload),
+        lambda: _generate_text(payload, timeout, label, max_retries, retry_delay)
+    )
+
+
+async def _generate_text(
+    payload: dict,
+    timeout: float,
+    label: str,
+    max_retries: int,
+    retry_delay: float
+) -> str:
+    """
+    Call the fastest healthy backend without coalescing.
+
+    Failed attempts are retried with exponential backoff as decided by
+    classify_failure, on another capable backend when there is one. Raises
+    UpstreamError once no more attempts are left.
+    """
+    capability = capability_of(payload)
+    tried = set()
+    for attempt in range(max_retries):
+        backend = registry.choose(capability, exclude=tried) or registry.choose(capability)
+        if backend is None:
+            raise UpstreamError(f"Analysis unavailable: no backend can handle {capability} requests")
+        try:
+            answer = await _hedged_call(backend, payload, timeout, label, capability, tried)
+            logger.info(f"Successfully processed {label} response via {backend.name}")
+            return answer
+        except Exception as e:
+            tried.add(backend)
+            error = record_failure(e, label, attempt, max_retries)
+            if error is not None:
+                raise error
+
+        with metrics.span("retry_sleep", label):
+            await asyncio.sleep(retry_delay)
+        retry_delay *= 2  # Exponential backoff
+
+    raise UpstreamError("Analysis unavailable: no attempts were made")
+
+
+async def _call(backend: Backend, payload: dict, timeout: float, label: str, capability: str) -> str:
+    """One request to one backend, feeding its latency and error statistics"""
+    started = time.perf_counter()
+    try:
+        async with backend.guard.slot(label):
+            with metrics.span("upstream", label):
+                response = await backend.post(get_client(), payload, timeout)
+            response.raise_for_status()
+        answer = backend.extract_text(response.json())
+    except asyncio.CancelledError:
+        # A request cancelled after losing a hedge took at least this long; without
+        # the sample a backend that turned slow would keep looking fast
+        elapsed = time.perf_counter() - started
+        stats = backend.stats[capability]
+        if stats.latency is not None and elapsed > stats.latency:
+            stats.observe(elapsed, ok=True)
+        raise
+    except Exception as e:
+        # Bad requests say nothing about the backend's health
+        if is_overload(e):
+            backend.stats[capability].observe(time.perf_counter() - started, ok=False)
+        raise
+    backend.stats[capability].observe(time.perf_counter() - started, ok=True)
+    metrics.upstream_requests.inc(model=label, status=str(response.status_code))
+    return answer
+
+
+async def _hedged_call(
+    backend: Backend,
+    payload: dict,
+    timeout: float,
+    label: str,
+    capability: str,
+    tried: set
+) -> str:
+    """
+    Call `backend`, hedging with the next backend if UPSTREAM_HEDGE is on.
+
+    Once the first request outlives the p95 latency of its backend, the
+    same request goes to the next capable backend; the first answer wins and
+    the other request is cancelled. A hedge only fails when both requests
+    fail, with the error of the last one.
+    """
+    delay = backend.stats[capability].p95() if UPSTREAM_HEDGE else None
+    backup = registry.choose(capability, exclude=tried | {backend}) if delay is not None else None
+    if backup is None or not backup.healthy(capability):
+        return await _call(backend, payload, timeout, label, capability)
+
+    pending = {asyncio.create_task(_call(backend, payload, timeout, label, capability))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+        backends.hedges.inc(model=label, backend=backup.name)
+        logger.info(f"Hedging {label} on {backup.name} after {delay * 1000:.0f}ms on {backend.name}")
+        pending.add(asyncio.create_task(_call(backup, payload, timeout, label, capability)))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                # The caller counts the error it is given; count the one it replaces
+                if error is not None:
+                    metrics.upstream_requests.inc(model=label, status=failure_outcome(error))
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def stream_text(
+    payload: dict,
+    timeout: float = 30,
+    label: str = "gemini",
+    max_retries: int = UPSTREAM_MAX_RETRIES,
+    retry_delay: float = UPSTREAM_RETRY_DELAY
+) -> AsyncIterator[str]:
+    """
+    Stream answer text from the fastest healthy backend as it is generated.
+
+    Failures before the first chunk are retried like generate_text. Once text
+    has been relayed a retry would repeat it, so later failures raise
+    UpstreamError straight away. Streams are not hedged.
+    """
+    capability = capability_of(payload)
+    tried = set()
+    for attempt in range(max_retries):
+        backend = registry.choose(capability, exclude=tried) or registry.choose(capability)
+        if backend is None:
+            raise UpstreamError(f"Analysis unavailable: no backend can handle {capability} requests")
+        started = False
+        attempt_started = time.perf_counter()
+        try:
+            async with backend.guard.slot(label), get_client().stream(
+                "POST", timeout=timeout, **backend.request(payload, stream=True)
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if not data:
+                        continue
+                    text = backend.extract_stream_text(data)
+                    if text:
+                        if not started:
+                            metrics.observe_stage("upstream_first_chunk", time.perf_counter() - attempt_started, label)
+                        started = True
+                        yield text
+            metrics.upstream_requests.inc(model=label, status="200")
+            metrics.observe_stage("upstream_stream", time.perf_counter() - attempt_started, label)
+            logger.info(f"Successfully streamed {label} response via {backend.name}")
+            return
+        except Exception as e:
+            # Only failures are recorded: stream timings are not comparable with whole answers
+            if not started and is_overload(e):
+                backend.stats[capability].observe(time.perf_counter() - attempt_started, ok=False)
+            tried.add(backend)
+            if started:
+                metrics.upstream_requests.inc(model=label, status="interrupted")
+                logger.error(f"Stream for {label} interrupted: {str(e)}")
+                raise UpstreamError("The AI service stopped responding mid-answer. Please try again.")
+            error = record_failure(e, label, attempt, max_retries)
+            if error is not None:
+                raise error
+
+        with metrics.span("retry_sleep", label):
+            await asyncio.sleep(retry_delay)
+        retry_delay *= 2  # Exponential backoff
+
+    raise UpstreamError("Analysis unavailable: no attempts were made")
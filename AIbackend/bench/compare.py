@@ -0,0 +1,73 @@
+"""
+Compare two bench.run result files.
+
+    python -m bench.compare bench/results/base.json bench/results/new.json --threshold 10
+
+Exits with status 1 when throughput drops or p95/p99 latency, loop lag or
+peak memory grows by more than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+
+# (label, path into the result, True when higher is better)
+METRICS = [
+    ("requests/s", ("summary", "requests_per_s"), True),
+    ("errors", ("summary", "errors"), False),
+    ("p50 ms", ("summary", "latency_ms", "p50"), False),
+    ("p95 ms", ("summary", "latency_ms", "p95"), False),
+    ("p99 ms", ("summary", "latency_ms", "p99"), False),
+    ("loop lag p99 ms", ("loop_lag_ms", "p99"), False),
+    ("peak RSS MB", ("memory", "peak_rss_mb"), False),
+]
+# Only these can fail the comparison; error counts and p50 are shown for context
+GATED = {"requests/s", "p95 ms", "p99 ms", "loop lag p99 ms", "peak RSS MB"}
+
+
+def lookup(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """Return (label, base, new, change %, regressed) rows"""
+    rows = []
+    for label, path, higher_is_better in METRICS:
+        old_value, new_value = lookup(base, path), lookup(new, path)
+        change = None
+        regressed = False
+        if isinstance(old_value, (int, float)) and isinstance(new_value, (int, float)) and old_value:
+            change = (new_value - old_value) / old_value * 100
+            worse = -change if higher_is_better else change
+            regressed = label in GATED and worse > threshold
+        rows.append((label, old_value, new_value, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"base {base['meta'].get('commit')} ({base['meta']['workload']})  ->  "
+          f"new {new['meta'].get('commit')} ({new['meta']['workload']})")
+    rows = compare(base, new, args.threshold)
+    for label, old_value, new_value, change, regressed in rows:
+        delta = f"{change:+.1f}%" if change is not None else "n/a"
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {label:<16} {old_value!s:>10} -> {new_value!s:>10}  {delta:>8}{flag}")
+    sys.exit(1 if any(row[4] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
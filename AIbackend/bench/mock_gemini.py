@@ -0,0 +1,222 @@
+"""
+Local stand-in for the Gemini generateContent API.
+
+Answers `:generateContent` and `:streamGenerateContent` calls for any model,
+and OpenAI-style `/v1/chat/completions` calls, with a canned agricultural
+answer after a configurable delay. It can also
+inject random server errors and periodic 429 bursts, so the service's retry,
+guard and cache paths can be exercised without spending API quota.
+
+Run standalone and point the service at it:
+
+    python -m bench.mock_gemini --port 8099 --latency lognormal:800:0.5
+    GEMINI_API_URL=http://127.0.0.1:8099/v1beta/models/gemini-pro:generateContent \\
+        GEMINI_API_KEY=bench uvicorn app.main:app
+
+or register it as an extra OpenAI-compatible backend:
+
+    UPSTREAM_BACKENDS='[{"name": "mock", "type": "openai", "model": "mock",
+        "url": "http://127.0.0.1:8099/v1/chat/completions", "capabilities": ["text", "vision"]}]'
+
+bench.run uses the same app in-process by default.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER = (
+    "For healthy crop growth, test the soil before sowing and apply fertilizer in split doses. "
+    "Water the farm early in the morning to reduce evaporation, watch the leaves for pest damage "
+    "and remove diseased plants quickly. Rotate crops each season to keep the soil fertile and "
+    "improve the next harvest yield."
+)
+
+
+@dataclass
+class MockProfile:
+    """How the mock upstream behaves"""
+    # fixed, uniform, exponential or lognormal
+    latency: str = "lognormal"
+    # Median latency in milliseconds (the mean for exponential)
+    latency_ms: float = 800.0
+    # Spread: +/- fraction for uniform, sigma for lognormal
+    spread: float = 0.5
+    # Fraction of calls failing with a 500
+    error_rate: float = 0.0
+    # Every `burst_every` seconds, answer 429 for `burst_seconds` seconds
+    burst_every: float = 0.0
+    burst_seconds: float = 0.0
+    # Streamed answers are split into this many chunks over the latency
+    stream_chunks: int = 8
+    seed: int = 0
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "MockProfile":
+        """Build a profile from a latency spec such as `lognormal:800:0.5` or `fixed:200`"""
+        parts = spec.split(":")
+        profile = cls(latency=parts[0], **kwargs)
+        if len(parts) > 1:
+            profile.latency_ms = float(parts[1])
+        if len(parts) > 2:
+            profile.spread = float(parts[2])
+        return profile
+
+
+class MockState:
+    """Samples latencies and outcomes for one mock upstream"""
+
+    def __init__(self, profile: MockProfile):
+        self.profile = profile
+        self.random = random.Random(profile.seed)
+        self.started = time.monotonic()
+        self.stats = {"calls": 0, "streamed": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+
+    def latency(self) -> float:
+        p = self.profile
+        base = p.latency_ms / 1000
+        if p.latency == "fixed":
+            return base
+        if p.latency == "uniform":
+            return max(self.random.uniform(base * (1 - p.spread), base * (1 + p.spread)), 0.0)
+        if p.latency == "exponential":
+            return self.random.expovariate(1 / base) if base > 0 else 0.0
+        if p.latency == "lognormal":
+            return self.random.lognormvariate(math.log(base), p.spread) if base > 0 else 0.0
+        raise ValueError(f"Unknown latency distribution: {p.latency}")
+
+    def in_burst(self) -> bool:
+        p = self.profile
+        if p.burst_every <= 0 or p.burst_seconds <= 0:
+            return False
+        # The first burst starts `burst_every` seconds in, after a clean warm-up period
+        return (time.monotonic() - self.started) % p.burst_every >= p.burst_every - p.burst_seconds
+
+    def outcome(self) -> int:
+        """HTTP status of the next call"""
+        self.stats["calls"] += 1
+        if self.in_burst():
+            self.stats["rate_limited"] += 1
+            return 429
+        if self.random.random() < self.profile.error_rate:
+            self.stats["errors"] += 1
+            return 500
+        self.stats["ok"] += 1
+        return 200
+
+
+def _result(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+def _error(status: int) -> JSONResponse:
+    messages = {429: "Resource has been exhausted (mock burst).", 500: "Internal error (mock)."}
+    headers = {"Retry-After": "1"} if status == 429 else None
+    return JSONResponse(
+        {"error": {"code": status, "message": messages.get(status, "Mock error")}},
+        status_code=status,
+        headers=headers,
+    )
+
+
+def create_app(profile: MockProfile) -> FastAPI:
+    """ASGI app serving the mock API with the given behaviour"""
+    app = FastAPI(title="Mock Gemini")
+    state = MockState(profile)
+    app.state.mock = state
+
+    @app.post("/v1beta/models/{target}")
+    async def generate(target: str, request: Request):
+        await request.body()
+        status = state.outcome()
+        delay = state.latency()
+        if status != 200:
+            # Failures come back quickly, like the real quota and server errors
+            await asyncio.sleep(min(delay, 0.05))
+            return _error(status)
+
+        if target.endswith(":streamGenerateContent"):
+            state.stats["streamed"] += 1
+            return StreamingResponse(_stream(delay), media_type="text/event-stream")
+        await asyncio.sleep(delay)
+        return _result(ANSWER)
+
+    async def _chunks(delay: float):
+        words = ANSWER.split(" ")
+        chunks = max(min(profile.stream_chunks, len(words)), 1)
+        size = math.ceil(len(words) / chunks)
+        for i in range(0, len(words), size):
+            await asyncio.sleep(delay / chunks)
+            yield " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+
+    async def _stream(delay: float):
+        async for text in _chunks(delay):
+            yield f"data: {json.dumps(_result(text))}\r\n\r\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        status = state.outcome()
+        delay = state.latency()
+        if status != 200:
+            await asyncio.sleep(min(delay, 0.05))
+            return _error(status)
+
+        if body.get("stream"):
+            state.stats["streamed"] += 1
+            return StreamingResponse(_chat_stream(delay), media_type="text/event-stream")
+        await asyncio.sleep(delay)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}]}
+
+    async def _chat_stream(delay: float):
+        async for text in _chunks(delay):
+            yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': text}}]})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return state.stats
+
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="lognormal:800:0.5",
+                        help="distribution:median_ms[:spread], e.g. fixed:200, uniform:500:0.3, lognormal:800:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="seconds between 429 bursts (0 disables)")
+    parser.add_argument("--burst-seconds", type=float, default=0.0, help="length of each 429 burst")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="chunks per streamed answer")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def profile_from_args(args: argparse.Namespace) -> MockProfile:
+    return MockProfile.from_spec(
+        args.latency,
+        error_rate=args.error_rate,
+        burst_every=args.burst_every,
+        burst_seconds=args.burst_seconds,
+        stream_chunks=args.stream_chunks,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Gemini generateContent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Load test the farmer assistant against a mock Gemini upstream.
+
+By default the service and the mock both run in this process, wired together
+through ASGI transports, so a run needs no network, no API key and no quota:
+
+    python -m bench.run --workload mixed --requests 500 --concurrency 32
+    python -m bench.run --workload text --latency fixed:300 --burst-every 10 --burst-seconds 2
+
+With --base-url the requests go to an already running service instead (start
+it against `python -m bench.mock_gemini`); memory and event-loop lag are then
+those of the load generator, not the service.
+
+Results are written as JSON to bench/results/ and can be compared across
+commits with `python -m bench.compare`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from bench.mock_gemini import add_profile_arguments, create_app, profile_from_args
+from bench.workloads import Workload
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+MOCK_URL = "http://mock-gemini/v1beta/models/gemini-pro:generateContent"
+
+
+def percentiles(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+
+    def at(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 2)
+
+    return {"p50": at(0.5), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1], 2)}
+
+
+def peak_rss_mb():
+    """Process memory high-water mark, where the platform reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).resolve().parent
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task that sleeps for `interval` seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append((loop.time() - started - self.interval) * 1000)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def configure_in_process(args):
+    """Point the service at the in-process mock; must run before the app is imported"""
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("ADMISSION_SERVICE_TOKEN", "bench")
+    os.environ["GEMINI_API_URL"] = MOCK_URL
+    os.environ.pop("GEMINI_STREAM_URL", None)
+    # Keep benchmark answers and jobs out of the real databases
+    data_dir = tempfile.mkdtemp(prefix="farmer-bench-")
+    os.environ.setdefault("CACHE_DB_PATH", os.path.join(data_dir, "cache.sqlite3"))
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(data_dir, "jobs.sqlite3"))
+    if args.cache_off:
+        os.environ["CACHE_ENABLED"] = "false"
+        os.environ["SIMILARITY_ENABLED"] = "false"
+        os.environ["IMAGE_CACHE_ENABLED"] = "false"
+
+
+def identity_headers(index: int) -> dict:
+    """
+    Headers presenting concurrent worker `index` as its own client.
+
+    The service only honours X-Client-Id with the shared service token;
+    without one every request counts as the same peer and quickly hits the
+    per-client queue limit.
+    """
+    token = os.environ.get("ADMISSION_SERVICE_TOKEN")
+    if not token:
+        return {}
+    return {"X-Service-Token": token, "X-Client-Id": f"bench-{index}"}
+
+
+async def send(client: httpx.AsyncClient, spec, identity: Optional[dict] = None) -> tuple:
+    """Send one request and return (status, latency_ms, response bytes)"""
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            spec.path, data=spec.data, files=spec.files, content=spec.content,
+            headers={**spec.headers, **(identity or {})}
+        )
+        status = response.status_code
+        size = len(response.content)
+        # /batch answers 200 up front; failed items only show up in the NDJSON lines
+        if spec.kind == "batch" and status == 200:
+            # Item lines carry status ok/error; the closing summary line has no status
+            failed = sum(1 for line in response.text.splitlines() if line and json.loads(line).get("status") == "error")
+            status = 200 if not failed else 207
+    except httpx.HTTPError as e:
+        status, size = type(e).__name__, 0
+    return status, (time.perf_counter() - started) * 1000, size
+
+
+async def drive(client: httpx.AsyncClient, workload: Workload, args) -> list:
+    """Keep `concurrency` requests in flight until the request count or duration is reached"""
+    records = []
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = {"n": args.requests}
+
+    async def worker(index: int):
+        identity = identity_headers(index)
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif remaining["n"] <= 0:
+                return
+            else:
+                remaining["n"] -= 1
+            spec = workload.next()
+            status, latency, size = await send(client, spec, identity)
+            records.append({"kind": spec.kind, "status": status, "ms": latency, "bytes": size, "items": spec.items})
+
+    await asyncio.gather(*(worker(index) for index in range(args.concurrency)))
+    return records
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    ok = [r for r in records if r["status"] == 200]
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": len(records) - len(ok),
+        "requests_per_s": round(len(records) / elapsed, 2) if elapsed else None,
+        "items_per_s": round(sum(r["items"] for r in ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles([r["ms"] for r in records]),
+        "ok_latency_ms": percentiles([r["ms"] for r in ok]),
+        "status": {str(k): v for k, v in sorted(Counter(str(r["status"]) for r in records).items())},
+        "bytes_received": sum(r["bytes"] for r in records),
+    }
+
+
+async def run(args) -> dict:
+    workload = Workload(args.workload, seed=args.seed, images=args.images, batch_size=args.batch_size)
+    profile = profile_from_args(args)
+    mock_app = None
+    service_app = None
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    else:
+        configure_in_process(args)
+        from app.main import app as service_app
+        from app.services import upstream
+
+        mock_app = create_app(profile)
+        upstream._client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=mock_app),
+            headers={"Content-Type": "application/json"},
+            timeout=httpx.Timeout(30.0),
+        )
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=service_app), base_url="http://service", timeout=args.timeout
+        )
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    monitor = LoopLagMonitor()
+    async with client:
+        if service_app is not None:
+            lifespan = service_app.router.lifespan_context(service_app)
+            await lifespan.__aenter__()
+        try:
+            monitor.start()
+            started = time.perf_counter()
+            records = await drive(client, workload, args)
+            elapsed = time.perf_counter() - started
+            await monitor.stop()
+            health = (await client.get("/api/v1/farmer-assistant/health")).json()
+        finally:
+            if service_app is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    by_kind = {}
+    for kind in sorted({r["kind"] for r in records}):
+        by_kind[kind] = summarize([r for r in records if r["kind"] == kind], elapsed)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "label": args.label,
+            "workload": args.workload,
+            "target": args.base_url or "in-process",
+            "concurrency": args.concurrency,
+            "requests": args.requests if not args.duration else None,
+            "duration_s": args.duration,
+            "batch_size": args.batch_size if args.workload == "batch" else None,
+            "cache_off": args.cache_off,
+            "mock": None if args.base_url else vars(profile),
+            "python": platform.python_version(),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "summary": summarize(records, elapsed),
+        "by_kind": by_kind,
+        "loop_lag_ms": percentiles(monitor.samples),
+        "memory": {
+            "scope": "load generator" if args.base_url else "service and load generator",
+            "peak_rss_mb": peak_rss_mb(),
+            "tracemalloc_peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if args.tracemalloc else None,
+        },
+        "upstream_mock": mock_app.state.mock.stats if mock_app is not None else None,
+        "service_health": health.get("backends"),
+    }
+
+
+def print_report(result: dict):
+    summary = result["summary"]
+    print(f"\n{result['meta']['workload']} @ concurrency {result['meta']['concurrency']} "
+          f"({result['meta']['target']}, commit {result['meta']['commit']})")
+    print(f"  {summary['requests']} requests in {result['elapsed_s']}s -> {summary['requests_per_s']} req/s, "
+          f"{summary['errors']} errors {summary['status']}")
+    rows = [("all", summary)] + list(result["by_kind"].items())
+    for name, stats in rows:
+        lat = stats["latency_ms"]
+        print(f"  {name:<12} p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  max {lat['max']}ms")
+    lag = result["loop_lag_ms"]
+    print(f"  event-loop lag p50 {lag['p50']}ms  p99 {lag['p99']}ms  max {lag['max']}ms")
+    print(f"  peak RSS {result['memory']['peak_rss_mb']} MB ({result['memory']['scope']})")
+    if result["upstream_mock"]:
+        print(f"  mock upstream {result['upstream_mock']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Farmer assistant load test against a mock Gemini upstream")
+    parser.add_argument("--workload", choices=Workload.KINDS, default="mixed")
+    parser.add_argument("--requests", type=int, default=200, help="total requests to send")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests kept in flight")
+    parser.add_argument("--batch-size", type=int, default=20, help="questions per /batch request")
+    parser.add_argument("--images", type=int, default=8, help="distinct images in image workloads")
+    parser.add_argument("--cache-off", action="store_true", help="disable the answer caches (in-process only)")
+    parser.add_argument("--base-url", help="benchmark a running service instead of an in-process one")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--label", help="free-form tag stored with the results")
+    parser.add_argument("--out", help="results file (default bench/results/<workload>-<time>.json)")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / (
+        f"{args.workload}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    print(f"  results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Scripted traffic against /api/v1/farmer-assistant/*"""
+import io
+import json
+import random
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+PREFIX = "/api/v1/farmer-assistant"
+
+CROPS = ["wheat", "rice", "cotton", "sugarcane", "tomato", "onion", "soybean", "maize"]
+PROBLEMS = [
+    "yellow leaves", "white flies", "leaf curl", "stem borer attack",
+    "poor germination", "fruit rot", "wilting plants", "low yield",
+]
+SEASONS = ["kharif", "rabi", "summer", "monsoon"]
+TEMPLATES = [
+    "My {crop} crop has {problem} this {season}, what should I do?",
+    "Which fertilizer helps {crop} with {problem} during {season}?",
+    "How to control {problem} in {crop} farming in the {season} season?",
+]
+
+
+@dataclass
+class RequestSpec:
+    """One HTTP request of a workload"""
+    kind: str
+    path: str
+    data: Optional[dict] = None
+    files: Optional[dict] = None
+    content: Optional[bytes] = None
+    headers: dict = field(default_factory=dict)
+    # Number of questions carried, more than one for /batch
+    items: int = 1
+
+
+def make_images(count: int, seed: int = 0, size=(1600, 1200)) -> List[bytes]:
+    """Distinct phone-camera sized JPEGs, so the image cache does not collapse them into one"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pattern = (rng.random((12, 16, 3)) * 255).astype("uint8")
+        buffer = io.BytesIO()
+        Image.fromarray(pattern).resize(size, Image.BILINEAR).save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+class Workload:
+    """
+    Produces the requests of one traffic mix.
+
+    text, stream, image and batch send a single kind of request; mixed
+    interleaves text, streamed text, image-only and image-plus-question
+    requests in roughly the proportions the app sends them.
+    """
+
+    KINDS = ("text", "stream", "image", "mixed", "batch")
+    MIX = [("text", 0.5), ("image_query", 0.2), ("image", 0.2), ("stream", 0.1)]
+
+    def __init__(self, kind: str, seed: int = 0, images: int = 8, batch_size: int = 20):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown workload {kind!r}, expected one of {', '.join(self.KINDS)}")
+        self.kind = kind
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.images = make_images(images, seed) if kind in ("image", "mixed") else []
+
+    def question(self) -> str:
+        return self.random.choice(TEMPLATES).format(
+            crop=self.random.choice(CROPS),
+            problem=self.random.choice(PROBLEMS),
+            season=self.random.choice(SEASONS),
+        )
+
+    def image(self) -> bytes:
+        return self.random.choice(self.images)
+
+    def next(self) -> RequestSpec:
+        kind = self.kind
+        if kind == "mixed":
+            kind = self.random.choices([k for k, _ in self.MIX], weights=[w for _, w in self.MIX])[0]
+
+        if kind == "text":
+            return RequestSpec(kind, f"{PREFIX}/text-query", data={"query": self.question()})
+        if kind == "stream":
+            return RequestSpec(kind, f"{PREFIX}/text-query/stream", data={"query": self.question()})
+        if kind == "image":
+            return RequestSpec(kind, f"{PREFIX}/analyze", files={"image": ("field.jpg", self.image(), "image/jpeg")})
+        if kind == "image_query":
+            return RequestSpec(
+                kind, f"{PREFIX}/analyze",
+                data={"query": self.question()},
+                files={"image": ("field.jpg", self.image(), "image/jpeg")},
+            )
+        lines = [json.dumps({"id": str(i), "query": self.question()}) for i in range(self.batch_size)]
+        return RequestSpec(
+            kind, f"{PREFIX}/batch",
+            content=("\n".join(lines) + "\n").encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+            items=self.batch_size,
+        )
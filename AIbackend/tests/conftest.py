@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Keep the SQLite files of the imported singletons out of the working tree
+_data_dir = tempfile.mkdtemp(prefix="farmer-tests-")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(_data_dir, "response_cache.sqlite3"))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_data_dir, "jobs.sqlite3"))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
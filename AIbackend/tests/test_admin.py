@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routers import admin
+from app.services.knowledge import knowledge_index
+
+client = TestClient(app)
+DOC = {"question": "urea dose for wheat", "answer": "Spray 5 litres of monocrotophos", "tags": []}
+
+
+def test_admin_api_is_disabled_without_a_token(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+    response = client.put("/api/v1/admin/knowledge/fake-dose", json=DOC)
+    assert response.status_code == 403
+    assert client.get("/api/v1/admin/cache").status_code == 403
+    assert "fake-dose" not in {match.doc.doc_id for match in knowledge_index.search("urea dose for wheat").matches}
+
+
+def test_admin_api_requires_the_configured_token(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/api/v1/admin/sessions").status_code == 403
+    assert client.get("/api/v1/admin/sessions", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/api/v1/admin/sessions", headers={"X-Admin-Token": "s3cret"}).status_code == 200
@@ -0,0 +1,89 @@
+from app.services import admission
+from app.services.admission import FairQueue, Principal, principal_from
+
+CLAIMED = {"x-client-id": "device-42", "x-user-role": "expert"}
+
+
+def test_identity_headers_are_ignored_without_the_service_token(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_SERVICE_TOKEN", "s3cret")
+    assert principal_from(CLAIMED, "10.0.0.7") == Principal("10.0.0.7", admission.ADMISSION_DEFAULT_ROLE)
+    forged = {**CLAIMED, "x-service-token": "guess"}
+    assert principal_from(forged, "10.0.0.7") == Principal("10.0.0.7", admission.ADMISSION_DEFAULT_ROLE)
+
+
+def test_identity_headers_are_ignored_when_no_token_is_configured(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_SERVICE_TOKEN", None)
+    headers = {**CLAIMED, "x-service-token": ""}
+    assert principal_from(headers, "10.0.0.7") == Principal("10.0.0.7", admission.ADMISSION_DEFAULT_ROLE)
+
+
+def test_trusted_caller_sets_client_and_role(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_SERVICE_TOKEN", "s3cret")
+    trusted = {**CLAIMED, "x-service-token": "s3cret"}
+    assert principal_from(trusted, "10.0.0.7") == Principal("device-42", "expert")
+    unknown_role = {**trusted, "x-user-role": "superuser"}
+    assert principal_from(unknown_role, "10.0.0.7").role == admission.ADMISSION_DEFAULT_ROLE
+
+
+FARMER = Principal("f1", "farmer")
+CRP = Principal("c1", "crp")
+
+
+def drain(queue: FairQueue) -> list:
+    order = []
+    while queue:
+        order.append(queue.pop())
+    return order
+
+
+def test_roles_share_turns_in_proportion_to_their_weights():
+    queue = FairQueue({"farmer": 2, "crp": 1}, max_depth=0, max_per_client=0)
+    for i in range(6):
+        queue.push(f"crp-{i}", CRP)
+    for i in range(6):
+        queue.push(f"farmer-{i}", FARMER)
+    first_six = [name.split("-")[0] for name in drain(queue)[:6]]
+    assert first_six.count("farmer") == 4
+    assert first_six.count("crp") == 2
+
+
+def test_clients_of_a_role_take_turns():
+    queue = FairQueue({"crp": 1}, max_depth=0, max_per_client=0)
+    for i in range(3):
+        queue.push(f"bulk-{i}", Principal("bulk", "crp"))
+    queue.push("other-0", Principal("other", "crp"))
+    assert drain(queue) == ["bulk-0", "other-0", "bulk-1", "bulk-2"]
+
+
+def test_idle_role_does_not_cash_in_its_absence():
+    queue = FairQueue({"farmer": 1, "crp": 1}, max_depth=0, max_per_client=0)
+    for i in range(10):
+        queue.push(f"farmer-{i}", FARMER)
+        queue.pop()
+    for i in range(4):
+        queue.push(f"farmer-{i}", FARMER)
+        queue.push(f"crp-{i}", CRP)
+    roles = [name.split("-")[0] for name in drain(queue)]
+    # Equal weights alternate instead of serving the returning role four times in a row
+    assert roles[:4].count("crp") == 2
+
+
+def test_depth_limits_refuse_new_waiters():
+    queue = FairQueue({"farmer": 1, "crp": 1}, max_depth=3, max_per_client=2)
+    queue.push("a", FARMER)
+    queue.push("b", FARMER)
+    assert queue.refusal(FARMER) == "client_limit"
+    assert queue.refusal(CRP) is None
+    queue.push("c", CRP)
+    assert queue.refusal(Principal("c2", "crp")) == "queue_full"
+
+
+def test_discarded_waiter_is_not_served():
+    queue = FairQueue({"farmer": 1}, max_depth=0, max_per_client=0)
+    queue.push("a", FARMER)
+    queue.push("b", FARMER)
+    queue.discard("a", FARMER)
+    queue.discard("a", FARMER)  # already gone: no-op
+    assert len(queue) == 1
+    assert drain(queue) == ["b"]
+    assert queue.depth_by_role() == {}
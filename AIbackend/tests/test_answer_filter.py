@@ -0,0 +1,52 @@
+import pytest
+
+from app.services import answer_filter
+from app.services.answer_filter import ResponseRules
+
+KEYWORDS = ["crop", "soil", "फसल"]
+REPLACEMENTS = {
+    "I'm not sure": "Please consult your local agricultural officer,",
+    "I'm not": "I am not",
+    "As an AI": "As your farming assistant",
+    "AI model": "assistant",
+}
+
+
+@pytest.fixture(params=["automaton", "substring"])
+def rules(request, monkeypatch):
+    if request.param == "substring":
+        monkeypatch.setattr(answer_filter, "ahocorasick", None)
+    elif answer_filter.ahocorasick is None:
+        pytest.skip("pyahocorasick not installed")
+    return ResponseRules(KEYWORDS, REPLACEMENTS)
+
+
+def test_relevance(rules):
+    assert rules.check_and_clean("Rotate the CROP every season") == "Rotate the CROP every season"
+    assert rules.check_and_clean("इस फसल के लिए") is not None
+    assert rules.check_and_clean("Here is a cake recipe") is None
+
+
+def test_rewrites_are_leftmost_longest(rules):
+    text = "I'm not sure about the soil. I'm not a chemist. As an AI model I advise crop rotation."
+    assert rules.clean(text) == (
+        "Please consult your local agricultural officer, about the soil. I am not a chemist. "
+        "As your farming assistant model I advise crop rotation."
+    )
+
+
+def test_rewrite_split_across_stream_chunks(rules):
+    text = "As an AI I suggest testing the soil. I'm not sure of the dose."
+    expected = rules.check_and_clean(text)
+    for size in (1, 3, 7, len(text)):
+        stream = rules.stream()
+        sent = "".join(stream.feed(text[i:i + size]) for i in range(0, len(text), size))
+        sent += stream.finish()
+        assert sent == expected
+        assert stream.answer == expected
+
+
+def test_stream_holds_everything_until_relevant(rules):
+    stream = rules.stream()
+    assert stream.feed("Hello there, " * 5) == ""
+    assert stream.finish() is None
@@ -0,0 +1,26 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_items_manifest_can_be_sent_as_a_file():
+    manifest = json.dumps([{"id": "a", "mode": "text"}]).encode()
+    response = client.post("/api/v1/farmer-assistant/batch", files={"items": ("items.json", manifest, "application/json")})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["status"] == "error"
+    assert lines[0]["detail"] == "Either image or text query must be provided"
+    assert lines[-1]["summary"]["failed"] == 1
+
+
+def test_invalid_items_manifest_is_a_client_error():
+    response = client.post("/api/v1/farmer-assistant/batch", files={"items": ("items.json", b"[{", "application/json")})
+    assert response.status_code == 400
+    response = client.post("/api/v1/farmer-assistant/batch", files={"items": ("items.json", b"\xff\xfe\x00", "application/json")})
+    assert response.status_code == 400
+    response = client.post("/api/v1/farmer-assistant/batch", files={"items": (None, "not json")})
+    assert response.status_code == 400
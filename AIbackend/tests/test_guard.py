@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.services.guard import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    AIMDLimiter,
+    CircuitBreaker,
+    GuardRejected,
+    TokenBucket,
+    UpstreamGuard,
+)
+
+
+def make_breaker(cooldown: float = 0.05, probes: int = 1) -> CircuitBreaker:
+    return CircuitBreaker(threshold=0.5, window=4, min_calls=2, cooldown=cooldown, probes=probes)
+
+
+def test_breaker_opens_at_the_failure_threshold():
+    breaker = make_breaker()
+    breaker.record(False)
+    assert breaker.state == CLOSED  # fewer than min_calls outcomes
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.cooling_down()
+    assert 0 < breaker.retry_after() <= 0.05
+
+
+def test_breaker_half_opens_after_cooldown_and_closes_on_success():
+    breaker = make_breaker(probes=1)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert not breaker.cooling_down()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.failure_rate() == 0.0
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = make_breaker()
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.opened_count == 2
+
+
+def test_released_probe_slot_can_be_reused():
+    breaker = make_breaker()
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_token_bucket_refuses_when_the_wait_is_too_long():
+    async def scenario():
+        bucket = TokenBucket(rate=1, burst=1)
+        await bucket.acquire(max_wait=0)
+        with pytest.raises(GuardRejected) as rejected:
+            await bucket.acquire(max_wait=0.1)
+        return rejected.value.retry_after
+
+    assert asyncio.run(scenario()) > 0.5
+
+
+def test_limiter_grows_on_success_and_backs_off_on_overload():
+    limiter = AIMDLimiter(initial=4, minimum=2, maximum=5)
+    limiter.in_flight = 1
+    limiter.release(overloaded=False)
+    assert limiter.limit == pytest.approx(4.25)
+    limiter.in_flight = 1
+    limiter.release(overloaded=True)
+    assert limiter.limit == pytest.approx(4.25 * 0.7)
+    for _ in range(10):
+        limiter.in_flight = 1
+        limiter.release(overloaded=True)
+    assert limiter.limit == 2
+
+
+def test_cancelled_waiter_leaves_the_queue_and_leaks_no_slot():
+    async def scenario():
+        limiter = AIMDLimiter(initial=1, minimum=1, maximum=4)
+        await limiter.acquire(1)
+        waiter = asyncio.create_task(limiter.acquire(1))
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.queued == 0
+        limiter.release(overloaded=False, adjust=False)
+        return limiter.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_slot_handed_over_to_a_cancelled_waiter_is_not_lost():
+    async def scenario():
+        limiter = AIMDLimiter(initial=1, minimum=1, maximum=4)
+        await limiter.acquire(1)
+        waiter = asyncio.create_task(limiter.acquire(1))
+        await asyncio.sleep(0)
+        # Hand the slot over, then cancel the waiter before it resumes
+        limiter.release(overloaded=False, adjust=False)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            return limiter.in_flight
+        # The waiter kept the slot it was given; it must give it back as usual
+        limiter.release(overloaded=False, adjust=False)
+        return limiter.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_waiter_times_out_with_a_rejection():
+    async def scenario():
+        limiter = AIMDLimiter(initial=1, minimum=1, maximum=4)
+        await limiter.acquire(1)
+        with pytest.raises(GuardRejected):
+            await limiter.acquire(0.01)
+        return limiter.queued, limiter.in_flight
+
+    assert asyncio.run(scenario()) == (0, 1)
+
+
+def make_guard() -> UpstreamGuard:
+    guard = UpstreamGuard()
+    guard.breaker = make_breaker()
+    guard.bucket = TokenBucket(rate=0, burst=1)
+    guard.limiter = AIMDLimiter(initial=1, minimum=1, maximum=4)
+    return guard
+
+
+def test_cancelled_call_releases_its_slot_without_judging_the_upstream():
+    async def scenario():
+        guard = make_guard()
+
+        async def call():
+            async with guard.slot("test"):
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(call())
+        await asyncio.sleep(0.01)
+        assert guard.limiter.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return guard
+
+    guard = asyncio.run(scenario())
+    assert guard.limiter.in_flight == 0
+    assert guard.limiter.limit == 1
+    assert guard.breaker.failure_rate() == 0.0
+
+
+def test_overloaded_calls_open_the_breaker_and_then_fail_fast():
+    async def scenario():
+        guard = make_guard()
+        overloaded = httpx.HTTPStatusError(
+            "503", request=httpx.Request("POST", "http://upstream"), response=httpx.Response(503)
+        )
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                async with guard.slot("test"):
+                    raise overloaded
+        with pytest.raises(GuardRejected) as rejected:
+            async with guard.slot("test"):
+                pass
+        return guard, rejected.value
+
+    guard, rejected = asyncio.run(scenario())
+    assert guard.breaker.state == OPEN
+    assert rejected.retry_after > 0
+    assert guard.limiter.in_flight == 0
@@ -0,0 +1,81 @@
+import base64
+import io
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.services import ingest, metrics
+from app.services.ingest import IngestError, process_image
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (30, 160, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def png_noise(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_image_over_pixel_cap_is_refused_before_decoding(monkeypatch):
+    monkeypatch.setattr(ingest, "IMAGE_MAX_PIXELS", 100 * 100)
+    with pytest.raises(IngestError) as error:
+        process_image(png(101, 100))
+    assert error.value.status_code == 413
+
+
+def test_image_within_pixel_cap_is_processed(monkeypatch):
+    monkeypatch.setattr(ingest, "IMAGE_MAX_PIXELS", 100 * 100)
+    result = process_image(png(100, 100))
+    assert (result.width, result.height) == (100, 100)
+
+
+def test_garbage_is_an_invalid_image():
+    with pytest.raises(IngestError) as error:
+        process_image(b"not an image")
+    assert error.value.status_code == 400
+
+
+def test_exif_rotated_image_is_sent_upright_without_metadata():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display
+    exif[0x8825] = {2: (12.0, 58.0, 0.0)}  # GPS latitude
+    buffer = io.BytesIO()
+    # Low quality so the re-encode is not smaller than the original
+    Image.frombytes("RGB", (600, 400), os.urandom(600 * 400 * 3)).save(buffer, "JPEG", quality=20, exif=exif)
+    content = buffer.getvalue()
+
+    result = process_image(content)
+    payload = base64.b64decode(result.encoded)
+    assert payload != content
+    sent = Image.open(io.BytesIO(payload))
+    assert sent.size == (result.width, result.height) == (400, 600)
+    assert not sent.getexif()
+    assert "exif" not in sent.info
+
+
+def test_plain_image_is_forwarded_when_reencoding_does_not_help():
+    content = png(40, 30)
+    result = process_image(content)
+    assert base64.b64decode(result.encoded) == content
+
+
+def test_processing_stages_reach_the_request_trace():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.post("/ingest")
+    async def ingest_body(request: Request):
+        await ingest.ingest_bytes(await request.body())
+        return {}
+
+    # Random pixels so the upload is not served from the ingest memo
+    response = TestClient(app).post("/ingest", content=png_noise(64, 48))
+    stages = {entry.split(";")[0].strip() for entry in response.headers["server-timing"].split(",")}
+    assert {"image_process", "image_decode", "image_hash", "image_encode", "base64"} <= stages
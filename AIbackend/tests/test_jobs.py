@@ -0,0 +1,122 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.services import jobs
+from app.services.jobs import DONE, QUEUED, RUNNING, JobError, JobQueue
+
+
+def test_job_interrupted_by_restart_runs_after_restart(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hanging_runner(inputs):
+            started.set()
+            await asyncio.sleep(3600)
+
+        first = JobQueue(db_path, ttl=3600, workers=1, max_queued=10)
+        await first.start(hanging_runner)
+        job = await first.submit("key", {"query": "wheat"}, priority=1)
+        await asyncio.wait_for(started.wait(), 5)
+        assert (await first.get(job["job_id"]))["status"] == RUNNING
+        await first.stop()
+        first.close()
+
+        async def runner(inputs):
+            return {"answer": inputs["query"]}
+
+        second = JobQueue(db_path, ttl=3600, workers=1, max_queued=10)
+        await second.start(runner)
+        finished = await second.get(job["job_id"], wait=5)
+        resubmitted = await second.submit("key", {"query": "wheat"}, priority=1)
+        await second.stop()
+        second.close()
+        return finished, resubmitted
+
+    finished, resubmitted = asyncio.run(scenario())
+    assert finished["status"] == DONE
+    assert finished["result"] == {"answer": "wheat"}
+    assert resubmitted["deduplicated"] and resubmitted["status"] == DONE
+
+
+def test_stale_running_job_is_requeued_while_serving(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(jobs, "_RECOVER_INTERVAL", 0.05)
+
+    async def scenario():
+        async def runner(inputs):
+            return {"answer": "ok"}
+
+        queue = JobQueue(db_path, ttl=3600, workers=1, max_queued=10)
+        await queue.start(runner)
+        # A job left running by a process that died without releasing it
+        await asyncio.to_thread(queue.store.create, "orphan", "orphan-key", 1, '{"query": "rice"}')
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated_at = 0 WHERE id = 'orphan'", (RUNNING,))
+        job = await queue.get("orphan", wait=5)
+        await queue.stop()
+        queue.close()
+        return job
+
+    assert asyncio.run(scenario())["status"] == DONE
+
+
+def test_release_only_touches_running_jobs(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), ttl=3600)
+    store.create("a", "key", 1, "{}")
+    store.release("a")
+    assert store.get("a")["status"] == QUEUED
+    assert store.claim("a") == "{}"
+    store.release("a")
+    assert store.get("a")["status"] == QUEUED
+    store.finish("a", "{}", None)
+    store.release("a")
+    assert store.get("a")["status"] == DONE
+    store.close()
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.1.2.3/hook",
+    "http://192.168.0.10/hook",
+    "http://[::1]/hook",
+    "http://0.0.0.0/hook",
+    "ftp://example.com/hook",
+])
+def test_callbacks_to_non_public_addresses_are_refused(url):
+    with pytest.raises(JobError):
+        asyncio.run(jobs.check_callback_url(url))
+
+
+def test_public_and_allowlisted_callbacks_are_accepted(monkeypatch):
+    assert asyncio.run(jobs.check_callback_url("https://8.8.8.8/hook")) == "https://8.8.8.8/hook"
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_ALLOWED_HOSTS", {"localhost"})
+    assert asyncio.run(jobs.check_callback_url("http://localhost:5000/hook")) == "http://localhost:5000/hook"
+    with pytest.raises(JobError):
+        asyncio.run(jobs.check_callback_url("https://8.8.8.8/hook"))
+
+
+def test_slow_callbacks_do_not_hold_workers(tmp_path, monkeypatch):
+    async def never_answers(self, job_id, urls):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(JobQueue, "_notify", never_answers)
+
+    async def scenario():
+        async def runner(inputs):
+            return {"answer": inputs["query"]}
+
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), ttl=3600, workers=1, max_queued=10)
+        await queue.start(runner)
+        first = await queue.submit("a", {"query": "wheat"}, priority=1, callback_url="https://8.8.8.8/a")
+        second = await queue.submit("b", {"query": "rice"}, priority=1, callback_url="https://8.8.8.8/b")
+        results = [await queue.get(job["job_id"], wait=5) for job in (first, second)]
+        await queue.stop()
+        queue.close()
+        return results
+
+    assert [job["status"] for job in asyncio.run(scenario())] == [DONE, DONE]
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from app.services import probes, upstream
+from app.services.guard import CircuitBreaker, OPEN
+from app.services.probes import CachedProbe
+
+
+def open_breaker(cooldown: float) -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=0.5, window=4, min_calls=2, cooldown=cooldown, probes=1)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_readiness_recovers_once_the_breaker_cooldown_has_passed(monkeypatch):
+    backend = upstream.registry.backends[0]
+    monkeypatch.setattr(backend.guard, "breaker", open_breaker(cooldown=0.05))
+    monkeypatch.setattr(probes.warmup, "steps", {"modules": {"status": probes.DONE}})
+
+    ready, checks = probes.readiness()
+    assert not ready and not checks["upstream_available"]
+
+    time.sleep(0.06)
+    # Nothing has called the upstream, so the breaker itself is still open
+    assert backend.guard.breaker.state == OPEN
+    ready, checks = probes.readiness()
+    assert ready and checks["upstream_available"]
+
+
+def test_readiness_waits_for_warmup(monkeypatch):
+    monkeypatch.setattr(probes.warmup, "steps", {"modules": {"status": probes.RUNNING}})
+    ready, checks = probes.readiness()
+    assert not ready and not checks["warmup"]
+
+
+def test_cached_probe_calls_the_upstream_once_per_interval():
+    calls = []
+
+    async def check():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"status": "success" if len(calls) == 1 else "error", "message": "checked"}
+
+    async def scenario():
+        probe = CachedProbe(check, ttl=0.1, retry_interval=0.05)
+        concurrent = await asyncio.gather(*(probe.result() for _ in range(5)))
+        cached = await probe.result()
+        await asyncio.sleep(0.11)
+        failed = await probe.result()
+        failed_again = await probe.result()
+        return concurrent, cached, failed, failed_again
+
+    concurrent, cached, failed, failed_again = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert all(result["status"] == "success" and not reused for result, reused in concurrent)
+    assert cached[1] is True
+    assert failed[0]["status"] == "error" and failed[1] is False
+    assert failed_again[1] is True
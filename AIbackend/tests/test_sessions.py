@@ -0,0 +1,58 @@
+import asyncio
+
+from app.routers import farmerAssistant
+from app.routers.farmerAssistant import CACHE_BYPASS, CACHE_MISS, MODEL_TIMEOUT_MESSAGE
+from app.services.sessions import SessionStore, session_store
+
+
+def make_store(**overrides) -> SessionStore:
+    settings = dict(enabled=True, max_sessions=10, ttl=3600, recent_turns=2, max_summaries=4,
+                    answer_chars=600, token_budget=800)
+    settings.update(overrides)
+    return SessionStore(**settings)
+
+
+def test_older_turns_are_compacted_into_summaries():
+    store = make_store()
+    for i in range(4):
+        store.record("farmer-1", f"question {i}", f"Answer {i}. More detail follows.")
+    context = store.context("farmer-1", "next question")
+    assert "Farmer: question 3" in context and "Farmer: question 2" in context
+    assert "question 0 -> Answer 0." in context
+    assert "More detail follows" not in context.split("Earlier in this conversation:")[1].split("Farmer:")[0]
+
+
+def test_context_fits_the_token_budget():
+    store = make_store(token_budget=60)
+    store.record("farmer-1", "old question", "x" * 400)
+    store.record("farmer-1", "recent question", "short answer")
+    context = store.context("farmer-1", "new question")
+    assert "recent question" in context
+    assert "x" * 100 not in context
+
+
+def test_least_recently_used_session_is_evicted():
+    store = make_store(max_sessions=2)
+    for session_id in ("a", "b", "c"):
+        store.record(session_id, "question", "answer")
+    assert store.context("a", "q") is None
+    assert store.context("c", "q") is not None
+    assert store.evicted["lru"] == 1
+
+
+def test_timed_out_model_is_not_remembered(monkeypatch):
+    async def run_model(model_name, supports_vision, text_input, image, history):
+        if not supports_vision:
+            await asyncio.sleep(10)
+        return "Water the wheat crop every week.", CACHE_MISS
+
+    monkeypatch.setattr(farmerAssistant, "run_model", run_model)
+    monkeypatch.setattr(farmerAssistant, "ANALYZE_TEXT_DEADLINE", 0.05)
+    result = asyncio.run(farmerAssistant.analysis_result("how often to water wheat", None, "timeout-farmer"))
+
+    text_model = next(name for name, _model, vision in farmerAssistant.MODELS if not vision)
+    assert result.responses[text_model] == MODEL_TIMEOUT_MESSAGE
+    assert result.cache[text_model] == CACHE_BYPASS
+    context = session_store.context("timeout-farmer", "next")
+    assert "Water the wheat crop every week." in context
+    assert "timed out" not in context
@@ -0,0 +1,71 @@
+import pytest
+
+from app.services.similarity import SimilarityIndex, content_words, exact_features, shingles
+
+
+def make_index() -> SimilarityIndex:
+    return SimilarityIndex(enabled=True, threshold=0.8, num_perm=64, bands=16, max_entries=100)
+
+
+def test_near_duplicate_with_typo_matches():
+    index = make_index()
+    index.add("ns", "how do I irrigate my wheat crop", "answer")
+    match = index.lookup("ns", "how do i irigate my wheat crop")
+    assert match is not None
+    assert match[1] == "answer"
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("how many kg of urea should I apply for 10 acres of paddy",
+     "how many kg of urea should I apply for 100 acres of paddy"),
+    ("dose of urea for 2 acre rice", "dose of urea for 5 acre rice"),
+    ("is it safe to spray monocrotophos on vegetables before harvest",
+     "is it not safe to spray monocrotophos on vegetables before harvest"),
+    ("can I use neem oil on tomato", "can't I use neem oil on tomato"),
+])
+def test_different_numbers_or_negation_never_match(stored, asked):
+    index = make_index()
+    index.add("ns", stored, "stored answer")
+    assert index.lookup("ns", asked) is None
+    assert index.lookup("ns", stored) is not None
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("is urea better than dap", "is dap better than urea"),
+    ("brown plant hopper in rice", "brown plant hopper in cotton"),
+    ("how much urea to apply before transplanting", "how much urea to apply after transplanting"),
+    ("how much water does chickpea need at flowering stage",
+     "how much water does chickpea need at podding stage"),
+])
+def test_different_subject_stage_or_order_never_match(stored, asked):
+    index = make_index()
+    index.add("ns", stored, "stored answer")
+    assert index.lookup("ns", asked) is None
+    assert index.lookup("ns", stored) is not None
+
+
+def test_shingles_depend_on_word_order():
+    assert shingles("urea better than dap") != shingles("dap better than urea")
+
+
+def test_content_words():
+    assert content_words("Aphids on tomatoes before flowering") == ("aphid", "tomato", "before", "flowering")
+    assert content_words("how do I irrigate my crop") == ()
+
+
+def test_same_numbers_still_match():
+    index = make_index()
+    index.add("ns", "dose of urea for 2 acre rice", "answer")
+    assert index.lookup("ns", "dose of urea for 2 acres rice") is not None
+
+
+def test_exact_features():
+    assert exact_features("Is it NOT safe for 2.5 acres?") == frozenset({"not", "2.5"})
+    assert exact_features("don't spray 2,5 litres") == frozenset({"dont", "2.5"})
+    assert exact_features("how to grow wheat") == frozenset()
+
+
+def test_namespaces_are_separate():
+    index = make_index()
+    index.add("a", "how do I irrigate my wheat crop", "answer")
+    assert index.lookup("b", "how do I irrigate my wheat crop") is None
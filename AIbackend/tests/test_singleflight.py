@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight, payload_key
+
+
+def test_payload_key_ignores_key_order():
+    assert payload_key({"a": 1, "b": [1, 2]}) == payload_key({"b": [1, 2], "a": 1})
+    assert payload_key({"a": 1}) != payload_key({"a": 2})
+
+
+def test_concurrent_calls_share_one_result():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", factory) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "started": 1, "merged": 4, "abandoned": 0}
+
+
+def test_failure_is_shared_and_not_cached():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        again = await flight.do("key", lambda: asyncio.sleep(0, result="recovered"))
+        return results, again
+
+    results, again = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert again == "recovered"
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("key", lambda: asyncio.sleep(0.05, result="answer")))
+        second = asyncio.create_task(flight.do("key", lambda: asyncio.sleep(0.05, result="other")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, flight.abandoned
+
+    assert asyncio.run(scenario()) == ("answer", 0)
+
+
+def test_shared_call_is_cancelled_when_nobody_waits():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def scenario():
+        flight = SingleFlight()
+        waiter = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert cancelled == [1]
+    assert flight.abandoned == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_caller_arriving_after_the_last_waiter_cancelled_starts_a_new_call():
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            # Cancellation takes a while to finish, as an upstream call would
+            await asyncio.shield(asyncio.sleep(0.02))
+
+    async def scenario():
+        flight = SingleFlight()
+        waiter = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        result = await flight.do("key", lambda: asyncio.sleep(0, result="fresh"))
+        return flight, result
+
+    flight, result = asyncio.run(scenario())
+    assert result == "fresh"
+    assert flight.started == 2
+    assert flight.merged == 0
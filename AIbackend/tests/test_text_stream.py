@@ -0,0 +1,30 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routers import farmerAssistant
+from app.services import upstream
+
+client = TestClient(app)
+
+
+def events(body: str) -> list:
+    return [block.split("\n")[0].removeprefix("event: ") for block in body.strip().split("\n\n")]
+
+
+def test_stream_ends_with_an_error_when_the_budget_runs_out(monkeypatch):
+    async def stalled(payload, timeout=30, label="gemini", **kwargs):
+        yield "Water the "
+        await asyncio.sleep(10)
+        yield "field."
+
+    monkeypatch.setattr(upstream, "stream_text", stalled)
+    monkeypatch.setattr(farmerAssistant, "ANALYZE_TOTAL_BUDGET", 0.2)
+    response = client.post(
+        "/api/v1/farmer-assistant/text-query/stream",
+        data={"query": "zq budget probe xv stalled upstream"},
+    )
+    assert response.status_code == 200
+    assert events(response.text)[-2:] == ["error", "end"]
+    assert farmerAssistant.MODEL_TIMEOUT_MESSAGE in response.text